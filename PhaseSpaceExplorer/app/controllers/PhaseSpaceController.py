@@ -1,4 +1,4 @@
-from PySide6.QtCore import QObject, Signal
+from PySide6.QtCore import QObject, QTimer, Signal
 
 class PhaseSpaceController(QObject):
     # Dicts for development only!
@@ -8,7 +8,89 @@ class PhaseSpaceController(QObject):
     parameters_changed = Signal(dict)
     trajectory_added = Signal(dict)
     trajectory_integrated = Signal(dict)
+    trajectory_chunk_integrated = Signal(dict)
     labels_changed = Signal(dict)
+    # Search box from initial states, passed back with parameters attached
+    soe_search_requested = Signal(dict)
+    soe_search_sent = Signal(dict)
+    # Separatrices of SoE rows, requested like SoE search, with `branches`
+    # of backend.manifolds when computed, no branches to hide them
+    manifolds_requested = Signal(dict)
+    manifolds_sent = Signal(dict)
+    manifolds_computed = Signal(dict)
+    # Instrumentation, emitted with `stats` after every dispatch
+    requests_dispatched = Signal(dict)
     
     def __init__(self):
-        super().__init__()
\ No newline at end of file
+        super().__init__()
+
+        # Integration requests are not passed on at once, requests coming
+        # within `_dispatch_delay` ms are merged and dispatched together:
+        # one latest request per row, or all rows if parameters changed
+        self._pending_rows:dict[int, dict] = {}
+        self._pending_parameters:dict | None = None
+        self._dispatch_delay:int = 20
+        self._dispatch_timer = QTimer(self)
+        self._dispatch_timer.setSingleShot(True)
+        self._dispatch_timer.setInterval(self._dispatch_delay)
+        self._dispatch_timer.timeout.connect(self.dispatch_requests)
+
+        self._requests_received:int = 0
+        self._requests_dispatched:int = 0
+        self._max_queue_depth:int = 0
+        return
+    
+    @property
+    def queue_depth(self) -> int:
+        # Rows waiting for dispatch, parameter change counts as one
+        return len(self._pending_rows) + (self._pending_parameters is not None)
+    
+    @property
+    def stats(self) -> dict:
+        return {"received":self._requests_received,
+                "dispatched":self._requests_dispatched,
+                "queue_depth":self.queue_depth,
+                "max_queue_depth":self._max_queue_depth,
+                "coalescing_ratio":self._requests_received/self._requests_dispatched
+                if self._requests_dispatched else 0.0}
+    
+    def _request_received(self):
+        self._requests_received += 1
+        self._max_queue_depth = max(self._max_queue_depth, self.queue_depth)
+        if not self._dispatch_timer.isActive():
+            self._dispatch_timer.start()
+        return
+    
+    def request_integration(self, signal_data:dict):
+        # Row n with parameters attached, latest request of the row wins
+        n = signal_data["n"]
+        merged = signal_data.copy()
+        previous = self._pending_rows.get(n)
+        # Only t_end changed only if it is so for all merged requests
+        if previous is not None and previous.get("field") != merged.get("field"):
+            merged.pop("field", None)
+        self._pending_rows[n] = merged
+        self._request_received()
+        return
+    
+    def request_parameters_change(self, signal_data:dict):
+        # All rows are integrated again anyway, so pending rows are dropped
+        self._pending_rows.clear()
+        self._pending_parameters = signal_data
+        self._request_received()
+        return
+    
+    def dispatch_requests(self):
+        # Parameter change integrates all rows, including ones
+        # requested after it, as their data is already in the table
+        if self._pending_parameters is not None:
+            self.parameters_changed.emit(self._pending_parameters)
+        elif self._pending_rows:
+            signal_data = {"requests":list(self._pending_rows.values())}
+            self.parameters_to_integrate_sent.emit(signal_data)
+        self._requests_dispatched += 1
+
+        self._pending_rows = {}
+        self._pending_parameters = None
+        self.requests_dispatched.emit(self.stats)
+        return
@@ -1,4 +1,4 @@
-from PySide6.QtWidgets import QMainWindow, QMdiArea, QMdiSubWindow
+from PySide6.QtWidgets import QMainWindow, QMdiArea, QMdiSubWindow, QFileDialog
 
 from app.controllers.PhaseSpaceController import PhaseSpaceController
 from app.controllers.MainController import MainController
@@ -9,12 +9,14 @@ from app.widgets.FolderSelector import FolderSelector
 
 from backend.DynamicalSystem import DynamicalSystem
 from backend.DSLoaderFromPy import DSLoaderFromPy
+from backend.Session import Session
 
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self._main_controller = MainController()
+        self.ds = None
         self.setup_ui()
         self.connect_controller()
         return
@@ -28,6 +30,13 @@ class MainWindow(QMainWindow):
         self.setCentralWidget(self.mdi)
 
         self.setup_DsChooser()
+        self.setup_menu()
+        return
+
+    def setup_menu(self):
+        file_menu = self.menuBar().addMenu("File")
+        file_menu.addAction("Save session...", self.handle_save_session)
+        file_menu.addAction("Load session...", self.handle_load_session)
         return
     
     def connect_controller(self):
@@ -54,6 +63,7 @@ class MainWindow(QMainWindow):
         ops = QMdiSubWindow()
         ops.setGeometry(0, 0, 500, 200)
         ops_widget = ODEsParametersWidget(self.ds, self.ps_controller)
+        self.ops_widget = ops_widget
         ops.setWidget(ops_widget)
         ops.setWindowTitle("ODEs Parameters")
         self.mdi.addSubWindow(ops)
@@ -63,6 +73,7 @@ class MainWindow(QMainWindow):
         iss = QMdiSubWindow()
         iss.setGeometry(500, 0, 1000, 200)
         iss_widget = InitialStateWidget(self.ds, self.ps_controller)
+        self.iss_widget = iss_widget
         iss.setWidget(iss_widget)
         iss.setWindowTitle("Initial States")
         self.mdi.addSubWindow(iss)
@@ -79,11 +90,60 @@ class MainWindow(QMainWindow):
         return
     
     def handle_ds_folder_selected(self, folderpath:str):
+        self.load_ds(folderpath)
+        self.mdi.removeSubWindow(self.ds_chooser)
+        self.setup_PhaseSpaceWorkbench()
+        return
+
+    def load_ds(self, folderpath:str):
         self.ds = DynamicalSystem()
         loader = DSLoaderFromPy(folderpath)
         loader.load_DS()
+        loader.compile_DS()
         self.ds.load(loader)
         print(self.ds)
-        self.mdi.removeSubWindow(self.ds_chooser)
+        return
+
+    def handle_save_session(self):
+        if self.ds is None:
+            return
+        filepath, _ = QFileDialog.getSaveFileName(
+            self, "Save session", "", "Session (*.npz)")
+        if filepath:
+            self.save_session(filepath)
+        return
+
+    def handle_load_session(self):
+        filepath, _ = QFileDialog.getOpenFileName(
+            self, "Load session", "", "Session (*.npz)")
+        if filepath:
+            self.load_session(filepath)
+        return
+
+    def save_session(self, filepath:str):
+        session = Session()
+        session.ds_folderpath = self.ds.folderpath
+        session.ds_file_hash = self.ds.file_hash
+        session.parameter_values = self.ops_widget.parameter_values
+        self.iss_widget.save_to_session(session)
+        session.save(filepath, self.iss_widget.trajectories())
+        return
+
+    def load_session(self, filepath:str):
+        session = Session()
+        session.load(filepath)
+
+        # Workbench of the current dynamical system is replaced
+        if self.ds is not None:
+            self.iss_widget.shutdown()
+            for window in self.mdi.subWindowList():
+                self.mdi.removeSubWindow(window)
+                window.deleteLater()
+        else:
+            self.mdi.removeSubWindow(self.ds_chooser)
+        self.load_ds(session.ds_folderpath)
         self.setup_PhaseSpaceWorkbench()
-        return
\ No newline at end of file
+
+        self.ops_widget.set_parameter_values(session.parameter_values)
+        self.iss_widget.load_from_session(session)
+        return
@@ -76,13 +76,16 @@ class InitialStateTable(QTableWidget):
                 self.takeItem(row, col)
         return
     
-    def add_row(self, row_type):
+    def add_row(self, row_type, data:dict|None = None):
+        # data from get_data of a row, e.g. of a saved session
         self.setRowCount(self.rowCount()+1)
 
         if row_type == "Dragpoint":
             new_row = RowDataDragpoint(
                 len(self._variable_names), 
                 self._available_row_types)
+            if data is not None:
+                new_row.set_data(data)
             self._rows.append(new_row)
             new_row.add_to_table(self, self.rowCount()-1)
 
@@ -90,6 +93,8 @@ class InitialStateTable(QTableWidget):
             new_row = RowDataSoE(
                 len(self._variable_names), 
                 self._available_row_types)
+            if data is not None:
+                new_row.set_data(data)
             self._rows.append(new_row)
             new_row.add_to_table(self, self.rowCount()-1)
         return
@@ -206,13 +211,14 @@ class InitialStateTable(QTableWidget):
         self._rows[n].t_end = new_value
         field.setText(str(new_value))
 
+        # Only t_end changed, so trajectory can be extended or truncated
         _type = self.get_row_type(n)
-        signal_data = {"n":n, "type":_type}
+        signal_data = {"n":n, "type":_type, "field":"t_end"}
         self._controller.data_changed.emit(signal_data)
         return
     
     def handle_t_steps_changed(self, n):
-        field = self._rows[n].t_steps
+        field = self._rows[n].t_steps_field
         prev_value = self._rows[n].t_steps
 
         try:
@@ -220,6 +226,10 @@ class InitialStateTable(QTableWidget):
         except:
             field.setText(str(prev_value))
             return
+        # At least both ends of time span are sampled
+        if new_value < 2:
+            field.setText(str(prev_value))
+            return
         self._rows[n].t_steps = new_value
         field.setText(str(new_value))
 
@@ -259,7 +269,7 @@ class InitialStateTable(QTableWidget):
         return
     
     def handle_eig_N_changed(self, n):
-        field = self._rows[n].eig_N
+        field = self._rows[n].eig_N_field
         prev_value = self._rows[n].eig_N
 
         try:
@@ -276,7 +286,7 @@ class InitialStateTable(QTableWidget):
         return
     
     def handle_eig_dir_changed(self, n, index_combo):
-        self._rows[n].dt = ("+", "-")[index_combo] # TODO refactor ("+", "-")
+        self._rows[n].eig_dir = ("+", "-")[index_combo] # TODO refactor ("+", "-")
 
         _type = self.get_row_type(n)
         signal_data = {"n":n, "type":_type}
@@ -287,6 +297,9 @@ class InitialStateTable(QTableWidget):
 ###############################################################################
 
 class RowDataDragpoint():
+    # Data saved in session, see get_data
+    _data_fields = ("show", "dt", "t_start", "t_end", "t_steps")
+
     def __init__(self, N_variables, available_types):
         self.N_variables = N_variables
         self.available_types = available_types
@@ -308,6 +321,19 @@ class RowDataDragpoint():
         self.t_end_field = None
         self.t_steps_field = None
         return
+
+    def get_data(self) -> dict:
+        data = {field:getattr(self, field) for field in self._data_fields}
+        data["type"] = self.type
+        data["variables"] = [float(value) for value in self.variables]
+        return data
+
+    def set_data(self, data:dict):
+        # Set before add_to_table, fields show the data
+        for field in self._data_fields:
+            setattr(self, field, data[field])
+        self.variables = np.array(data["variables"], dtype=float)
+        return
     
     def add_to_table(self, table:InitialStateTable, n:int):
         self.type_field = QComboBox()
@@ -329,6 +355,7 @@ class RowDataDragpoint():
             self.variables_fields[i] = field
 
         self.show_field = QCheckBox() # TODO how to fucking set the state to checked
+        self.show_field.setChecked(self.show)
         self.show_field.stateChanged.connect(
             lambda state, n=n: 
             table.handle_show_change(state, n))
@@ -336,7 +363,7 @@ class RowDataDragpoint():
 
         self.dt_field = QComboBox()
         self.dt_field.addItems(("+", "-"))
-        self.dt_field.setCurrentIndex(0)
+        self.dt_field.setCurrentIndex(("+", "-").index(self.dt))
         self.dt_field.currentIndexChanged.connect(
             lambda index_combobox, n=n:
             table.handle_dt_changed(n, index_combobox))
@@ -368,6 +395,10 @@ class RowDataDragpoint():
 ###############################################################################
 
 class RowDataSoE():
+    # Data saved in session, see get_data
+    _data_fields = ("show", "autocorrect", "dt", "eps", "eig_N", "eig_dir",
+                    "t_start", "t_end", "t_steps")
+
     def __init__(self, N_variables, available_types):
         self.N_variables = N_variables
         self.available_types = available_types
@@ -398,6 +429,19 @@ class RowDataSoE():
         self.t_end_field = None
         self.t_steps_field = None
         return
+
+    def get_data(self) -> dict:
+        data = {field:getattr(self, field) for field in self._data_fields}
+        data["type"] = self.type
+        data["variables"] = [float(value) for value in self.variables]
+        return data
+
+    def set_data(self, data:dict):
+        # Set before add_to_table, fields show the data
+        for field in self._data_fields:
+            setattr(self, field, data[field])
+        self.variables = np.array(data["variables"], dtype=float)
+        return
     
     def add_to_table(self, table, n):
         self.type_field = QComboBox()
@@ -419,6 +463,7 @@ class RowDataSoE():
             self.variables_fields[i] = field
 
         self.show_field = QCheckBox() # TODO how to fucking set the state to checked
+        self.show_field.setChecked(self.show)
         self.show_field.stateChanged.connect(
             lambda state, n=n: 
             table.handle_show_change(state, n))
@@ -431,6 +476,7 @@ class RowDataSoE():
         table.setCellWidget(n, self.N_variables+2, self.correct_field)
 
         self.autocorrect_field = QCheckBox()
+        self.autocorrect_field.setChecked(self.autocorrect)
         self.autocorrect_field.stateChanged.connect(
             lambda state, n=n: 
             table.handle_autocorrect_change(state, n))
@@ -438,7 +484,7 @@ class RowDataSoE():
 
         self.dt_field = QComboBox()
         self.dt_field.addItems(("+", "-"))
-        self.dt_field.setCurrentIndex(0)
+        self.dt_field.setCurrentIndex(("+", "-").index(self.dt))
         self.dt_field.currentIndexChanged.connect(
             lambda index_combobox, n=n:
             table.handle_dt_changed(n, index_combobox))
@@ -460,7 +506,7 @@ class RowDataSoE():
 
         self.eig_dir_field = QComboBox()
         self.eig_dir_field.addItems(("+", "-"))
-        self.eig_dir_field.setCurrentIndex(0)
+        self.eig_dir_field.setCurrentIndex(("+", "-").index(self.eig_dir))
         self.eig_dir_field.currentIndexChanged.connect(
             lambda index_combobox, n=n:
             table.handle_eig_dir_changed(n, index_combobox))
@@ -1,18 +1,47 @@
-from copy import deepcopy
+from concurrent.futures import Future
+from copy import copy, deepcopy
+from os.path import join
 
 import numpy as np
+from PySide6.QtCore import QThreadPool
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QPushButton, QTableWidget, QHBoxLayout, 
     QComboBox, QLineEdit, QCheckBox)
 
 from app.controllers.PhaseSpaceController import PhaseSpaceController
 from app.widgets.InitialStateTable import InitialStateTable, RowDataDragpoint, RowDataSoE
+from app.workers.IntegrationWorker import IntegrationWorker, IntegrationWorkerSignals
 from backend.DynamicalSystem import DynamicalSystem
 from backend.Trajectory import Trajectory
+from backend.TrajectoryEnsemble import TrajectoryEnsemble
+from backend.TrajectoryPool import TrajectoryPool
+from backend.TrajectoryCache import TrajectoryCache
+from backend.TrajectoryStore import TrajectoryStore, evict_stores, stores_folderpath
+from backend.Linearization import Linearization
+from backend.Session import Session
+from backend.equilibria import find_equilibria, unique_points
+from backend.manifolds import compute_manifolds
 
 class InitialStateWidget(QWidget):
     _initial_state_type_options:list[str] = ["Dragpoint", "Tmp"]
     _dt_options:list[str] = ["+", "-"]
+    _execution_mode_options:list[str] = ["Threads", "Processes"]
+    # Methods of solve_ivp, implicit ones for stiff systems
+    _alg_options:list[str] = ["RK45", "DOP853", "Radau", "BDF", "LSODA"]
+    # Displayed name -> sampling mode of Trajectory.integrate_scipy
+    _sampling_options:dict[str, str] = {"Solver steps":"solver",
+                                        "Uniform t_steps":"uniform"}
+    # Rows with this many t_steps or more are integrated to disk
+    _store_min_t_steps:int = 10**6
+    # Their stores take at most this much disk, least recently used
+    # ones are removed first
+    _stores_max_bytes:int = 16*2**30
+    # Default box of SoE search, the same for all non periodic variables
+    _soe_box:tuple[float, float] = (-10.0, 10.0)
+    _soe_N_seeds:int = 1000
+    # Separatrices run this long from SoE, forward and backward
+    _manifold_t_end:float = 20.0
+    _manifold_t_steps:int = 2000
     def __init__(self, ds:DynamicalSystem, 
                  controller:PhaseSpaceController):
         super().__init__()
@@ -22,6 +51,29 @@ class InitialStateWidget(QWidget):
 
         self._trajectories:list[Trajectory] = []
 
+        # Integration runs in worker threads or processes, only the latest
+        # job of every row is kept, results of older ones are discarded
+        self._execution_mode:str = self._execution_mode_options[0]
+        self._thread_pool = QThreadPool(self)
+        self._process_pool = TrajectoryPool(self._ds)
+        self._process_signals = IntegrationWorkerSignals()
+        self._next_job_id:int = 0
+        self._row_jobs:dict[int, int] = {}
+        self._workers:dict[int, IntegrationWorker | Future] = {}
+        self._alg:str = self._alg_options[0]
+        self._sampling:str = "solver"
+        # Trajectories are only displayed, float32 is enough for that
+        self._dtype:str = "float64"
+
+        # Processed trajectories by content, see TrajectoryCache.make_key
+        self._cache = TrajectoryCache()
+        # Eigenpairs at SoE, edits of eps or eigenvector fields reuse them
+        self._linearization = Linearization(self._ds.ODEs)
+        # Separatrices are recomputed while shown, only the latest job counts
+        self._show_manifolds:bool = False
+        self._manifolds_job:int = 0
+        self._manifolds_worker:IntegrationWorker | None = None
+
         self.setup_ui()
         self.connect_controller()
         return
@@ -37,9 +89,41 @@ class InitialStateWidget(QWidget):
         add_row_button = QPushButton("Add Row")
         add_row_button.clicked.connect(self.add_row)
         button_layout.addWidget(add_row_button)
-        # Add placeholder button
-        other_button = QPushButton("Other Button")
-        button_layout.addWidget(other_button)
+        # Choose where rows are integrated
+        self.execution_mode_combobox = QComboBox()
+        self.execution_mode_combobox.addItems(self._execution_mode_options)
+        self.execution_mode_combobox.currentTextChanged.connect(
+            self.handle_execution_mode_changed)
+        button_layout.addWidget(self.execution_mode_combobox)
+        # Choose method of solve_ivp
+        self.alg_combobox = QComboBox()
+        self.alg_combobox.addItems(self._alg_options)
+        self.alg_combobox.currentTextChanged.connect(self.handle_alg_changed)
+        button_layout.addWidget(self.alg_combobox)
+        # Choose which samples of solutions are kept
+        self.sampling_combobox = QComboBox()
+        self.sampling_combobox.addItems(list(self._sampling_options.keys()))
+        self.sampling_combobox.currentTextChanged.connect(
+            self.handle_sampling_changed)
+        button_layout.addWidget(self.sampling_combobox)
+        # Keep solutions in float32 to fit more rows in memory
+        self.float32_checkbox = QCheckBox("float32")
+        self.float32_checkbox.stateChanged.connect(
+            self.handle_float32_changed)
+        button_layout.addWidget(self.float32_checkbox)
+        # Find all SoE in a box and add rows for them
+        find_soe_button = QPushButton("Find SoE")
+        find_soe_button.clicked.connect(self.handle_find_soe)
+        button_layout.addWidget(find_soe_button)
+        self.soe_box_field = QLineEdit()
+        self.soe_box_field.setPlaceholderText(
+            f"{self._soe_box[0]}, {self._soe_box[1]}")
+        button_layout.addWidget(self.soe_box_field)
+        # Stable and unstable manifolds of all saddle SoE rows
+        self.manifolds_checkbox = QCheckBox("Separatrices")
+        self.manifolds_checkbox.stateChanged.connect(
+            self.handle_manifolds_changed)
+        button_layout.addWidget(self.manifolds_checkbox)
         layout.addLayout(button_layout)
 
         # Setup Initial State table
@@ -48,59 +132,567 @@ class InitialStateWidget(QWidget):
         return
     
     def add_row(self):
-        self.table.add_row("Dragpoint")
+        self.add_row_with_data("Dragpoint")
+        return
+
+    def add_row_with_data(self, row_type:str, data:dict|None = None):
+        self.table.add_row(row_type, data)
         self._trajectories.append(Trajectory(self._ds.ODEs, np.zeros(self._N_variables)))
 
         signal_data = {"n":self.table.rowCount()-1}
         self._controller.trajectory_added.emit(signal_data)
         return
+
+    def save_to_session(self, session:Session):
+        session.settings = {"execution_mode":self._execution_mode,
+                            "alg":self._alg,
+                            "sampling":self._sampling,
+                            "dtype":self._dtype}
+        session.rows = [self.table.get_row(n).get_data()
+                        for n in range(self.table.rowCount())]
+        return
+
+    def load_from_session(self, session:Session):
+        # Settings first, so that rows request trajectories with saved settings
+        sampling_texts = {mode:text for (text, mode) in self._sampling_options.items()}
+        self.execution_mode_combobox.setCurrentText(session.settings["execution_mode"])
+        self.alg_combobox.setCurrentText(session.settings.get("alg", self._alg_options[0]))
+        self.sampling_combobox.setCurrentText(sampling_texts[session.settings["sampling"]])
+        self.float32_checkbox.setChecked(session.settings["dtype"] == "float32")
+
+        # Trajectories of a changed dynamical system are integrated again
+        same_ds = (session.ds_file_hash == self._ds.file_hash)
+        for (n, data) in enumerate(session.rows):
+            self.add_row_with_data(data["type"], data)
+            trajectory = session.trajectory(n, self._ds.ODEs, self._ds.jacobian) \
+                if same_ds else None
+            if trajectory is None:
+                continue
+            # Integration of the added row is requested through controller
+            # and dispatched later, by then its trajectory is in cache.
+            # It is cached by its own settings, so a trajectory saved before
+            # it was complete, or with other settings, is integrated again.
+            # Its arrays are mapped from session file and read once drawn.
+            key = TrajectoryCache.trajectory_key(self._ds.file_hash, trajectory)
+            self._cache.put(key, trajectory)
+        return
+
+    def trajectories(self) -> list[Trajectory | None]:
+        # Trajectories of rows, None if row is not integrated yet
+        return [trajectory if trajectory.y_sols is not None else None
+                for trajectory in self._trajectories]
     
     def connect_controller(self):
         self._controller.parameters_to_integrate_sent.connect(self.handle_initial_state_changed_step2)
         self._controller.trajectory_added.connect(self.integrate)
         self._controller.parameters_changed.connect(self.handle_parameters_changed)
         self._controller.labels_changed.connect(self.handle_labels_changed)
+        self._controller.soe_search_sent.connect(self.handle_soe_search_sent)
+        self._controller.manifolds_sent.connect(self.handle_manifolds_sent)
+        self._process_signals.finished.connect(self.handle_job_finished)
+        return
+
+    def shutdown(self):
+        # Widget is removed, its jobs and worker processes are not needed
+        for worker in self._workers.values():
+            worker.cancel()
+        self.cancel_manifolds_job()
+        self._workers.clear()
+        self._row_jobs.clear()
+        self._process_pool.shutdown()
+        return
+
+    def handle_execution_mode_changed(self, mode:str):
+        self._execution_mode = mode
         return
     
+    def handle_alg_changed(self, alg:str):
+        self._alg = alg
+        self.integrate_all()
+        return
+
+    def handle_sampling_changed(self, text:str):
+        self._sampling = self._sampling_options[text]
+        self.integrate_all()
+        return
+
+    def integrate_all(self):
+        # Solutions of all rows change, integrate them again
+        for n in range(self.table.rowCount()):
+            signal_data = {"n":n, "type":self.table.get_row_type(n)}
+            self._controller.data_changed.emit(signal_data)
+        return
+
+    def handle_float32_changed(self, state):
+        # Already integrated trajectories are kept as they are
+        self._dtype = "float32" if (state==2) else "float64"
+        return
+
     def integrate(self, signal_data):
         self._controller.data_changed.emit(signal_data)
         return
     
+    def register_job(self, ns:list[int]) -> int:
+        job_id = self._next_job_id
+        self._next_job_id += 1
+        for n in ns:
+            self._row_jobs[n] = job_id
+
+        # Cancel jobs that have no rows left to integrate
+        active_jobs = set(self._row_jobs.values())
+        for (old_job_id, worker) in list(self._workers.items()):
+            if old_job_id not in active_jobs:
+                worker.cancel()
+        return job_id
+
+    def initial_state(self, n:int, parameter_values) -> np.ndarray:
+        # SoE rows start eps away from SoE along the chosen eigenvector
+        row_data = self.table.get_row(n)
+        initial_state = row_data.variables.copy()
+        if row_data.type != "SoE" or not (0 <= row_data.eig_N < self._N_variables):
+            return initial_state
+
+        eigenvectors = self._linearization.eigen(initial_state, parameter_values)[1]
+        direction = eigenvectors[:, row_data.eig_N].real
+        if not np.linalg.norm(direction) > 0:
+            direction = eigenvectors[:, row_data.eig_N].imag
+        sign = 1.0 if row_data.eig_dir == "+" else -1.0
+        return initial_state + sign*row_data.eps*direction/np.linalg.norm(direction)
+
+    def cache_key(self, n:int, parameter_values, integration:str) -> str:
+        # Integration is the mode of Trajectory the row is integrated in,
+        # see INTEGRATION_MODES
+        return TrajectoryCache.make_key(
+            self._ds.file_hash, parameter_values,
+            self.initial_state(n, parameter_values), *self.time_span(n),
+            alg=self._alg, sampling=self._sampling, dtype=self._dtype,
+            integration=integration)
+
+    def emit_cached(self, ns:list[int], keys:list[str], parameter_values) -> list[int]:
+        # Emit cached trajectories right away, return rows to integrate
+        missed = []
+        for (n, key) in zip(ns, keys):
+            trajectory = self._cache.get(key)
+            if trajectory is None:
+                missed.append(n)
+                continue
+            if trajectory.ODEs is None:
+                trajectory.ODEs = self._ds.ODEs
+                trajectory.jacobian = self._ds.jacobian
+
+            # Supersede jobs still running for this row
+            self.register_job([n,])
+            del self._row_jobs[n]
+
+            self._trajectories[n] = trajectory
+            signal_data = {"n":n, "parameter_values":parameter_values,
+                           "trajectory":trajectory}
+            self._controller.trajectory_integrated.emit(signal_data)
+        return missed
+
+    def start_job(self, ns:list[int], job, parameter_values, keys:list[str]):
+        job_id = self.register_job(ns)
+        signal_data = {"ns":ns, "job_id":job_id, "keys":keys,
+                       "parameter_values":parameter_values}
+        worker = IntegrationWorker(job, signal_data)
+        worker.signals.finished.connect(self.handle_job_finished)
+        worker.signals.progress.connect(self.handle_job_progress)
+        self._workers[job_id] = worker
+        self._thread_pool.start(worker)
+        return
+
+    def start_process_job(self, n:int, initial_state, parameter_values,
+                          t_start, t_end, t_steps, key:str):
+        job_id = self.register_job([n,])
+        signal_data = {"ns":[n,], "job_id":job_id, "keys":[key,],
+                       "parameter_values":parameter_values}
+        future = self._process_pool.submit(
+            initial_state, parameter_values, t_start, t_end, t_steps,
+            alg=self._alg, sampling=self._sampling, dtype=self._dtype)
+        self._workers[job_id] = future
+        future.add_done_callback(
+            lambda future, signal_data=signal_data:
+            self.process_job_done(future, signal_data))
+        return
+
+    def process_job_done(self, future:Future, signal_data):
+        # Called from executor thread, result is passed
+        # to the GUI thread through a queued signal
+        signal_data["cancelled"] = future.cancelled()
+        signal_data["error"] = None
+        if not future.cancelled():
+            signal_data["error"] = future.exception()
+        if not signal_data["cancelled"] and signal_data["error"] is None:
+            signal_data["result"] = [future.result(),]
+        self._process_signals.finished.emit(signal_data)
+        return
+
+    def time_span(self, n:int) -> tuple:
+        row_data = self.table.get_row(n)
+        t_start, t_end = row_data.t_start, row_data.t_end
+        if row_data.dt == "-":
+            t_start, t_end = t_end, t_start
+        return (t_start, t_end, row_data.t_steps)
+
+    def handle_job_finished(self, signal_data):
+        job_id = signal_data["job_id"]
+        self._workers.pop(job_id, None)
+
+        if signal_data["cancelled"]:
+            return
+        if signal_data["error"] is not None:
+            print(f"Integration failed: {signal_data['error']}")
+            return
+
+        # Stale results are still valid to cache
+        for (key, trajectory) in zip(signal_data["keys"], signal_data["result"]):
+            if key is not None:
+                self._cache.put(key, trajectory)
+
+        for (n, trajectory) in zip(signal_data["ns"], signal_data["result"]):
+            # Newer job for this row was started, drop stale result
+            if self._row_jobs.get(n) != job_id:
+                continue
+            del self._row_jobs[n]
+            self._trajectories[n] = trajectory
+            new_signal_data = {"n":n,
+                               "parameter_values":signal_data["parameter_values"],
+                               "trajectory":trajectory}
+            self._controller.trajectory_integrated.emit(new_signal_data)
+        return
+
+    def handle_job_progress(self, signal_data):
+        # Partial results are pairs of trajectory integrated so far
+        # and index of its first segment changed since the previous one
+        job_id = signal_data["job_id"]
+        for (n, (trajectory, i_changed)) in zip(signal_data["ns"],
+                                                signal_data["result"]):
+            if self._row_jobs.get(n) != job_id:
+                continue
+            self._trajectories[n] = trajectory
+            new_signal_data = {"n":n,
+                               "parameter_values":signal_data["parameter_values"],
+                               "trajectory":trajectory,
+                               "i_changed":i_changed}
+            self._controller.trajectory_chunk_integrated.emit(new_signal_data)
+        return
+
     def handle_initial_state_changed_step2(self, signal_data):
         # NOTE that at this point initial state should be either:
         # - unchanged (in case of parameter change)
         # - updated (in case of initial state change)
         # so initial state should not be changed here
+        # Requests of rows are merged by controller, one per row
+        requests = signal_data["requests"]
+        self.show_soe_stability([request["n"] for request in requests],
+                                requests[-1]["parameter_values"])
+        if len(requests) == 1:
+            self.integrate_row(requests[0])
+            return
+
+        # Rows with only t_end changed are extended one by one,
+        # the others are integrated together
+        ns = []
+        for request in requests:
+            if request.get("field") == "t_end":
+                self.integrate_row(request)
+            else:
+                ns.append(request["n"])
+        if ns:
+            parameter_values = requests[-1]["parameter_values"].copy()
+            self.integrate_rows(ns, parameter_values)
+        return
+
+    def integrate_row(self, signal_data):
         n = signal_data["n"]
-        parameter_values = signal_data["parameter_values"]
+        parameter_values = signal_data["parameter_values"].copy()
 
-        row_data = self.table.get_row(n)
-        trajectory:Trajectory = self._trajectories[n]
-        trajectory.init_state = row_data.variables
+        # Processes integrate rows at once, threads in chunks
+        integration = "single" if self._execution_mode == "Processes" \
+            else "chunks"
+        key = self.cache_key(n, parameter_values, integration)
+        if not self.emit_cached([n,], [key,], parameter_values):
+            return
 
-        t_start, t_end = row_data.t_start, row_data.t_end
-        if row_data.dt == "-":
-            t_start, t_end = t_end, t_start
+        initial_state = self.initial_state(n, parameter_values)
+        t_start, t_end, t_steps = self.time_span(n)
+
+        # Continue or truncate the current trajectory instead of
+        # integrating from t_start again. Extended trajectory differs a bit
+        # from one integrated at once, so it is not cached.
+        previous = self._trajectories[n]
+        if signal_data.get("field") == "t_end" and previous.can_change_t_end(
+                parameter_values, initial_state, t_start, t_end, t_steps,
+                alg=self._alg, sampling=self._sampling):
+            periodic_events = self._ds.periodic_events
+
+            def job(should_stop):
+                # Copy, as previous trajectory may be shared with the cache
+                trajectory = copy(previous)
+                trajectory.change_t_end(t_end, periodic_events, should_stop)
+                return [trajectory,]
+
+            self.start_job([n,], job, parameter_values, [None,])
+            return
+
+        if self._execution_mode == "Processes":
+            self.start_process_job(n, initial_state, parameter_values,
+                                   t_start, t_end, t_steps, key)
+            return
+
+        ODEs = self._ds.ODEs
+        jacobian = self._ds.jacobian
+        periodic_events = self._ds.periodic_events
+        periodic_data = self._ds.periodic_data
+        alg = self._alg
+        sampling = self._sampling
+        dtype = self._dtype
+
+        # Very long trajectory is kept on disk, by the same key as in cache,
+        # so it is reused by later runs as well. Stores of shown rows
+        # are not evicted.
+        store = None
+        if t_steps >= self._store_min_t_steps:
+            stores_folder = stores_folderpath()
+            store = TrajectoryStore(join(stores_folder, key))
+            stores_max_bytes = self._stores_max_bytes
+            stores_kept = [trajectory.store.folderpath
+                           for trajectory in self._trajectories
+                           if trajectory.store is not None]
+            stores_kept.append(store.folderpath)
 
-        trajectory.integrate_scipy(parameter_values,
-                                   t_start, t_end,
-                                   row_data.t_steps,
-                                   periodic_events=self._ds.periodic_events)
-        trajectory.process_periodic_variables(self._ds.periodic_data)
-        signal_data["trajectory"] = trajectory
-        self._controller.trajectory_integrated.emit(signal_data)
+        # Trajectory is integrated in chunks and drawn as they come,
+        # so the beginning of long trajectory is shown almost at once
+        def job(should_stop):
+            if store is not None:
+                trajectory = store.load()
+                if trajectory is not None:
+                    trajectory.ODEs, trajectory.jacobian = ODEs, jacobian
+                    return [trajectory,]
+
+            trajectory = Trajectory(ODEs, initial_state)
+            chunks = trajectory.integrate_scipy_chunks(
+                parameter_values, t_start, t_end, t_steps,
+                periodic_events=periodic_events, periodic_data=periodic_data,
+                alg=alg, should_stop=should_stop, jacobian=jacobian,
+                sampling=sampling, dtype=dtype, store=store)
+            for i_changed in chunks:
+                # Copy, as trajectory keeps changing while chunk is drawn
+                yield [(copy(trajectory), i_changed),]
+            if store is not None:
+                store.save(trajectory)
+                evict_stores(stores_folder, stores_max_bytes, stores_kept)
+            return [trajectory,]
+
+        self.start_job([n,], job, parameter_values, [key,])
         return
     
     def handle_parameters_changed(self, *args, **kwargs):
         signal_data = args[0]
-        parameter_values = signal_data["parameter_values"]
-        for n in range(self.table.rowCount()):
-            new_signal_data = {"n":n, "parameter_values":parameter_values}
-            self.handle_initial_state_changed_step2(new_signal_data)
+        parameter_values = signal_data["parameter_values"].copy()
+        self.show_soe_stability(list(range(self.table.rowCount())), parameter_values)
+        self.integrate_rows(list(range(self.table.rowCount())), parameter_values)
+        if self._show_manifolds:
+            self.handle_manifolds_sent({"parameter_values":parameter_values})
+        return
+
+    def integrate_rows(self, ns:list[int], parameter_values):
+        # Very long rows are integrated to disk one by one
+        long_ns = [n for n in ns
+                   if self.time_span(n)[2] >= self._store_min_t_steps]
+        for n in long_ns:
+            self.integrate_row({"n":n, "parameter_values":parameter_values})
+        ns = [n for n in ns if n not in long_ns]
+
+        # Processes integrate rows one by one, threads as ensembles
+        integration = "single" if self._execution_mode == "Processes" \
+            else "ensemble"
+        keys = {n:self.cache_key(n, parameter_values, integration) for n in ns}
+        ns = self.emit_cached(ns, [keys[n] for n in ns], parameter_values)
+
+        # Every row is a separate job, spread across all cores,
+        # rows are redrawn as soon as their jobs finish
+        if self._execution_mode == "Processes":
+            for n in ns:
+                initial_state = self.initial_state(n, parameter_values)
+                self.start_process_job(n, initial_state, parameter_values,
+                                       *self.time_span(n), keys[n])
+            return
+
+        # Rows with the same time span are integrated together
+        # as one ensemble, in one call to solve_ivp
+        groups:dict[tuple, list[int]] = {}
+        for n in ns:
+            groups.setdefault(self.time_span(n), []).append(n)
+
+        ODEs = self._ds.ODEs
+        jacobian = self._ds.jacobian
+        periodic_events = self._ds.periodic_events
+        periodic_data = self._ds.periodic_data
+        alg = self._alg
+        sampling = self._sampling
+        dtype = self._dtype
+
+        for ((t_start, t_end, t_steps), ns) in groups.items():
+            initial_states = [self.initial_state(n, parameter_values) for n in ns]
+
+            def job(should_stop, initial_states=initial_states,
+                    t_start=t_start, t_end=t_end, t_steps=t_steps):
+                ensemble = TrajectoryEnsemble(ODEs, initial_states)
+                trajectories = ensemble.integrate_scipy(
+                    parameter_values, t_start, t_end, t_steps,
+                    periodic_events=periodic_events, alg=alg,
+                    should_stop=should_stop,
+                    jacobian=jacobian, sampling=sampling)
+                for trajectory in trajectories:
+                    trajectory.process_periodic_variables(periodic_data, dtype)
+                return trajectories
+
+            self.start_job(ns, job, parameter_values, [keys[n] for n in ns])
         return
     
+    def handle_find_soe(self):
+        # Box is "lower, upper", empty field means the default one
+        text = self.soe_box_field.text()
+        try:
+            (lower, upper) = [float(value) for value in text.split(",")] \
+                if text.strip() else self._soe_box
+        except ValueError:
+            self.soe_box_field.setText("")
+            return
+        signal_data = {"lower":min(lower, upper), "upper":max(lower, upper)}
+        self._controller.soe_search_requested.emit(signal_data)
+        return
+
+    def handle_soe_search_sent(self, signal_data):
+        # Periodic variables are searched over their period
+        lower = np.full(self._N_variables, signal_data["lower"])
+        upper = np.full(self._N_variables, signal_data["upper"])
+        periodic_data = self._ds.periodic_data
+        for (dim, (offset, period)) in periodic_data.items():
+            lower[dim], upper[dim] = offset, offset + period
+
+        ODEs = self._ds.ODEs
+        parameter_values = signal_data["parameter_values"]
+        N_seeds = self._soe_N_seeds
+        linearization = self._linearization
+
+        def job(should_stop):
+            equilibria = find_equilibria(ODEs, parameter_values, lower, upper,
+                                         N=N_seeds, periodic_data=periodic_data)
+            # Eigenpairs of all found SoE at once, rows look them up
+            linearization.eigen_batch(equilibria, parameter_values)
+            return list(equilibria.T)
+
+        worker = IntegrationWorker(job, {"parameter_values":parameter_values})
+        worker.signals.finished.connect(self.handle_soe_found)
+        self._thread_pool.start(worker)
+        return
+
+    def handle_soe_found(self, signal_data):
+        if signal_data["cancelled"]:
+            return
+        if signal_data["error"] is not None:
+            print(f"SoE search failed: {signal_data['error']}")
+            return
+
+        # SoE already in the table are not added again
+        existing = [self.table.get_row(n).variables
+                    for n in range(self.table.rowCount())
+                    if self.table.get_row_type(n) == "SoE"]
+        points = np.array(existing + signal_data["result"]).reshape(
+            -1, self._N_variables).T
+        i_unique = unique_points(points, 1e-6, self._ds.periodic_data)
+
+        for i in i_unique[i_unique >= len(existing)]:
+            data = RowDataSoE(self._N_variables, []).get_data()
+            data["variables"] = points[:, i].tolist()
+            self.add_row_with_data("SoE", data)
+            self.show_soe_stability([self.table.rowCount()-1],
+                                    signal_data["parameter_values"])
+        if self._show_manifolds:
+            self.handle_manifolds_sent(signal_data)
+        return
+
+    def handle_manifolds_changed(self, state):
+        self._show_manifolds = (state==2)
+        if self._show_manifolds:
+            self._controller.manifolds_requested.emit({})
+        else:
+            # Running job is not needed anymore
+            self.cancel_manifolds_job()
+            self._controller.manifolds_computed.emit({"branches":[]})
+        return
+
+    def handle_manifolds_sent(self, signal_data):
+        # Branches of all SoE rows are integrated in one batch
+        ns = [n for n in range(self.table.rowCount())
+              if self.table.get_row_type(n) == "SoE"]
+        equilibria = np.array([self.table.get_row(n).variables for n in ns]
+                              ).reshape(-1, self._N_variables).T
+        eps = [self.table.get_row(n).eps for n in ns]
+
+        ODEs = self._ds.ODEs
+        jacobian = self._ds.jacobian
+        periodic_events = self._ds.periodic_events
+        periodic_data = self._ds.periodic_data
+        parameter_values = signal_data["parameter_values"].copy()
+        linearization = self._linearization
+        t_end, t_steps = self._manifold_t_end, self._manifold_t_steps
+        dtype = self._dtype
+
+        def job(should_stop):
+            return compute_manifolds(
+                ODEs, equilibria, parameter_values, t_end, t_steps, eps=eps,
+                linearization=linearization, periodic_events=periodic_events,
+                periodic_data=periodic_data, jacobian=jacobian, dtype=dtype,
+                should_stop=should_stop)
+
+        self.cancel_manifolds_job()
+        worker = IntegrationWorker(job, {"job_id":self._manifolds_job})
+        worker.signals.finished.connect(self.handle_manifolds_found)
+        self._manifolds_worker = worker
+        self._thread_pool.start(worker)
+        return
+
+    def cancel_manifolds_job(self):
+        # Results of running job, if any, are dropped, see handle_manifolds_found
+        self._manifolds_job += 1
+        if self._manifolds_worker is not None:
+            self._manifolds_worker.cancel()
+            self._manifolds_worker = None
+        return
+
+    def handle_manifolds_found(self, signal_data):
+        # Parameters changed or separatrices were hidden since job started
+        if signal_data["cancelled"] or signal_data["job_id"] != self._manifolds_job:
+            return
+        self._manifolds_worker = None
+        if signal_data["error"] is not None:
+            print(f"Separatrices failed: {signal_data['error']}")
+            return
+        self._controller.manifolds_computed.emit({"branches":signal_data["result"]})
+        return
+
+    def show_soe_stability(self, ns:list[int], parameter_values):
+        # Kind of equilibrium is shown as tooltip of row type,
+        # eigenpairs of all rows not memoized yet are found at once
+        ns = [n for n in ns if self.table.get_row_type(n) == "SoE"]
+        if not ns:
+            return
+        states = np.array([self.table.get_row(n).variables for n in ns]).T
+        self._linearization.eigen_batch(states, parameter_values)
+        for n in ns:
+            row_data = self.table.get_row(n)
+            kind = self._linearization.classify(row_data.variables, parameter_values)
+            row_data.type_field.setToolTip(kind)
+        return
+
     def handle_labels_changed(self, *args, **kwargs):
         for i in range(self.table.rowCount()):
+            # Skip rows that are not integrated yet
+            if self._trajectories[i].y_sols is None:
+                continue
             signal_data = {"n":i, "trajectory":self._trajectories[i]}
             self._controller.trajectory_integrated.emit(signal_data)
         return
\ No newline at end of file
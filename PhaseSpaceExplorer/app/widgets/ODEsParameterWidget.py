@@ -56,6 +56,8 @@ class ODEsParametersWidget(QWidget):
     
     def connect_controller(self):
         self._controller.data_changed.connect(self.handle_parameters_requested)
+        self._controller.soe_search_requested.connect(self.handle_soe_search_requested)
+        self._controller.manifolds_requested.connect(self.handle_manifolds_requested)
         return
     
     def handle_parameter_value_change(self, text, changed_parameter_i):
@@ -71,11 +73,32 @@ class ODEsParametersWidget(QWidget):
         self._parameter_values[changed_parameter_i] = new_value
 
         signal_data = {"parameter_values": self._parameter_values}
-        self._controller.parameters_changed.emit(signal_data)
+        self._controller.request_parameters_change(signal_data)
         return
     
+    @property
+    def parameter_values(self) -> np.ndarray:
+        return self._parameter_values
+
+    def set_parameter_values(self, parameter_values):
+        # Values of a loaded session, nothing is integrated yet
+        self._parameter_values[:] = parameter_values
+        for (field, value) in zip(self.values, self._parameter_values):
+            field.setText(str(value))
+        return
+
     def handle_parameters_requested(self, signal_data):
         # Add parameter values to data and pass back
         signal_data["parameter_values"] = self._parameter_values
-        self._controller.parameters_to_integrate_sent.emit(signal_data)
-        return
\ No newline at end of file
+        self._controller.request_integration(signal_data)
+        return
+
+    def handle_soe_search_requested(self, signal_data):
+        signal_data["parameter_values"] = self._parameter_values.copy()
+        self._controller.soe_search_sent.emit(signal_data)
+        return
+
+    def handle_manifolds_requested(self, signal_data):
+        signal_data["parameter_values"] = self._parameter_values.copy()
+        self._controller.manifolds_sent.emit(signal_data)
+        return
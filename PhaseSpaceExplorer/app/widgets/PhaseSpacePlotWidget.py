@@ -1,20 +1,24 @@
 from typing import List
 
 from PySide6.QtWidgets import (
-    QVBoxLayout, QWidget, QComboBox, QHBoxLayout, QPushButton)
-# from PySide6.QtCore import QTimer
+    QVBoxLayout, QWidget, QComboBox, QHBoxLayout, QPushButton, QCheckBox)
+from PySide6.QtCore import QTimer
 
 from matplotlib.backends.backend_qtagg import FigureCanvas
 from matplotlib.backends.backend_qtagg import NavigationToolbar2QT as NavigationToolbar
 # import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
 from matplotlib.lines import Line2D
+import numpy as np
 
 from app.controllers.PhaseSpaceController import PhaseSpaceController
 from backend.DynamicalSystem import DynamicalSystem
+from backend.LineDecimator import LineDecimator
+from backend.VectorField import VectorField
 
 
 class PhaseSpacePlotWidget(QWidget):
+    _manifold_colors:dict[str, str] = {"stable":"tab:blue", "unstable":"tab:red"}
     def __init__(self, ds:DynamicalSystem, controller:PhaseSpaceController):
         super().__init__()
         self._ds:DynamicalSystem = ds
@@ -28,16 +32,38 @@ class PhaseSpacePlotWidget(QWidget):
 
         self._mylines:List[MyLine] = [] # TODO move this list into canvas class
 
+        # Separatrices, all branches of a kind are parts of one line
+        self._manifold_branches:list = []
+        self._manifold_lines:dict[str, MyLine] = {
+            kind:MyLine(self._canvas, color=color, linewidth=0.8)
+            for (kind, color) in self._manifold_colors.items()}
+
+        # Vector field and nullclines of the slice shown
+        N_variables = len(self._ds.variable_names)
+        self._field_overlay = MyFieldOverlay(
+            self._canvas, VectorField(self._ds.ODEs, N_variables), N_variables)
+
+        # Redraw requests are collected and flushed at most once per frame,
+        # so a burst of integrated rows costs a single draw
+        self._dirty_lines:set[MyLine] = set()
+        self._full_redraw:bool = False
+        self._draws_requested:int = 0
+        self._draws_done:int = 0
+        self._frame_timer = QTimer(self)
+        self._frame_timer.setSingleShot(True)
+        self._frame_timer.setInterval(16)
+        self._frame_timer.timeout.connect(self.flush_redraw)
+
         self.setup_ui()
         self.connect_controller()
-
-        # Setup a timer to trigger the redraw by calling wake_canvas
-        # self.timer = QTimer()
-        # self.timer.setInterval(1000)
-        # self.timer.timeout.connect(self.wake_canvas)
-        # self.timer.start()
         return
     
+    @property
+    def redraw_stats(self) -> dict:
+        return {"requested":self._draws_requested,
+                "done":self._draws_done,
+                "pending":self._frame_timer.isActive()}
+    
     def setup_ui(self):
         # Setup layout
         layout = QVBoxLayout()
@@ -62,6 +88,10 @@ class PhaseSpacePlotWidget(QWidget):
         labels_layout.addWidget(x_axis_label_combobox)
         labels_layout.addWidget(y_axis_label_combobox)
 
+        field_checkbox = QCheckBox("Vector field")
+        field_checkbox.stateChanged.connect(self.handle_field_changed)
+        labels_layout.addWidget(field_checkbox)
+
         fit_btn = QPushButton("Fit to plot")
         fit_btn.clicked.connect(self._canvas.autoscale)
         layout.addWidget(fit_btn)
@@ -74,39 +104,105 @@ class PhaseSpacePlotWidget(QWidget):
     
     def connect_controller(self):
         self._controller.trajectory_integrated.connect(self.handle_trajectory_integrated)
+        self._controller.trajectory_chunk_integrated.connect(self.handle_trajectory_integrated)
+        self._controller.manifolds_computed.connect(self.handle_manifolds_computed)
+        self._controller.labels_changed.connect(self.draw_manifolds)
+        self._controller.labels_changed.connect(self.update_field)
+        self._controller.parameters_changed.connect(self.update_field)
+        self._controller.trajectory_integrated.connect(self.update_field)
         return
     
     def wake_canvas(self):
-        self._canvas.draw()
+        self.request_redraw()
         return
     
-    def handle_trajectory_integrated(self, signal_data):
-        n = signal_data["n"]
-        trajectory = signal_data["trajectory"]
-
+    def request_redraw(self, line:"MyLine | None" = None):
+        # Only the given line changed, or the whole figure if it is None
+        self._draws_requested += 1
+        if line is None:
+            self._full_redraw = True
+        else:
+            self._dirty_lines.add(line)
+        if not self._frame_timer.isActive():
+            self._frame_timer.start()
+        return
+    
+    def flush_redraw(self):
+        # A single changed line is blitted, anything else is a full draw
+        if len(self._dirty_lines) == 1 and not self._full_redraw:
+            self._canvas.blit_line(self._dirty_lines.pop())
+        else:
+            self._canvas.draw_idle()
+        self._dirty_lines.clear()
+        self._full_redraw = False
+        self._draws_done += 1
+        return
+    
+    def trajectory_data(self, trajectory, i_changed:int = 0):
+        # Segments of trajectory from i_changed on, along the chosen axes
         x_label_index = self._canvas.x_label_index
         y_label_index = self._canvas.y_label_index
 
         if x_label_index != len(self._available_labels)-1:
             to_plot_xs = [trajectory.y_sols[i][x_label_index,:] 
-                          for i in range(len(trajectory.y_sols))]
+                          for i in range(i_changed, len(trajectory.y_sols))]
         else:
-            to_plot_xs = trajectory.t_sols
+            to_plot_xs = trajectory.t_sols[i_changed:]
 
         if y_label_index != len(self._available_labels)-1:
             to_plot_ys = [trajectory.y_sols[i][y_label_index,:] 
-                          for i in range(len(trajectory.y_sols))]
+                          for i in range(i_changed, len(trajectory.y_sols))]
         else:
-            to_plot_ys = trajectory.t_sols
+            to_plot_ys = trajectory.t_sols[i_changed:]
+        return (to_plot_xs, to_plot_ys)
+
+    def handle_trajectory_integrated(self, signal_data):
+        n = signal_data["n"]
+        trajectory = signal_data["trajectory"]
+        # Partially integrated trajectory only changes from this segment on
+        i_changed = signal_data.get("i_changed", 0)
+        (to_plot_xs, to_plot_ys) = self.trajectory_data(trajectory, i_changed)
 
-        # Check if new MyLine is needed
-        if n > len(self._mylines)-1:
+        # Check if new MyLine is needed,
+        # rows may finish integrating in any order
+        while n > len(self._mylines)-1:
             self._mylines.append(MyLine(self._canvas))
 
-        self._mylines[n].update(to_plot_xs, to_plot_ys)
-        self.wake_canvas()
+        self._mylines[n].update(to_plot_xs, to_plot_ys, i_changed)
+        self.request_redraw(self._mylines[n])
         return
     
+    def handle_manifolds_computed(self, signal_data):
+        self._manifold_branches = signal_data["branches"]
+        self.draw_manifolds()
+        return
+
+    def draw_manifolds(self, *args, **kwargs):
+        for (kind, line) in self._manifold_lines.items():
+            to_plot_xs, to_plot_ys = [], []
+            for branch in self._manifold_branches:
+                if branch.kind != kind:
+                    continue
+                (xs, ys) = self.trajectory_data(branch.trajectory)
+                to_plot_xs.extend(xs)
+                to_plot_ys.extend(ys)
+            line.update(to_plot_xs, to_plot_ys)
+        self.request_redraw()
+        return
+
+    def handle_field_changed(self, state):
+        self._field_overlay.visible = (state==2)
+        self.update_field()
+        return
+
+    def update_field(self, signal_data:dict = {}):
+        # Overlay is recomputed only if parameters or slice changed,
+        # drawing it on new view is left to the canvas, see MyCanvas.draw
+        parameter_values = signal_data.get("parameter_values")
+        if self._field_overlay.update(parameter_values):
+            self.request_redraw()
+        return
+
     def handle_axis_label_changed(self, label, axis):
         if axis == "x":
             self._canvas.x_label_index = label
@@ -135,6 +231,28 @@ class MyCanvas(FigureCanvas):
 
         self.axes.set_xlabel(self._available_labels[self._x_label_index])
         self.axes.set_ylabel(self._available_labels[self._y_label_index])
+
+        # Lines are decimated to the view they were last drawn in
+        self._lines:List[MyLine] = []
+        self._decimated_view:tuple | None = None
+        # Overlays are recomputed for full quality views only
+        self._overlays:List[MyFieldOverlay] = []
+
+        # While wheel or drag events keep coming, lines are decimated to
+        # a coarser view, full quality redraw comes once input settles
+        self._preview:bool = False
+        self._preview_factor:int = 4
+        self._settle_timer = QTimer(self)
+        self._settle_timer.setSingleShot(True)
+        self._settle_timer.setInterval(150)
+        self._settle_timer.timeout.connect(self.finish_interaction)
+        self.fig.canvas.mpl_connect('motion_notify_event', self.handle_motion)
+
+        # Changing line is drawn on top of cached background with
+        # all the other artists, see blit_line
+        self._blit_line:MyLine | None = None
+        self._background = None
+        self.fig.canvas.mpl_connect('draw_event', self.handle_draw_event)
         return
     
     @property
@@ -163,8 +281,103 @@ class MyCanvas(FigureCanvas):
     def y_label(self):
         return self._available_labels[self._y_label_index]
     
+    @property
+    def view(self) -> tuple:
+        # Limits and size of the axes in pixels, everything decimation depends on
+        return (self.axes.get_xlim(), self.axes.get_ylim(),
+                int(self.axes.bbox.width), int(self.axes.bbox.height))
+    
+    @property
+    def lod_view(self) -> tuple:
+        # View lines are decimated to, coarser one during interaction
+        (x_lim, y_lim, width, height) = self.view
+        if self._preview:
+            width = width // self._preview_factor
+            height = height // self._preview_factor
+        return (x_lim, y_lim, width, height)
+    
+    def add_line(self, line:"MyLine"):
+        self._lines.append(line)
+        return
+
+    def add_overlay(self, overlay:"MyFieldOverlay"):
+        self._overlays.append(overlay)
+        return
+    
     def autoscale(self):
-        self.axes.autoscale()
+        # Decimated lines only hold samples around the view,
+        # so limits are fitted to full data of lines
+        bounds = [line.bounds for line in self._lines if line.bounds is not None]
+        if not bounds:
+            self.axes.autoscale()
+            return
+        (x_min, x_max, y_min, y_max) = np.array(bounds).T
+        (x_min, x_max, y_min, y_max) = (x_min.min(), x_max.max(),
+                                        y_min.min(), y_max.max())
+        # Same margins as set in __init__
+        x_margin = 0.05*(x_max - x_min) or 0.5
+        y_margin = 0.05*(y_max - y_min) or 0.5
+        self.axes.set_xlim(x_min - x_margin, x_max + x_margin)
+        self.axes.set_ylim(y_min - y_margin, y_max + y_margin)
+        self.draw()
+        return
+    
+    def draw(self):
+        # Zoom, pan and resize all end up here
+        if self.lod_view != self._decimated_view:
+            self._decimated_view = self.lod_view
+            for line in self._lines:
+                line.decimate()
+        if not self._preview:
+            for overlay in self._overlays:
+                overlay.update()
+        super().draw()
+        return
+    
+    def handle_draw_event(self, event):
+        # Full draw skips animated artists, background is cached
+        # without them and they are drawn on top of it
+        self._background = self.copy_from_bbox(self.fig.bbox)
+        if self._blit_line is not None:
+            for ref in self._blit_line.refs:
+                self.axes.draw_artist(ref)
+        return
+    
+    def blit_line(self, line:"MyLine"):
+        """
+        Redraw the figure after data of one line changed. As long as
+        the same line keeps changing and the view stays the same,
+        only this line is drawn, on top of cached background.
+        """
+        if (line is not self._blit_line) or (self._background is None) \
+                or (self.lod_view != self._decimated_view):
+            if self._blit_line is not None:
+                self._blit_line.set_animated(False)
+            self._blit_line = line
+            line.set_animated(True)
+            self.draw()
+            return
+
+        self.restore_region(self._background)
+        for ref in line.refs:
+            self.axes.draw_artist(ref)
+        self.blit(self.fig.bbox)
+        return
+    
+    def start_interaction(self):
+        self._preview = True
+        self._settle_timer.start()
+        return
+    
+    def finish_interaction(self):
+        self._preview = False
+        self.draw_idle()
+        return
+    
+    def handle_motion(self, event):
+        # Dragging with pan or zoom tool of the toolbar
+        if event.button is not None:
+            self.start_interaction()
         return
     
     def wake(self):
@@ -193,29 +406,151 @@ class MyCanvas(FigureCanvas):
                      xdata + cur_xrange*scale_factor])
         self.axes.set_ylim([ydata - cur_yrange*scale_factor,
                      ydata + cur_yrange*scale_factor])
-        self.draw() # force re-draw
+        # Coarse preview, scroll ticks coming faster than frames are drawn
+        # are merged by draw_idle, see finish_interaction
+        self.start_interaction()
+        self.draw_idle()
 
 
 class MyLine():
-    def __init__(self, canvas:MyCanvas):
+    def __init__(self, canvas:MyCanvas, **line_kwargs):
         self._canvas = canvas
-        self._refs:List[Line2D] = []
+
+        # All segments of trajectory are drawn by one artist, as one curve
+        # with NaN separators, so the number of artists does not grow
+        # with the number of segments
+        self._ref:Line2D
+        self._ref, = self._canvas.axes.plot([], [], **line_kwargs)  # Create empty line
+
+        # Full data of every segment, only its decimated
+        # version for the current view is given to the line
+        self._x_datas:list[np.ndarray] = []
+        self._y_datas:list[np.ndarray] = []
+        self._decimator:LineDecimator | None = None
+
+        self._canvas.add_line(self)
+        return
+    
+    @property
+    def refs(self) -> List[Line2D]:
+        return [self._ref,]
+    
+    def set_animated(self, value:bool):
+        # Drawn separately from the figure, see MyCanvas.blit_line
+        self._ref.set_animated(value)
         return
     
-    def update(self, x_datas, y_datas):
+    @property
+    def bounds(self):
+        if self._decimator is None:
+            return None
+        return self._decimator.bounds
+    
+    def update(self, x_datas, y_datas, i_from=0):
+        # Data is given for segments from i_from on,
+        # segments before i_from are kept as they are
         assert len(x_datas) == len(y_datas)
+        self._x_datas = self._x_datas[:i_from] + list(x_datas)
+        self._y_datas = self._y_datas[:i_from] + list(y_datas)
+
+        nan = np.array([np.nan])
+        xs = np.concatenate([part for x_data in self._x_datas
+                             for part in (nan, x_data)][1:] or [nan])
+        ys = np.concatenate([part for y_data in self._y_datas
+                             for part in (nan, y_data)][1:] or [nan])
+        self._decimator = LineDecimator(xs, ys)
+        self.decimate()
+        return
+    
+    def decimate(self):
+        # Update line with data decimated to view
+        if self._decimator is None:
+            return
+        (xs, ys) = self._decimator.decimate(*self._canvas.lod_view)
+        self._ref.set_data(xs, ys)
+        return
+
+
+class MyFieldOverlay():
+    def __init__(self, canvas:MyCanvas, field:VectorField, N_variables:int,
+                 resolution:int = 32):
+        self._canvas = canvas
+        self._field:VectorField = field
+        self._N_variables:int = N_variables
+        # Grid intervals along each axis, bounds cost of every update
+        self._resolution:int = resolution
+        self.visible:bool = False
+
+        self._parameter_values = None
+        # Everything the drawn overlay depends on, None if nothing is drawn
+        self._drawn_for:tuple | None = None
+        self._quiver = None
+        self._nullclines:list = []
+
+        self._canvas.add_overlay(self)
+        return
+
+    def remove(self):
+        for artist in [self._quiver,] + self._nullclines:
+            if artist is not None:
+                artist.remove()
+        self._quiver = None
+        self._nullclines = []
+        self._drawn_for = None
+        return
+
+    def update(self, parameter_values = None) -> bool:
+        """
+        Recompute overlay for the current view, slice and parameters,
+        only tiles of the field not seen before are evaluated.
+
+        Returns:
+            True if overlay changed
+        """
+        if parameter_values is not None:
+            self._parameter_values = np.array(parameter_values, dtype=float)
+
+        i_x = self._canvas.x_label_index
+        i_y = self._canvas.y_label_index
+        # Field of a 2D slice of phase space, time is not a variable
+        shown = self.visible and (self._parameter_values is not None) \
+            and (i_x != i_y) and (i_x < self._N_variables) \
+            and (i_y < self._N_variables)
+        if not shown:
+            changed = self._drawn_for is not None
+            self.remove()
+            return changed
+
+        (x_lim, y_lim, width, height) = self._canvas.view
+        drawn_for = (x_lim, y_lim, width, height, i_x, i_y,
+                     self._parameter_values.tobytes())
+        if drawn_for == self._drawn_for:
+            return False
+        self.remove()
+        self._drawn_for = drawn_for
+
+        (xs, ys, dX) = self._field.field(self._parameter_values, x_lim, y_lim,
+                                         i_x, i_y, resolution=self._resolution)
+        if len(xs) < 2 or len(ys) < 2:
+            return True
+        (U, V) = (np.ma.masked_invalid(dX[i_x]), np.ma.masked_invalid(dX[i_y]))
+
+        # Arrows show direction only, normalized as seen on screen
+        U_px = U * width / abs(x_lim[1] - x_lim[0])
+        V_px = V * height / abs(y_lim[1] - y_lim[0])
+        norm = np.hypot(U_px, V_px)
+        norm[norm == 0] = 1.0
+        axes = self._canvas.axes
+        self._quiver = axes.quiver(xs, ys, U_px/norm, V_px/norm, color="0.7",
+                                   pivot="mid", width=0.002, zorder=0)
 
-        # Remove excess references if we have more than needed
-        while len(self._refs) > len(x_datas):
-            removed_ref = self._refs.pop()
-            removed_ref.remove()
-        
-        # Add new references if we need more
-        while len(self._refs) < len(x_datas):
-            new_ref, = self._canvas.axes.plot([], [])  # Create empty line
-            self._refs.append(new_ref)
-
-        # Update all references with new data
-        for (x_data, y_data, ref) in zip(x_datas, y_datas, self._refs):
-            ref.set_data(x_data, y_data)
-        return
\ No newline at end of file
+        # Nullclines are zero levels of derivatives along the axes
+        for (dX_i, color) in ((U, "tab:green"), (V, "tab:purple")):
+            if dX_i.min() < 0 < dX_i.max():
+                self._nullclines.append(axes.contour(
+                    xs, ys, dX_i, levels=[0.0], colors=color,
+                    linewidths=0.8, zorder=0))
+        # Overlay covers the view, it must not rescale it
+        axes.set_xlim(x_lim, auto=None)
+        axes.set_ylim(y_lim, auto=None)
+        return True
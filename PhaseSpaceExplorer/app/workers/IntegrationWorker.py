@@ -0,0 +1,64 @@
+from inspect import isgenerator
+from typing import Callable, Generator
+
+from PySide6.QtCore import QObject, QRunnable, Signal
+
+from backend.exceptions.Trajectory_exceptions import IntegrationCancelledException
+
+
+class IntegrationWorkerSignals(QObject):
+    # QRunnable is not a QObject, so signals live here
+    finished = Signal(dict)
+    progress = Signal(dict)
+
+    def __init__(self):
+        super().__init__()
+
+
+class IntegrationWorker(QRunnable):
+    def __init__(self, job:Callable[[Callable[[], bool]], list], signal_data:dict):
+        # job receives `should_stop` callable and returns list of results,
+        # or it is a generator that yields lists of partial results
+        # and returns the final one
+        super().__init__()
+        self.signals = IntegrationWorkerSignals()
+        self._job = job
+        self._signal_data = signal_data
+        self._cancelled = False
+        return
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        self._cancelled = True
+        return
+
+    def report_progress(self, job:Generator[list, None, list]) -> list:
+        while True:
+            try:
+                partial_result = next(job)
+            except StopIteration as stop:
+                return stop.value
+            signal_data = self._signal_data.copy()
+            signal_data["result"] = partial_result
+            self.signals.progress.emit(signal_data)
+
+    def run(self):
+        # Always report back, so the owner can forget about this worker
+        self._signal_data["cancelled"] = False
+        self._signal_data["error"] = None
+        try:
+            if self._cancelled:
+                raise IntegrationCancelledException()
+            result = self._job(lambda: self._cancelled)
+            if isgenerator(result):
+                result = self.report_progress(result)
+            self._signal_data["result"] = result
+        except IntegrationCancelledException:
+            self._signal_data["cancelled"] = True
+        except Exception as e:
+            self._signal_data["error"] = e
+        self.signals.finished.emit(self._signal_data)
+        return
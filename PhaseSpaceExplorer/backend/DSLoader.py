@@ -21,10 +21,18 @@ class DSLoader(Protocol):
     def ODEs(self) -> Callable:
         raise NotImplementedError
     
+    @property
+    def jacobian(self) -> Callable | None:
+        raise NotImplementedError
+
     @property
     def periodic_data(self) -> Dict[int, Tuple[float, float]]:
         raise NotImplementedError
 
     @property
     def periodic_events(self) -> List[Callable]:
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    @property
+    def compile_mode(self) -> Dict[str, str]:
+        raise NotImplementedError
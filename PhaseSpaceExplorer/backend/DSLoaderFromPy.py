@@ -2,6 +2,7 @@ from typing import List, Callable, Tuple, Dict
 
 from os.path import isfile, join
 
+from backend.compilation import compile_ODEs, compile_events
 from backend.exceptions.DSLoader_exceptions import *
 
 
@@ -11,6 +12,12 @@ class DSLoaderFromPy():
         self.folderpath = folderpath
         self.filepath = join(self.folderpath, self.filename)
         self.module = None
+
+        # Compiled versions of ODEs and events, see compile_DS
+        self._compiled_ODEs = None
+        self._compiled_jacobian = None
+        self._compiled_events = None
+        self.compile_mode = {"ODEs": "python", "periodic_events": "python"}
         return
 
     def load_DS(self):
@@ -27,6 +34,22 @@ class DSLoaderFromPy():
             raise CouldNotImportModuleException(self.filepath)
 
         self.module = module
+        self._compiled_ODEs = None
+        self._compiled_jacobian = None
+        self._compiled_events = None
+        self.compile_mode = {"ODEs": "python", "periodic_events": "python"}
+
+    def compile_DS(self):
+        # Optional step after load_DS, falls back to python functions
+        self._compiled_ODEs, ODEs_mode = compile_ODEs(
+            self.module_ODEs, len(self.variable_names), len(self.parameter_names))
+        self._compiled_events, events_mode = compile_events(
+            self.module_periodic_events, len(self.variable_names))
+        self.compile_mode = {"ODEs": ODEs_mode, "periodic_events": events_mode}
+        if self.module_jacobian is not None:
+            self._compiled_jacobian, self.compile_mode["jacobian"] = compile_ODEs(
+                self.module_jacobian,
+                len(self.variable_names), len(self.parameter_names))
 
     @property
     def variable_names(self) -> List[str]:
@@ -46,12 +69,33 @@ class DSLoaderFromPy():
 
     @property
     def ODEs(self) -> Callable:
+        if self._compiled_ODEs is not None:
+            return self._compiled_ODEs
+        return self.module_ODEs
+
+    @property
+    def module_ODEs(self) -> Callable:
         try:
             to_return = self.module["ODEs"]
         except:
             raise ODEsNotFoundException(self.filepath)
         return to_return
 
+    @property
+    def jacobian(self) -> Callable | None:
+        if self._compiled_jacobian is not None:
+            return self._compiled_jacobian
+        return self.module_jacobian
+
+    @property
+    def module_jacobian(self) -> Callable | None:
+        # Optional, Jacobian of ODEs jacobian(U, p, t)[i][j] = dODEs_i/dU_j
+        try:
+            to_return = self.module["jacobian"]
+        except:
+            to_return = None
+        return to_return
+
     @property
     def periodic_data(self) -> Dict[int, Tuple[float, float]]:
         try:
@@ -62,6 +106,12 @@ class DSLoaderFromPy():
 
     @property
     def periodic_events(self) -> List[Callable]:
+        if self._compiled_events is not None:
+            return self._compiled_events
+        return self.module_periodic_events
+
+    @property
+    def module_periodic_events(self) -> List[Callable]:
         try:
             to_return = self.module["periodic_events"]
         except:
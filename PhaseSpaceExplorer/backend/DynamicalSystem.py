@@ -1,3 +1,4 @@
+from hashlib import sha256
 from os.path import join, isfile
 
 from backend.DSLoader import DSLoader
@@ -10,12 +11,31 @@ class DynamicalSystem:
         self._variable_names = None
         self._parameter_names = None
         self._ODEs = None
+        self._jacobian = None
         self._periodic_data = None
         self._periodic_events = None
+        self._file_hash = None
+        self._compile_mode = None
 
         self._loaded = False
         return
 
+    @property
+    def folderpath(self):
+        return self._ds_folderpath
+
+    @property
+    def filepath(self):
+        return self._ds_filepath
+
+    @property
+    def compile_mode(self):
+        return self._compile_mode
+
+    @property
+    def file_hash(self):
+        return self._file_hash
+
     @property
     def variable_names(self):
         return self._variable_names
@@ -28,6 +48,10 @@ class DynamicalSystem:
     def ODEs(self):
         return self._ODEs
 
+    @property
+    def jacobian(self):
+        return self._jacobian
+
     @property
     def periodic_data(self):
         return self._periodic_data
@@ -48,15 +72,27 @@ class DynamicalSystem:
                    f"Parameter names: {self._parameter_names}",
                    f"Periodic variable data: {self._periodic_data}",
                    f"Periodic events: {self._periodic_events}",
-                   f"ODEs: {self._ODEs}"]
+                   f"ODEs: {self._ODEs}",
+                   f"Jacobian: {self._jacobian}",
+                   f"Compiled with: {self._compile_mode}"]
         return "\n".join(strings)
 
+    @staticmethod
+    def hash_file(filepath) -> str:
+        with open(filepath, "rb") as f:
+            return sha256(f.read()).hexdigest()
+
     def load(self, loader: DSLoader):
         self._ds_folderpath = loader.folderpath
         self._ds_filepath = loader.filepath
         self._variable_names = loader.variable_names
         self._parameter_names = loader.parameter_names
         self._ODEs = loader.ODEs
+        self._jacobian = loader.jacobian
         self._periodic_data = loader.periodic_data
         self._periodic_events = loader.periodic_events
+        self._file_hash = self.hash_file(self._ds_filepath)
+        self._compile_mode = getattr(
+            loader, "compile_mode",
+            {"ODEs": "python", "periodic_events": "python"})
         self._loaded = True
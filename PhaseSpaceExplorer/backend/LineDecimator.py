@@ -0,0 +1,172 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+def _run_starts(
+        cxs: np.ndarray, cys: np.ndarray,
+        keep_ends: np.ndarray | None = None
+) -> np.ndarray:
+    """
+    Mask of samples to keep, so that the curve still visits the same cells.
+
+    Consecutive samples in the same cell (cxs, cys) form a run, the first
+    sample of every run is kept. Dropped samples are in the same cell as the
+    previous kept one, so the curve moves by less than the cell size.
+    The last sample of a run is kept as well where keep_ends is True, then
+    the curve between them stays in the cell if the cell is convex.
+
+    NaN cells never match, so NaN separators and the samples
+    around them, i.e. ends of every part of the curve, are kept.
+    """
+    N = len(cxs)
+    keep = np.ones(N, dtype=bool)
+    if N > 1:
+        changed = (cxs[1:] != cxs[:-1]) | (cys[1:] != cys[:-1])
+        keep[1:] = changed
+        run_ends = np.append(changed, True)
+        keep |= run_ends & np.append(np.isnan(cxs[1:]), True)
+        if keep_ends is not None:
+            keep |= run_ends & keep_ends
+    return keep
+
+
+class LineDecimator():
+    def __init__(self, xs: np.ndarray, ys: np.ndarray, chunk_size: int = 1024):
+        # Curve, possibly consisting of several parts separated by NaN
+        self._xs: np.ndarray = np.asarray(xs, dtype=float)
+        self._ys: np.ndarray = np.asarray(ys, dtype=float)
+        self._chunk_size: int = chunk_size
+
+        finite = np.isfinite(self._xs) & np.isfinite(self._ys)
+        self._bounds: Tuple[float, float, float, float] | None = None
+        if finite.any():
+            self._bounds = (self._xs[finite].min(), self._xs[finite].max(),
+                            self._ys[finite].min(), self._ys[finite].max())
+
+        # Pyramid of decimated curves on grids of (range / 2**level) cells,
+        # built on demand, None marks levels as large as the curve itself
+        self._levels: Dict[int, Tuple[np.ndarray, np.ndarray] | None] = {}
+        # Bounding boxes of chunks of every level, see _chunk_bounds
+        self._chunks: Dict[int, Tuple[np.ndarray, ...]] = {}
+        return
+
+    @property
+    def N(self) -> int:
+        return len(self._xs)
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float] | None:
+        # (x_min, x_max, y_min, y_max) of finite samples
+        return self._bounds
+
+    def _level(self, level: int) -> Tuple[np.ndarray, np.ndarray]:
+        if level not in self._levels:
+            (x_min, x_max, y_min, y_max) = self._bounds
+            # Grid is aligned to data, not to view, so levels are reusable
+            hx = max(x_max - x_min, np.finfo(float).tiny) / 2**level
+            hy = max(y_max - y_min, np.finfo(float).tiny) / 2**level
+            keep = _run_starts(np.floor((self._xs - x_min) / hx),
+                               np.floor((self._ys - y_min) / hy))
+
+            # Finer levels would not be smaller, stop at the curve itself
+            if 2*keep.sum() > self.N:
+                self._levels[level] = None
+            else:
+                self._levels[level] = (self._xs[keep], self._ys[keep])
+        if self._levels[level] is None:
+            return (self._xs, self._ys)
+        return self._levels[level]
+
+    def _chunk_bounds(self, level: int) -> Tuple[np.ndarray, ...]:
+        if level not in self._chunks:
+            (xs, ys) = self._level(level)
+            starts = np.arange(0, len(xs), self._chunk_size)
+            # fmin and fmax skip NaN separators
+            self._chunks[level] = (
+                starts,
+                np.fmin.reduceat(xs, starts), np.fmax.reduceat(xs, starts),
+                np.fmin.reduceat(ys, starts), np.fmax.reduceat(ys, starts))
+        return self._chunks[level]
+
+    def decimate(
+            self, x_lim: Tuple[float, float], y_lim: Tuple[float, float],
+            width: int, height: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Curve as seen in the view of width x height pixels,
+        drawn with at most about a pixel of difference.
+
+        Number of returned samples depends on the number of pixels
+        the curve goes through, not on the number of its samples.
+
+        Returns:
+            xs and ys of decimated curve, NaN separators are kept
+        """
+        if self._bounds is None or self.N <= 2:
+            return (self._xs, self._ys)
+
+        (x0, x1), (y0, y1) = sorted(x_lim), sorted(y_lim)
+        width, height = max(int(width), 1), max(int(height), 1)
+        px, py = (x1 - x0) / width, (y1 - y0) / height
+        if px <= 0 or py <= 0:
+            return (self._xs, self._ys)
+
+        # Coarsest level with cells not larger than a pixel
+        (x_min, x_max, y_min, y_max) = self._bounds
+        ratio = max((x_max - x_min) / px, (y_max - y_min) / py, 1.0)
+        level = int(np.ceil(np.log2(ratio)))
+        (xs, ys) = self._level(level)
+
+        # Chunks with bounding box out of view lie entirely to one side of it,
+        # so everything inside them is out of view. Their first and last
+        # samples keep the curve connected, NaNs keep parts separated.
+        (starts, xs_min, xs_max, ys_min, ys_max) = self._chunk_bounds(level)
+        in_view = (xs_max >= x0) & (xs_min <= x1) & (ys_max >= y0) & (ys_min <= y1)
+        if not in_view.all():
+            i_chunks = np.minimum(np.arange(len(xs)) // self._chunk_size,
+                                  len(starts) - 1)
+            keep = in_view[i_chunks] | np.isnan(xs)
+            keep[starts] = True
+            keep[np.append(starts[1:] - 1, len(xs) - 1)] = True
+            xs, ys = xs[keep], ys[keep]
+
+        # Pixel cells in view, samples out of view fall into one of the
+        # convex border cells around it. The curve may go a long way in
+        # a border cell, so both ends of runs there are kept.
+        cxs = np.clip(np.floor((xs - x0) / px), -1, width)
+        cys = np.clip(np.floor((ys - y0) / py), -1, height)
+        out_of_view = (cxs == -1) | (cxs == width) | (cys == -1) | (cys == height)
+        keep = _run_starts(cxs, cys, keep_ends=out_of_view)
+        return (xs[keep], ys[keep])
+
+
+################################################################################
+# Tests
+
+def test_line_decimator():
+    ts = np.linspace(0.0, 200*np.pi, 1_000_000)
+    xs, ys = np.cos(ts) * (1 + ts/1000), np.sin(ts)
+    xs[500_000] = ys[500_000] = np.nan
+    decimator = LineDecimator(xs, ys)
+
+    (xs_dec, ys_dec) = decimator.decimate((-2, 2), (-2, 2), 400, 300)
+    assert len(xs_dec) < len(xs) / 5
+    # Parts separated by NaN stay separated
+    assert np.isnan(xs_dec).sum() == 1
+
+    # Every kept sample is a sample of the curve, every dropped one
+    # is within a pixel of the previous kept one
+    i_kept = np.flatnonzero(np.isin(xs, xs_dec))
+    assert len(i_kept) == len(xs_dec) - 1
+    i_prev = i_kept[np.searchsorted(i_kept, np.arange(len(xs)), side="right") - 1]
+    assert np.nanmax(np.abs(xs - xs[i_prev])) <= 2 * 4/400
+    assert np.nanmax(np.abs(ys - ys[i_prev])) <= 2 * 4/300
+
+    # Zoomed in view only keeps samples around it
+    (xs_zoom, _) = decimator.decimate((0.9, 1.0), (-0.1, 0.1), 400, 300)
+    assert len(xs_zoom) < len(xs) / 50
+
+################################################################################
+if __name__ == "__main__":
+    test_line_decimator()
@@ -0,0 +1,218 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+from backend.misc import batch_evaluator, jacobians_fd
+
+
+# Kinds of equilibria by eigenvalues of Jacobian, see Linearization.classify
+STABILITY_TYPES = ("stable node", "stable focus", "unstable node",
+                   "unstable focus", "saddle", "non-hyperbolic")
+
+
+class Linearization():
+    """
+    Jacobians and their eigenpairs of ODEs at (state, parameters) pairs.
+
+    Jacobians of many pairs are found by central finite differences with
+    all perturbed states of all pairs evaluated in a single call of ODEs,
+    see misc.jacobians_fd. Eigenpairs are memoized by exact values of state
+    and parameters, least recently used ones are evicted first.
+    """
+    def __init__(self, ODEs: Callable, max_entries: int = 4096):
+        self._ODEs: Callable = ODEs
+        # Function evaluating (n_vars, N) states with (n_pars, N)
+        # parameters at once, None until the first evaluation
+        self._evaluate: Callable | None = None
+
+        # Eigenvalues and eigenvectors by key, least recently used first
+        self._entries: OrderedDict[bytes, Tuple[np.ndarray, np.ndarray]] = OrderedDict()
+        self._max_entries: int = max_entries
+
+        self._hits: int = 0
+        self._misses: int = 0
+        self._evictions: int = 0
+
+        # Memo is shared by worker threads
+        self._lock = Lock()
+        return
+
+    @property
+    def max_entries(self) -> int:
+        return self._max_entries
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "entries": len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        return
+
+    @staticmethod
+    def _columns(Xs, pars) -> Tuple[np.ndarray, np.ndarray]:
+        # States and parameters as (n_vars, N) and (n_pars, N) arrays,
+        # a single state or parameter vector is shared by all pairs
+        Xs = np.asarray(Xs, dtype=float)
+        if Xs.ndim == 1:
+            Xs = Xs[:, None]
+        Ps = np.asarray(pars, dtype=float)
+        if Ps.ndim == 1:
+            Ps = Ps[:, None]
+        N = max(Xs.shape[1], Ps.shape[1])
+        return (np.broadcast_to(Xs, (Xs.shape[0], N)),
+                np.broadcast_to(Ps, (Ps.shape[0], N)))
+
+    def jacobians(self, Xs, pars) -> np.ndarray:
+        """
+        Jacobians at every pair of state and parameters, not memoized.
+
+        Args:
+            Xs: states stacked as columns, shape (n_vars, N), or one state
+            pars: parameters stacked as columns, shape (n_pars, N),
+                or one parameter vector shared by all states
+
+        Returns:
+            Jacobians J[k, i, j] = dODEs_i / dU_j at k-th pair
+        """
+        (Xs, Ps) = self._columns(Xs, pars)
+        if self._evaluate is None:
+            self._evaluate = batch_evaluator(self._ODEs, Xs[:, :2], Ps[:, :2])
+        return jacobians_fd(self._evaluate, Xs, Ps)
+
+    @staticmethod
+    def _key(x: np.ndarray, p: np.ndarray) -> bytes:
+        return x.tobytes() + b"|" + p.tobytes()
+
+    def eigen_batch(self, Xs, pars) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Eigenpairs of Jacobians at every pair of state and parameters,
+        see jacobians. Only pairs not memoized yet are evaluated.
+
+        Returns:
+            Eigenvalues, shape (N, n_vars), and eigenvectors as columns,
+            shape (N, n_vars, n_vars), in the order of scipy.linalg.eig
+        """
+        (Xs, Ps) = self._columns(Xs, pars)
+        (n_vars, N) = Xs.shape
+        Xs, Ps = np.ascontiguousarray(Xs.T), np.ascontiguousarray(Ps.T)
+        keys = [self._key(Xs[k], Ps[k]) for k in range(N)]
+
+        eigenvalues = np.empty((N, n_vars), dtype=complex)
+        eigenvectors = np.empty((N, n_vars, n_vars), dtype=complex)
+        missed = []
+        with self._lock:
+            for (k, key) in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    missed.append(k)
+                    continue
+                self._entries.move_to_end(key)
+                self._hits += 1
+                (eigenvalues[k], eigenvectors[k]) = entry
+
+        if missed:
+            J = self.jacobians(Xs[missed].T, Ps[missed].T)
+            (values, vectors) = np.linalg.eig(J)
+            eigenvalues[missed], eigenvectors[missed] = values, vectors
+
+            with self._lock:
+                self._misses += len(missed)
+                for (i, k) in enumerate(missed):
+                    self._entries[keys[k]] = (values[i], vectors[i])
+                    self._entries.move_to_end(keys[k])
+                self._evict()
+        return (eigenvalues, eigenvectors)
+
+    def eigen(self, x, pars) -> Tuple[np.ndarray, np.ndarray]:
+        # Like misc.eigenvalues_and_eigenvectors, but memoized
+        (eigenvalues, eigenvectors) = self.eigen_batch(x, pars)
+        return (eigenvalues[0], eigenvectors[0])
+
+    def classify(self, x, pars, tol: float = 1e-9) -> str:
+        """
+        Kind of equilibrium x, one of STABILITY_TYPES, a lookup
+        once its eigenvalues are memoized.
+
+        Args:
+            tol: eigenvalues with |Re| up to tol times the largest |eigenvalue|
+                are on the imaginary axis
+        """
+        eigenvalues = self.eigen(x, pars)[0]
+        scale = max(np.abs(eigenvalues).max(), 1.0)
+        re = eigenvalues.real
+        if (np.abs(re) <= tol*scale).any():
+            return "non-hyperbolic"
+        if (re > 0).any() and (re < 0).any():
+            return "saddle"
+        kind = "stable" if (re < 0).all() else "unstable"
+        shape = "focus" if (np.abs(eigenvalues.imag) > tol*scale).any() else "node"
+        return f"{kind} {shape}"
+
+    def _evict(self) -> None:
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+        return
+
+
+################################################################################
+# Tests
+
+def test_linearization():
+    from backend.misc import eigenvalues_and_eigenvectors
+
+    def lorenz(U, p, t):
+        x, y, z = U
+        sigma, r, b = p
+        return [sigma*(y-x), x*(r-z) - y, x*y - b*z]
+
+    n_calls = [0]
+
+    def counted(U, p, t):
+        n_calls[0] += 1
+        return lorenz(U, p, t)
+
+    linearization = Linearization(counted, max_entries=3)
+    pars = np.array([[10.0, 10.0], [28.0, 0.5], [8/3, 8/3]])
+    c = np.sqrt(8/3*27)
+    Xs = np.array([[c, 0.0], [c, 0.0], [27.0, 0.0]])
+
+    # Both pairs, each with its own parameters, in one call
+    # once ODEs were found to broadcast
+    J = linearization.jacobians(Xs, pars)
+    n_calls[0] = 0
+    J = linearization.jacobians(Xs, pars)
+    assert n_calls[0] == 1
+    J_expected = np.array([[-10, 10, 0], [28-27, -1, -c], [c, c, -8/3]])
+    assert np.allclose(J[0], J_expected, atol=1e-6)
+
+    (eigenvalues, _) = linearization.eigen_batch(Xs, pars)
+    expected = eigenvalues_and_eigenvectors(lorenz, Xs[:, 0], pars[:, 0])[0]
+    assert np.allclose(np.sort_complex(eigenvalues[0]), np.sort_complex(expected))
+
+    # Classification is a lookup of memoized eigenvalues
+    n_calls[0] = 0
+    assert linearization.classify(Xs[:, 0], pars[:, 0]) == "saddle"
+    assert linearization.classify(Xs[:, 1], pars[:, 1]) == "stable node"
+    assert n_calls[0] == 0
+    c = np.sqrt(8/3*9)
+    assert linearization.classify([c, c, 9.0], [10.0, 10.0, 8/3]) == "stable focus"
+    assert linearization.stats["hits"] == 2 and linearization.stats["misses"] == 3
+
+    # The least recently used entry is evicted
+    linearization.eigen([1.0, 1.0, 1.0], pars[:, 0])
+    assert len(linearization) == 3 and linearization.stats["evictions"] == 1
+
+################################################################################
+if __name__ == "__main__":
+    test_linearization()
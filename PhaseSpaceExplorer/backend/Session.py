@@ -0,0 +1,188 @@
+import json
+import struct
+import zipfile
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from backend.Trajectory import Trajectory
+from backend.misc import atomic_write
+from backend.TrajectoryStore import TrajectoryStore
+
+
+# Version of the session file format, see Session.save
+SESSION_VERSION = 1
+
+
+class Session():
+    """
+    Everything needed to restore the workbench: dynamical system,
+    parameter values, rows of initial states and their trajectories.
+
+    Session file is a npz archive with a JSON manifest in "manifest" and
+    arrays of every trajectory in "trajectory_<n>.<name>". Arrays are not
+    compressed, so they are memory-mapped from the file and read only when
+    they are used, e.g. drawn. Trajectories kept in a TrajectoryStore are
+    saved there, manifest refers to the store.
+    """
+    def __init__(self):
+        # Data of the workbench, set before save or after load
+        self.ds_folderpath: str | None = None
+        self.ds_file_hash: str | None = None
+        self.parameter_values: List[float] = []
+        self.settings: Dict[str, Any] = {}
+        self.rows: List[Dict[str, Any]] = []
+
+        # Loaded session file and manifest entries of its trajectories
+        self._filepath: str | None = None
+        self._entries: List[Dict[str, Any] | None] = []
+        return
+
+    def save(self, filepath: str, trajectories: List[Trajectory | None]) -> None:
+        """
+        Args:
+            trajectories: trajectory of every row, None if not processed
+        """
+        entries, arrays = [], {}
+        for (n, trajectory) in enumerate(trajectories):
+            if trajectory is None or trajectory.y_sols is None:
+                entries.append(None)
+            elif trajectory.store is not None:
+                # Large buffers are on disk already
+                trajectory.store.save(trajectory)
+                entries.append({"store": trajectory.store.folderpath})
+            else:
+                (settings, trajectory_arrays) = trajectory.save_state()
+                entries.append({"settings": settings,
+                                "arrays": list(trajectory_arrays.keys())})
+                for (name, array) in trajectory_arrays.items():
+                    arrays[f"trajectory_{n}.{name}"] = array
+
+        manifest = {"version": SESSION_VERSION,
+                    "ds": {"folderpath": self.ds_folderpath,
+                           "file_hash": self.ds_file_hash},
+                    "parameter_values": [float(value)
+                                         for value in self.parameter_values],
+                    "settings": self.settings,
+                    "rows": self.rows,
+                    "trajectories": entries}
+
+        # Not compressed, so that arrays can be mapped, see _array
+        with atomic_write(filepath) as f:
+            np.savez(f, manifest=np.array(json.dumps(manifest)), **arrays)
+        return
+
+    def load(self, filepath: str) -> None:
+        # Trajectories are mapped later, see trajectory
+        with np.load(filepath) as npz:
+            manifest = json.loads(str(npz["manifest"]))
+        self._filepath = filepath
+
+        self.ds_folderpath = manifest["ds"]["folderpath"]
+        self.ds_file_hash = manifest["ds"]["file_hash"]
+        self.parameter_values = manifest["parameter_values"]
+        self.settings = manifest["settings"]
+        self.rows = manifest["rows"]
+        self._entries = manifest["trajectories"]
+        return
+
+    def _array(self, name: str) -> np.ndarray:
+        # Array of npz archive memory-mapped at its place in the file,
+        # it is stored there as .npy file, after its local zip header
+        with open(self._filepath, "rb") as f:
+            with zipfile.ZipFile(f) as archive:
+                info = archive.getinfo(f"{name}.npy")
+            f.seek(info.header_offset)
+            header = f.read(30)
+            (name_length, extra_length) = struct.unpack("<HH", header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 \
+                if version == (1, 0) else np.lib.format.read_array_header_2_0
+            (shape, fortran_order, dtype) = read_header(f)
+            offset = f.tell()
+        if int(np.prod(shape)) == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self._filepath, dtype=dtype, mode="r", offset=offset,
+                         shape=shape, order="F" if fortran_order else "C")
+
+    def trajectory(self, n: int, ODEs: Callable,
+                   jacobian: Callable | None = None) -> Trajectory | None:
+        """
+        Trajectory of n-th row, mapped from session file or from its store.
+        ODEs and jacobian are not saved, they are set to the given ones.
+
+        Returns:
+            Trajectory or None if it was not saved or its store is gone
+        """
+        entry = self._entries[n] if n < len(self._entries) else None
+        if entry is None:
+            return None
+
+        if "store" in entry:
+            trajectory = TrajectoryStore(entry["store"]).load()
+            if trajectory is not None:
+                trajectory.ODEs, trajectory.jacobian = ODEs, jacobian
+            return trajectory
+
+        arrays = {name: self._array(f"trajectory_{n}.{name}")
+                  for name in entry["arrays"]}
+        trajectory = Trajectory(ODEs, arrays["initial_state"])
+        trajectory.load_state(entry["settings"], arrays)
+        trajectory.jacobian = jacobian
+        return trajectory
+
+
+################################################################################
+# Tests
+
+def test_session():
+    from os.path import join
+    from tempfile import TemporaryDirectory
+
+    def pendulum(U, p, t):
+        return [U[1], p[0] - np.sin(U[0])]
+
+    def jacobian(U, p, t):
+        return [[0.0, 1.0], [-np.cos(U[0]), 0.0]]
+
+    def periodic_phi(t, y):
+        return np.sin((y[0]+np.pi)/2)
+
+    trajectory = Trajectory(pendulum, np.array([0.0, 0.0]))
+    trajectory.integrate_scipy([1.5], 0.0, 20.0, 500,
+                               periodic_events=[periodic_phi])
+    trajectory.process_periodic_variables({0: (-np.pi, 2*np.pi)})
+
+    session = Session()
+    session.ds_folderpath, session.ds_file_hash = "pendulum", "hash"
+    session.parameter_values = np.array([1.5])
+    session.rows = [{"type": "Dragpoint", "variables": [0.0, 0.0]},
+                    {"type": "SoE", "variables": [1.0, 0.0]}]
+    with TemporaryDirectory() as folderpath:
+        filepath = join(folderpath, "session.npz")
+        session.save(filepath, [trajectory, None])
+
+        loaded = Session()
+        loaded.load(filepath)
+        assert loaded.ds_file_hash == "hash"
+        assert loaded.parameter_values == [1.5]
+        assert loaded.rows == session.rows
+        assert loaded.trajectory(1, pendulum) is None
+
+        # Restored trajectory is mapped from file and continues
+        # like the saved one
+        restored = loaded.trajectory(0, pendulum, jacobian)
+        assert isinstance(restored.y_sols[0], np.memmap)
+        assert restored.jacobian is jacobian
+        assert np.array_equal(restored.y_sol, trajectory.y_sol)
+        assert len(restored.y_sols) == len(trajectory.y_sols)
+        assert restored.can_change_t_end([1.5], np.array([0.0, 0.0]),
+                                         0.0, 30.0, 500)
+        restored.change_t_end(30.0, [periodic_phi])
+        trajectory.change_t_end(30.0, [periodic_phi])
+        assert np.array_equal(restored.y_sol, trajectory.y_sol)
+
+################################################################################
+if __name__ == "__main__":
+    test_session()
@@ -1,14 +1,44 @@
-from copy import deepcopy
-from typing import Callable, List, Tuple, Dict
-from math import isclose
+from math import ceil
+from typing import Callable, Dict, Iterator, List, Tuple
 
 import numpy as np
 from scipy.integrate import solve_ivp
 
-from backend.misc import flatten
+from backend.misc import n_periods_to_periodic_segment
+from backend.TrajectoryStore import TrajectoryStore
 from backend.exceptions.Trajectory_exceptions import *
 
 
+# Methods of solve_ivp that use Jacobian
+IMPLICIT_METHODS = ("Radau", "BDF", "LSODA")
+
+# How solution is sampled, see sampling_kwargs
+SAMPLING_MODES = ("solver", "uniform")
+
+# How solution was integrated: at once, in chunks or stacked with other
+# trajectories, numbers differ a bit between them
+INTEGRATION_MODES = ("single", "chunks", "ensemble")
+
+
+def sampling_kwargs(t_start, t_end, t_N, sampling: str = "solver") -> dict:
+    """
+    Arguments of solve_ivp that define which samples of solution are stored.
+
+    Args:
+        sampling: "solver" keeps every step of the solver, steps are limited
+            so that there are about t_N/5 of them or more. "uniform" lets
+            the solver choose its steps freely and fills exactly t_N
+            equally spaced samples from its dense output.
+    """
+    if sampling == "uniform":
+        return {"max_step": np.inf,
+                "t_eval": np.linspace(t_start, t_end, max(int(t_N), 2))}
+    if sampling != "solver":
+        raise UnknownSamplingModeException(sampling)
+    # TODO rework this magic number in max_step
+    return {"max_step": abs((t_end-t_start)/t_N * 5), "t_eval": None}
+
+
 class Trajectory():
     def __init__(self, ODEs, initial_state):
         self._ODEs: Callable = ODEs
@@ -16,8 +46,24 @@ class Trajectory():
 
         self._dt = None
         self._integrated = False
-
-        # The result of solve_ivp as if variables are not periodic
+        self._processed = False
+
+        # Integration settings, needed to continue integration
+        self._pars: np.ndarray | None = None
+        self._t_start: float | None = None
+        self._t_end: float | None = None
+        self._t_N: int | None = None
+        self._max_step: float | None = None
+        self._alg: str | None = None
+        self._rtol: float | None = None
+        self._atol: float | None = None
+        self._jacobian: Callable | None = None
+        self._sampling: str = "solver"
+        self._integration: str = "single"
+        self._periodic_data: Dict[int, Tuple[float, float]] = {}
+
+        # The result of solve_ivp as if variables are not periodic,
+        # released once it is processed
         self._y_sol_raw: np.ndarray | None = None
         self._t_sol_raw: np.ndarray | None = None
         self._y_events_raw: List[np.ndarray] | None = None
@@ -27,18 +73,75 @@ class Trajectory():
         self._y_events_sorted: np.ndarray | None = None  # TODO Check type
         self._t_events_sorted: np.ndarray | None = None  # TODO Check type
 
-        # Raw solution with inserted events
-        self._y_sol_ful: np.ndarray | None = None
+        # Times of raw solution with inserted events
         self._t_sol_ful: np.ndarray | None = None
 
-        # Solutions splited by events
+        # Indexes of inserted events in _t_sol_ful
+        self._i_events: np.ndarray | None = None
+
+        # [start, stop) offsets of solutions splited by events
+        # in _t_sol_ful and in buffer with (translated) y solutions.
+        # Without periodic variables the buffer is the raw solution with
+        # inserted events, otherwise segments are packed one after another
+        # and shifted by whole periods, see _translate_to_period
+        self._i_segments: np.ndarray | None = None
+        self._i_y_sols: np.ndarray | None = None
+        self._y_sols_buf: np.ndarray | None = None
+        # Shifts of segments along periodic dims, (dims, segments)
+        self._shifts: np.ndarray | None = None
+        self._periodic_dims: np.ndarray | None = None
+        # Type of the buffer above, float32 is enough for display
+        self._dtype: np.dtype = np.dtype(np.float64)
+        # The last sample not rounded to the type of the buffer,
+        # integration is continued from it
+        self._last_state: np.ndarray | None = None
+
+        # Solutions splited by events, views into buffers above
         self._y_sols: List[np.ndarray] | None = None
         self._t_sols: List[np.ndarray] | None = None
+
+        # On-disk store of the buffers _t_sol_ful and _y_sols_buf,
+        # then they are memory-mapped, see move_to_store
+        self._store: TrajectoryStore | None = None
+        return
+
+    def __getstate__(self):
+        # ODEs loaded from file can not be pickled, and views
+        # would be pickled as separate copies, so both are left out.
+        # Stored buffers are mapped from the store again.
+        state = self.__dict__.copy()
+        state["_ODEs"] = None
+        state["_jacobian"] = None
+        state["_y_sols"] = None
+        state["_t_sols"] = None
+        if self._store is not None:
+            state["_t_sol_ful"] = None
+            state["_y_sols_buf"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._store is not None and self._store.is_complete():
+            self.map_store(self._store)
+        elif self._y_sols_buf is not None:
+            self._make_views()
         return
 
+    def __copy__(self):
+        # Shallow copy shares arrays, none of the methods below
+        # write into existing arrays, so the copy can be extended safely
+        trajectory = Trajectory.__new__(Trajectory)
+        trajectory.__dict__.update(self.__dict__)
+        if self._y_sols is not None:
+            trajectory._y_sols = list(self._y_sols)
+            trajectory._t_sols = list(self._t_sols)
+        return trajectory
+
     @property
     def y_sol(self):
-        return self._y_sol_ful
+        # Not translated solution with inserted events, it is not stored
+        # for periodic variables, so it is assembled from segments
+        return self._y_ful(0, len(self._t_sol_ful))
 
     @property
     def t_sol(self):
@@ -60,6 +163,24 @@ class Trajectory():
     def t_events(self):
         return self._t_events_sorted
 
+    @property
+    def ODEs(self):
+        return self._ODEs
+
+    @ODEs.setter
+    def ODEs(self, value):
+        self._ODEs = value
+        return
+
+    @property
+    def jacobian(self):
+        return self._jacobian
+
+    @jacobian.setter
+    def jacobian(self, value):
+        self._jacobian = value
+        return
+
     @property
     def init_state(self):
         return self._initial_state
@@ -71,7 +192,32 @@ class Trajectory():
 
     @property
     def last_state(self):
-        return self._y_sol_ful[:, -1]
+        if self._last_state is not None:
+            return self._last_state
+        N_ful = len(self._t_sol_ful)
+        return self._y_ful(N_ful-1, N_ful)[:, 0]
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    @property
+    def store(self) -> TrajectoryStore | None:
+        return self._store
+
+    @property
+    def nbytes(self) -> int:
+        # Memory held by arrays, buffers shared between fields counted once,
+        # memory-mapped ones are on disk
+        arrays = [self._y_sol_raw, self._t_sol_raw,
+                  self._y_events_sorted, self._t_events_sorted,
+                  self._t_sol_ful, self._i_events, self._shifts,
+                  self._i_segments, self._i_y_sols, self._y_sols_buf]
+        arrays += list(self._y_events_raw or []) + list(self._t_events_raw or [])
+        unique_arrays = {id(array): array for array in arrays
+                         if isinstance(array, np.ndarray)
+                         and not isinstance(array, np.memmap)}
+        return sum(array.nbytes for array in unique_arrays.values())
 
     @staticmethod
     def is_empty_events_raw(yev: List[np.ndarray], tev: List[np.ndarray]) -> bool:
@@ -83,156 +229,793 @@ class Trajectory():
                 return False
         return True
 
-    def integrate_scipy(
-            self, pars, t_start, t_end, t_N,
-            periodic_events: List[Callable] = [],
-            alg: str = "RK45", rtol: float = 1e-5, atol: float = 1e-5
-    ) -> None:
-
+    def _solve(
+            self, pars, t_start, t_end, y0, max_step,
+            periodic_events: List[Callable], alg: str, rtol: float, atol: float,
+            should_stop: Callable[[], bool] | None,
+            jacobian: Callable | None = None,
+            t_eval: np.ndarray | None = None
+    ):
         # TODO add "exploded to infinity" event
         all_events = periodic_events
         t_span = (t_start, t_end)
-        self._dt = "+" if (t_end > t_start) else "-"
 
-        # TODO rework this magic number in max_step
-        max_step = abs((t_end-t_start)/t_N * 5)
+        def rhs(t, U0):
+            # Let the caller abort a long integration, e.g. a stale one
+            if (should_stop is not None) and should_stop():
+                raise IntegrationCancelledException()
+            return self._ODEs(U0, pars, t)
+
+        # Implicit methods estimate Jacobian with n+1 calls of rhs
+        # unless it is given, explicit ones do not use it at all
+        jac_kwargs = {}
+        if alg in IMPLICIT_METHODS and jacobian is not None:
+            jac_kwargs["jac"] = lambda t, U: jacobian(U, pars, t)
 
         sol = solve_ivp(
-            lambda t, U0: self._ODEs(U0, np.array(pars), t),
+            rhs,
             t_span=t_span,
-            y0=self._initial_state,
+            y0=y0,
             max_step=max_step,
+            t_eval=t_eval,
             method=alg, rtol=rtol, atol=atol,
-            events=all_events
+            events=all_events,
+            **jac_kwargs
         )
+        return sol
+
+    def integrate_scipy(
+            self, pars, t_start, t_end, t_N,
+            periodic_events: List[Callable] = [],
+            alg: str = "RK45", rtol: float = 1e-5, atol: float = 1e-5,
+            should_stop: Callable[[], bool] | None = None,
+            jacobian: Callable | None = None,
+            sampling: str = "solver"
+    ) -> None:
+        pars = np.array(pars)
+        kwargs = sampling_kwargs(t_start, t_end, t_N, sampling)
+        max_step = kwargs["max_step"]
+
+        sol = self._solve(pars, t_start, t_end, self._initial_state, max_step,
+                          periodic_events, alg, rtol, atol, should_stop,
+                          jacobian, kwargs["t_eval"])
 
         # Get raw solution and raw events from solve_ivp
-        self._y_sol_raw, self._t_sol_raw = sol.y, sol.t
-        self._y_events_raw, self._t_events_raw = sol.y_events, sol.t_events
+        self.set_raw_solution(t_start, t_end, sol.y, sol.t,
+                              sol.y_events, sol.t_events,
+                              pars=pars, t_N=t_N, max_step=max_step,
+                              alg=alg, rtol=rtol, atol=atol,
+                              jacobian=jacobian,
+                              sampling=sampling)
+        return
+
+    def integrate_scipy_chunks(
+            self, pars, t_start, t_end, t_N,
+            periodic_events: List[Callable] = [],
+            periodic_data: Dict[int, Tuple[float, float]] = {},
+            alg: str = "RK45", rtol: float = 1e-5, atol: float = 1e-5,
+            should_stop: Callable[[], bool] | None = None,
+            jacobian: Callable | None = None,
+            sampling: str = "solver", n_chunks: int = 8,
+            dtype: np.dtype | type = np.float64,
+            store: TrajectoryStore | None = None, chunk_N: int = 2**18
+    ) -> Iterator[int]:
+        """
+        Integrate and process trajectory chunk by chunk, so that its
+        beginning can be shown long before the whole time span is done.
+        Every chunk is twice as long as the previous one, so the first one
+        takes 1/2**(n_chunks-1) of time span and all chunks together are
+        processed in about the same time as the whole trajectory at once.
+
+        With store, solution is written to it chunk by chunk instead,
+        chunks are of the same length of about chunk_N of t_N samples,
+        so that only one chunk is kept in memory at a time.
+
+        Yields:
+            Index of the first segment of y_sols and t_sols changed by the
+            chunk, segments before it stay as they were
+        """
+        pars = np.array(pars)
+        kwargs = sampling_kwargs(t_start, t_end, t_N, sampling)
+        max_step, t_eval = kwargs["max_step"], kwargs["t_eval"]
+
+        if store is None:
+            fractions = 2.0**np.arange(1-n_chunks, 1)
+        else:
+            n_chunks = max(ceil(t_N / chunk_N), 1)
+            fractions = np.arange(1, n_chunks+1) / n_chunks
+        if t_eval is None:
+            t_bounds = t_start + fractions*(t_end-t_start)
+            t_evals = [None]*n_chunks
+        else:
+            # Chunks end at samples, so every chunk starts with
+            # the last sample of the previous one
+            i_bounds = np.unique(np.maximum(
+                np.round(fractions*(len(t_eval)-1)).astype(int), 1))
+            i_starts = np.concatenate(([0], i_bounds[:-1]))
+            t_bounds = t_eval[i_bounds]
+            t_evals = [t_eval[i_start:i_stop+1]
+                       for (i_start, i_stop) in zip(i_starts, i_bounds)]
+        t_bounds[-1] = t_end
+
+        sol = self._solve(pars, t_start, t_bounds[0], self._initial_state,
+                          max_step, periodic_events, alg, rtol, atol,
+                          should_stop, jacobian, t_evals[0])
+        self.set_raw_solution(t_start, t_end, sol.y, sol.t,
+                              sol.y_events, sol.t_events,
+                              pars=pars, t_N=t_N, max_step=max_step,
+                              alg=alg, rtol=rtol, atol=atol,
+                              jacobian=jacobian,
+                              sampling=sampling, integration="chunks")
+        self._t_end = t_bounds[0]
+        self.process_periodic_variables(periodic_data, dtype)
+        if store is not None:
+            self.move_to_store(store)
+        yield 0
+
+        for (t_bound, t_eval_chunk) in zip(t_bounds[1:], t_evals[1:]):
+            k = len(self._i_segments) - 1
+            self._extend(t_bound, periodic_events, should_stop, t_eval_chunk)
+            self._t_end = t_bound
+            yield k
+        return
+
+    def set_raw_solution(
+            self, t_start, t_end,
+            y_sol: np.ndarray, t_sol: np.ndarray,
+            y_events: List[np.ndarray] | None,
+            t_events: List[np.ndarray] | None,
+            pars=None, t_N: int | None = None, max_step: float | None = None,
+            alg: str = "RK45", rtol: float = 1e-5, atol: float = 1e-5,
+            jacobian: Callable | None = None,
+            sampling: str = "solver", integration: str = "single"
+    ) -> None:
+        # Used by integrate_scipy and by integrators that solve
+        # several trajectories at once (see TrajectoryEnsemble)
+        self._dt = "+" if (t_end > t_start) else "-"
+        self._y_sol_raw, self._t_sol_raw = y_sol, t_sol
+        self._y_events_raw = y_events if y_events is not None else []
+        self._t_events_raw = t_events if t_events is not None else []
+
+        self._pars = np.array(pars) if pars is not None else None
+        self._t_start, self._t_end = t_start, t_end
+        self._t_N, self._max_step = t_N, max_step
+        self._alg, self._rtol, self._atol = alg, rtol, atol
+        self._jacobian = jacobian
+        self._sampling = sampling
+        self._integration = integration
 
         self._integrated = True
+        self._processed = False
         return
 
-    def process_periodic_variables(
-        self, periodic_data: Dict[int, Tuple[float, float]] = {}
+    def can_change_t_end(
+            self, pars, initial_state, t_start, t_end, t_N,
+            alg: str = "RK45", rtol: float = 1e-5, atol: float = 1e-5,
+            sampling: str = "solver"
+    ) -> bool:
+        """
+        Check if trajectory with given settings can be obtained from this one
+        by change_t_end, i.e. only t_end is different.
+        Uniform samples depend on t_end, so such trajectory can not be changed.
+        """
+        if not self._processed or self._pars is None:
+            return False
+        # Copies share the store, changing one would change the others
+        if self._store is not None:
+            return False
+        if not (sampling == self._sampling == "solver"):
+            return False
+        dt = "+" if (t_end > t_start) else "-"
+        return (dt == self._dt) and (t_end != t_start) \
+            and (t_start == self._t_start) and (t_N == self._t_N) \
+            and (alg, rtol, atol) == (self._alg, self._rtol, self._atol) \
+            and np.array_equal(pars, self._pars) \
+            and np.array_equal(initial_state, self._initial_state)
+
+    def change_t_end(
+            self, t_end,
+            periodic_events: List[Callable] = [],
+            should_stop: Callable[[], bool] | None = None
     ) -> None:
+        """
+        Continue integration from the last state up to new t_end,
+        or truncate the solution if new t_end is closer to t_start.
+        Only the last segment and the new tail are processed again,
+        without periodic variables only the new tail.
+        """
+        if not self._processed:
+            raise NotIntegratedYetException()
+
+        sign = 1.0 if self._dt == "+" else -1.0
+        if sign*(t_end - self._t_end) > 0:
+            self._extend(t_end, periodic_events, should_stop)
+        elif sign*(t_end - self._t_end) < 0:
+            self._truncate(t_end)
+        self._t_end = t_end
+        return
+
+    def _n_not_after(self, ts: np.ndarray, t) -> int:
+        # Number of leading samples of ts not after t along _dt
+        if self._dt == "+":
+            return int(np.searchsorted(ts, t, side="right"))
+        return int(np.searchsorted(-ts, -t, side="right"))
+
+    def _extend(self, t_end, periodic_events, should_stop,
+                t_eval: np.ndarray | None = None) -> None:
+        # Last sample is never an event, after truncation it may be
+        # before _t_end. If given, t_eval has to start with it as well.
+        sol = self._solve(self._pars, self._t_sol_ful[-1], t_end,
+                          self.last_state, self._max_step,
+                          periodic_events, self._alg, self._rtol, self._atol,
+                          should_stop, self._jacobian,
+                          t_eval)
+
+        # First sample of the new solution repeats the last sample
+        ys_new, ts_new = sol.y[:, 1:], sol.t[1:]
+        y_events_new = sol.y_events if sol.y_events is not None else []
+        t_events_new = sol.t_events if sol.t_events is not None else []
+
+        # Last segment has no events inside, it is continued by the new tail
+        k = len(self._i_segments) - 1
+        self._continue_segment(k, self._i_segments[k, 1] - 1, ys_new, ts_new,
+                               y_events_new, t_events_new)
+        return
+
+    def _truncate(self, t_end) -> None:
+        N_variables = self._y_sols_buf.shape[0]
+        i_stop = self._n_not_after(self._t_sol_ful, t_end)
+
+        # Linearly interpolated sample at t_end closes the solution
+        y_end = np.empty((N_variables, 0))
+        t_end_sample = np.empty(0)
+        if self._t_sol_ful[i_stop-1] != t_end:
+            (t0, t1) = self._t_sol_ful[i_stop-1:i_stop+1]
+            (y0, y1) = self._y_ful(i_stop-1, i_stop+1).T
+            w = (t_end - t0) / (t1 - t0)
+            y_end = ((1-w)*y0 + w*y1)[:, None]
+            t_end_sample = np.array([t_end])
+
+        # Segment with the new last sample is continued by it, later ones dropped
+        k = int(np.searchsorted(self._i_segments[:, 0], i_stop-1, side="right")) - 1
+        self._continue_segment(k, i_stop-1, y_end, t_end_sample, [], [])
+        return
+
+    def _continue_segment(self, k: int, i_last: int, ys_new, ts_new,
+                          y_events, t_events) -> None:
+        # Replace samples of k-th segment after its sample i_last, and all
+        # later segments, by new samples. Only the new samples are processed,
+        # unless periodic segment is then shifted by other number of periods,
+        # as its mean moved to another period, then all of it is processed again.
+        i_from = i_last
+        tail = self._processed_tail(i_from, i_last, ys_new, ts_new,
+                                    y_events, t_events)
+        if self._shifts is not None and \
+                not np.array_equal(tail._shifts[:, 0], self._shifts[:, k]):
+            i_from = self._i_segments[k, 0]
+            tail = self._processed_tail(i_from, i_last, ys_new, ts_new,
+                                        y_events, t_events)
+        self._process_tail(k, tail, i_from)
+        return
 
+    def _processed_tail(self, i_from: int, i_last: int, ys_new, ts_new,
+                        y_events, t_events) -> "Trajectory":
+        # Samples [i_from, i_last] followed by new ones, processed
+        # as a trajectory of its own
+        ys_tail = np.concatenate((self._y_ful(i_from, i_last+1), ys_new), axis=1)
+        ts_tail = np.concatenate((self._t_sol_ful[i_from:i_last+1], ts_new))
+        tail = Trajectory(self._ODEs, ys_tail[:, 0])
+        tail.set_raw_solution(ts_tail[0], ts_tail[-1], ys_tail, ts_tail,
+                              y_events, t_events)
+        tail._dt = self._dt
+        tail.process_periodic_variables(self._periodic_data, self._dtype)
+        return tail
+
+    def _y_ful(self, i_from: int, i_stop: int) -> np.ndarray:
+        # Not translated samples [i_from, i_stop) of solution with inserted
+        # events, gathered from segments in buffer and shifted back
+        if self._shifts is None:
+            # Buffer is the solution itself, mapped buffer is read lazily
+            return self._y_sols_buf[:, i_from:i_stop].astype(float, copy=False)
+        i_ful = np.arange(i_from, i_stop)
+        k = np.searchsorted(self._i_segments[:, 0], i_ful, side="right") - 1
+        ys = self._y_sols_buf[:, i_ful - self._i_segments[k, 0] + self._i_y_sols[k, 0]]
+        ys = ys.astype(float, copy=False)
+        if self._shifts is not None:
+            ys[self._periodic_dims] += self._shifts[:, k]
+        return ys
+
+    def _process_tail(self, k, tail: "Trajectory", i_from: int) -> None:
+        # Replace samples from i_from on, in k-th segment, by processed tail.
+        # The first segment of tail continues k-th segment, see _continue_segment.
+        i_segment_from = self._i_segments[k, 0]
+        i_buf_from = self._i_y_sols[k, 0] + (i_from - i_segment_from)
+
+        # Events up to the first sample of tail are kept
+        N_events_kept = self._n_not_after(self._t_events_sorted,
+                                          self._t_sol_ful[i_from])
+        self._y_events_sorted = np.concatenate(
+            (self._y_events_sorted[:N_events_kept], tail._y_events_sorted))
+        self._t_events_sorted = np.concatenate(
+            (self._t_events_sorted[:N_events_kept], tail._t_events_sorted))
+
+        self._i_events = np.concatenate(
+            (self._i_events[self._i_events <= i_from], tail._i_events + i_from))
+        i_segments_tail = tail._i_segments + i_from
+        i_segments_tail[0, 0] = i_segment_from
+        self._i_segments = np.concatenate((self._i_segments[:k], i_segments_tail))
+
+        # Without periodic variables segments overlap in buffer at events,
+        # then buffer offsets are the same as segment offsets
+        if self._store is None:
+            self._t_sol_ful = np.concatenate(
+                (self._t_sol_ful[:i_from], tail._t_sol_ful))
+            self._y_sols_buf = np.concatenate(
+                (self._y_sols_buf[:, :i_buf_from], tail._y_sols_buf), axis=1)
+        else:
+            # k-th segment is the last one in buffer, so the tail replaces
+            # its end and the buffer never grows by more than the new samples.
+            # The first sample of tail is sample i_from, it is only written
+            # again if the segment is shifted by other number of periods,
+            # so that continued solution is appended to the store.
+            i_skip = 1 if self._shifts is None or np.array_equal(
+                tail._shifts[:, 0], self._shifts[:, k]) else 0
+            self._t_sol_ful = self._store.write("t", i_from+1, tail._t_sol_ful[1:])
+            self._y_sols_buf = self._store.write(
+                "y", i_buf_from+i_skip, tail._y_sols_buf[:, i_skip:])
+        i_y_sols_tail = tail._i_y_sols + i_buf_from
+        i_y_sols_tail[0, 0] = i_buf_from - (i_from - i_segment_from)
+        self._i_y_sols = np.concatenate((self._i_y_sols[:k], i_y_sols_tail))
+        self._last_state = tail._last_state
+        if self._shifts is not None:
+            self._shifts = np.concatenate(
+                (self._shifts[:, :k], tail._shifts), axis=1)
+        self._make_views()
+        return
+
+    def process_periodic_variables(
+        self, periodic_data: Dict[int, Tuple[float, float]] = {},
+        dtype: np.dtype | type = np.float64
+    ) -> None:
+        """
+        Insert events into solution, split it by events and translate
+        segments of periodic variables to period. Raw solution is
+        released afterwards, only segments are kept in one buffer.
+
+        Args:
+            periodic_data: offset and period of every periodic variable
+            dtype: type of the buffer with y solutions, float32 halves
+                memory of trajectories that are only displayed
+        """
         if not self._integrated:
             raise NotIntegratedYetException()
+        if self._y_sol_raw is None:
+            self._restore_raw()
 
+        self._periodic_data = periodic_data
+        self._dtype = np.dtype(dtype)
         self._flatten_and_sort_events()
         self._insert_events()
         self._split()
         self._translate_to_period(periodic_data)
+        self._processed = True
+        if self._store is not None:
+            self.move_to_store(self._store)
         return
 
-    def _flatten_and_sort_events(self) -> None:
-        if self.is_empty_events_raw(self._y_events_raw, self._t_events_raw):
-            self._y_events_sorted = []
-            self._t_events_sorted = []
-            return
+    def move_to_store(self, store: TrajectoryStore) -> None:
+        """
+        Write buffers of processed trajectory to store and read them
+        from there lazily. Solution added by change_t_end or by
+        integrate_scipy_chunks is written to store as well.
+        """
+        if not self._processed:
+            raise NotIntegratedYetException()
+        self._t_sol_ful = store.write("t", 0, self._t_sol_ful)
+        self._y_sols_buf = store.write("y", 0, self._y_sols_buf)
+        self._store = store
+        self._make_views()
+        return
 
-        ys_flat = flatten(self._y_events_raw)
-        ts_flat = flatten(self._t_events_raw)
+    def map_store(self, store: TrajectoryStore) -> None:
+        # Buffers already written to store, e.g. of loaded trajectory
+        self._t_sol_ful = store.array("t")
+        self._y_sols_buf = store.array("y")
+        self._store = store
+        self._make_views()
+        return
 
-        ys_ts_zip = zip(ys_flat, ts_flat)
-        ys_ts_sorted = sorted(ys_ts_zip, key=lambda y_t_pair: y_t_pair[1])
-        ys_sorted, ts_sorted = list(zip(*ys_ts_sorted))
+    def save_state(self) -> Tuple[dict, Dict[str, np.ndarray]]:
+        """
+        State of processed trajectory, e.g. to save it in a session file,
+        see load_state. ODEs and jacobian are not saved.
 
-        self._y_events_sorted = ys_sorted
-        self._t_events_sorted = ts_sorted
+        Returns:
+            JSON-compatible settings and arrays
+        """
+        if not self._processed:
+            raise NotIntegratedYetException()
+        settings = {
+            "dt": self._dt,
+            "t_start": float(self._t_start), "t_end": float(self._t_end),
+            "t_N": None if self._t_N is None else int(self._t_N),
+            "max_step": None if self._max_step is None else float(self._max_step),
+            "alg": self._alg, "rtol": self._rtol, "atol": self._atol,
+            "sampling": self._sampling,
+            "integration": self._integration,
+            "periodic_data": [[int(dim), float(offset), float(period)]
+                              for (dim, (offset, period))
+                              in self._periodic_data.items()],
+            "dtype": self._dtype.name}
+        arrays = {
+            "initial_state": np.asarray(self._initial_state),
+            "y_events": self._y_events_sorted, "t_events": self._t_events_sorted,
+            "t_sol": self._t_sol_ful, "i_events": self._i_events,
+            "i_segments": self._i_segments, "i_y_sols": self._i_y_sols,
+            "y_sols_buf": self._y_sols_buf, "last_state": self.last_state}
+        if self._pars is not None:
+            arrays["pars"] = self._pars
+        if self._shifts is not None:
+            arrays["shifts"] = self._shifts
+            arrays["periodic_dims"] = self._periodic_dims
+        return (settings, arrays)
+
+    def load_state(self, settings: dict, arrays: Dict[str, np.ndarray]) -> None:
+        # State saved by save_state, arrays may be read from file lazily,
+        # so every one of them is read once
+        self._initial_state = np.asarray(arrays["initial_state"])
+        self._pars = np.asarray(arrays["pars"]) if "pars" in arrays else None
+        self._dt = settings["dt"]
+        self._t_start, self._t_end = settings["t_start"], settings["t_end"]
+        self._t_N, self._max_step = settings["t_N"], settings["max_step"]
+        self._alg, self._rtol, self._atol = \
+            settings["alg"], settings["rtol"], settings["atol"]
+        self._sampling = settings["sampling"]
+        self._integration = settings.get("integration", "single")
+        self._periodic_data = {dim: (offset, period) for (dim, offset, period)
+                               in settings["periodic_data"]}
+        self._dtype = np.dtype(settings["dtype"])
+
+        self._y_events_sorted = arrays["y_events"]
+        self._t_events_sorted = arrays["t_events"]
+        self._t_sol_ful = arrays["t_sol"]
+        self._i_events = arrays["i_events"]
+        self._i_segments = arrays["i_segments"]
+        self._i_y_sols = arrays["i_y_sols"]
+        self._y_sols_buf = arrays["y_sols_buf"]
+        self._last_state = np.asarray(arrays["last_state"], dtype=float) \
+            if "last_state" in arrays else None
+        self._shifts, self._periodic_dims = None, None
+        if "shifts" in arrays:
+            self._shifts = arrays["shifts"]
+            self._periodic_dims = arrays["periodic_dims"]
+
+        self._y_sol_raw, self._t_sol_raw = None, None
+        self._y_events_raw, self._t_events_raw = None, None
+        self._store = None
+        self._integrated = True
+        self._processed = True
+        self._make_views()
         return
 
-    def _insert_events(self) -> None:
-        ys = self._y_sol_raw.copy()
-        ts = self._t_sol_raw.copy()
-
-        for (i, t_event) in enumerate(self._t_events_sorted):
-            state_to_insert = self._y_events_sorted[i]
-            time_to_insert = t_event
-            for (j, t) in enumerate(ts):
-                if (self._dt == "+") and (t >= t_event):
-                    ys = np.insert(ys, j, state_to_insert, axis=1)
-                    ts = np.insert(ts, j, time_to_insert)
-                    break
-                if (self._dt == "-") and (t <= t_event):
-                    ys = np.insert(ys, j, state_to_insert, axis=1)
-                    ts = np.insert(ts, j, time_to_insert)
-                    break
-
-        self._y_sol_ful = ys
-        self._t_sol_ful = ts
+    def _restore_raw(self) -> None:
+        # Raw solution of already processed trajectory, to process it again,
+        # stored one is written to its store again afterwards
+        is_raw = np.ones(len(self._t_sol_ful), dtype=bool)
+        is_raw[self._i_events] = False
+        self._y_sol_raw = self.y_sol[:, is_raw]
+        self._y_sol_raw[:, -1] = self.last_state
+        self._t_sol_raw = self._t_sol_ful[is_raw]
+        self._y_events_raw = [self._y_events_sorted,]
+        self._t_events_raw = [self._t_events_sorted,]
         return
 
-    def _split(self) -> None:
-        # In case of no events
-        if not self._t_events_sorted:
-            self._y_sols = [self._y_sol_ful,]
-            self._t_sols = [self._t_sol_ful,]
+    def _flatten_and_sort_events(self) -> None:
+        N_variables = self._y_sol_raw.shape[0]
+        if self.is_empty_events_raw(self._y_events_raw, self._t_events_raw):
+            self._y_events_sorted = np.empty((0, N_variables))
+            self._t_events_sorted = np.empty(0)
             return
 
-        # Find temporal indexes of events in t_sol
-        i_events = []
-        for t_event in self._t_events_sorted:
-            for (i, t) in enumerate(self._t_sol_ful):
-                if (t == t_event) or isclose(t, t_event):
-                    i_events.append(i)
-                    break
+        ys_flat = np.concatenate(
+            [np.reshape(y, (-1, N_variables)) for y in self._y_events_raw])
+        ts_flat = np.concatenate(self._t_events_raw)
 
+        # Sort along the direction of integration
+        order = np.argsort(ts_flat, kind="stable")
         if self._dt == "-":
-            i_events = list(reversed(i_events))
-
-        # Add first and last temporal indexes, makes algorithm easier
-        if (i_events[0] != 0):
-            i_events.insert(0, 0)
-        if (i_events[-1] != len(self._t_sol_ful)):
-            i_events.append(len(self._t_sol_ful))
+            order = order[::-1]
 
-        yss, tss = [], []
+        self._y_events_sorted = ys_flat[order]
+        self._t_events_sorted = ts_flat[order]
+        return
 
-        # Split y_sol and t_sol by i_events
-        for i in range(len(i_events)-1):
-            left = i_events[i]
-            right = i_events[i+1] + 1 \
-                if (i != len(i_events)-1) else i_events[i+1]
-            yss.append(self._y_sol_ful[:, left:right].copy())
-            tss.append(self._t_sol_ful[left:right].copy())
+    def _insert_events(self) -> None:
+        ys = self._y_sol_raw
+        ts = self._t_sol_raw
+        ys_events = self._y_events_sorted
+        ts_events = self._t_events_sorted
+
+        # Event goes right before the first sample
+        # that is not earlier (along _dt) than the event
+        if self._dt == "+":
+            i_insert = np.searchsorted(ts, ts_events, side="left")
+        else:
+            i_insert = np.searchsorted(-ts, -ts_events, side="left")
+
+        # Events past the last sample are dropped
+        inside = i_insert < len(ts)
+        i_insert = i_insert[inside]
+        N_events = len(i_insert)
+        N_ful = len(ts) + N_events
+
+        # Indexes of events in the merged arrays
+        i_events = i_insert + np.arange(N_events)
+        is_event = np.zeros(N_ful, dtype=bool)
+        is_event[i_events] = True
+
+        ys_ful = np.empty((ys.shape[0], N_ful), dtype=self._dtype)
+        # Times stay float64, float32 ones would be visibly rounded
+        # on long time spans
+        ts_ful = np.empty(N_ful, dtype=ts.dtype)
+        ys_ful[:, ~is_event] = ys
+        ts_ful[~is_event] = ts
+        ys_ful[:, is_event] = ys_events[inside].T
+        ts_ful[is_event] = ts_events[inside]
+
+        # Raw solution is not needed any more, events are never
+        # after its last sample, so that is the last one of the solution
+        self._last_state = np.array(ys[:, -1], dtype=float)
+        self._y_sol_raw, self._t_sol_raw = None, None
+        self._y_events_raw, self._t_events_raw = None, None
+
+        self._y_sols_buf = ys_ful
+        self._t_sol_ful = ts_ful
+        self._i_events = i_events
+        return
 
-        self._y_sols = yss
-        self._t_sols = tss
+    def _split(self) -> None:
+        N_ful = len(self._t_sol_ful)
+        i_events = self._i_events
+
+        # Segments go from one event to the next one, including both,
+        # so neighbouring segments share the event sample
+        starts = np.concatenate(([0], i_events))
+        stops = np.concatenate((i_events+1, [N_ful]))
+        if len(i_events) != 0 and i_events[0] == 0:
+            starts, stops = starts[1:], stops[1:]
+
+        self._i_segments = np.column_stack((starts, stops))
+        self._i_y_sols = self._i_segments
+        self._shifts, self._periodic_dims = None, None
+        self._make_views()
         return
 
     def _translate_to_period(self, periodic_data) -> None:
-        new_yss = deepcopy(self._y_sols)
-
-        # Iterate over all subsolutions
-        for i in range(len(self._y_sols)):
-
-            # Get subsolution ys[dim,time]
-            ys = self._y_sols[i]
-
-            # Calculate mean with respect to time
-            ys_mean = np.mean(ys, axis=1)
-
-            # Iterate over dims in periodic_data
-            for (j, data) in periodic_data.items():
-                offset, period = data
+        # Non periodic solution stays as views into the buffer
+        if not periodic_data:
+            return
 
-                # Calculate a number of period shifts
-                # to be ∈ [offset, offset+period]
-                n_periods = 0
-                while ys_mean[j] - n_periods*period > offset+period:
-                    n_periods += 1
-                while ys_mean[j] - n_periods*period < offset:
-                    n_periods -= 1
+        starts, stops = self._i_segments.T
+        lengths = stops - starts
+
+        # Pack all segments one after another into a single buffer,
+        # shared event samples are duplicated so segments can be shifted
+        # independently
+        packed_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        i_gather = np.arange(lengths.sum()) \
+            - np.repeat(packed_starts - starts, lengths)
+        ys_packed = self._y_sols_buf[:, i_gather]
+
+        dims = np.array(list(periodic_data.keys()))
+        offsets, periods = np.array(list(periodic_data.values())).T
+
+        # Mean of every segment along every periodic dim, shape (dims, segments)
+        ys_means = np.add.reduceat(ys_packed[dims], packed_starts, axis=1) \
+            / lengths
+
+        # Shift every segment so that its mean is in [offset, offset+period)
+        n_periods = n_periods_to_periodic_segment(
+            ys_means, offsets[:, None], periods[:, None])
+        shifts = n_periods * periods[:, None]
+        ys_packed[dims] -= np.repeat(shifts, lengths, axis=1)
+
+        self._i_y_sols = np.column_stack((packed_starts, packed_starts+lengths))
+        self._y_sols_buf = ys_packed
+        self._shifts = shifts
+        self._periodic_dims = dims
+        self._make_views()
+        return
 
-                # Create one-hot-row matrix
-                # and shift solution along one spacial dimention
-                shift = np.zeros_like(ys)
-                shift[j, :] = n_periods*period
-                ys = ys - shift
+    def _make_views(self) -> None:
+        self._y_sols = [self._y_sols_buf[:, start:stop]
+                        for (start, stop) in self._i_y_sols]
+        self._t_sols = [self._t_sol_ful[start:stop]
+                        for (start, stop) in self._i_segments]
+        return
 
-            new_yss[i] = ys
 
-        self._y_sols = new_yss
-        return
+################################################################################
+# Tests
+
+def _pendulum(U, p, t):
+    phi, y = U
+    return [y, p[0] - p[1]*y - np.sin(phi)]
+
+
+def _periodic_phi(t, y):
+    return np.sin((y[0]+np.pi)/2)
+
+
+def test_change_t_end():
+    periodic_data = {0: (-np.pi, 2*np.pi)}
+    for (t_end, t_end_new) in ((20.0, 30.0), (30.0, 20.0), (-20.0, -30.0)):
+        trajectory = Trajectory(_pendulum, np.array([0.0, 0.0]))
+        trajectory.integrate_scipy([1.5, 0.01], 0.0, t_end, 1000,
+                                   periodic_events=[_periodic_phi])
+        trajectory.process_periodic_variables(periodic_data)
+        trajectory.change_t_end(t_end_new, periodic_events=[_periodic_phi])
+
+        assert trajectory.t_sol[-1] == t_end_new
+        assert len(trajectory.y_sols) == len(trajectory.t_events) + 1
+        for (ys, ts) in zip(trajectory.y_sols, trajectory.t_sols):
+            assert ys.shape[1] == len(ts)
+            assert -np.pi <= np.mean(ys[0]) <= np.pi
+
+
+def test_uniform_sampling():
+    periodic_data = {0: (-np.pi, 2*np.pi)}
+    trajectory = Trajectory(_pendulum, np.array([0.0, 0.0]))
+    trajectory.integrate_scipy([1.5, 0.01], 0.0, 50.0, 500,
+                               periodic_events=[_periodic_phi],
+                               sampling="uniform")
+    trajectory.process_periodic_variables(periodic_data)
+
+    # Requested samples plus inserted events, regardless of solver steps
+    N_events = len(trajectory.t_events)
+    assert N_events > 0
+    assert trajectory.y_sol.shape == (2, 500 + N_events)
+    is_sample = np.ones(len(trajectory.t_sol), dtype=bool)
+    is_sample[trajectory._i_events] = False
+    assert np.allclose(trajectory.t_sol[is_sample], np.linspace(0.0, 50.0, 500))
+    assert not trajectory.can_change_t_end(
+        [1.5, 0.01], np.array([0.0, 0.0]), 0.0, 60.0, 500, sampling="uniform")
+
+
+def test_integrate_scipy_chunks():
+    periodic_data = {0: (-np.pi, 2*np.pi)}
+    trajectory = Trajectory(_pendulum, np.array([0.0, 0.0]))
+    N_segments = 0
+    for i_changed in trajectory.integrate_scipy_chunks(
+            [1.5, 0.01], 0.0, 100.0, 1000, periodic_events=[_periodic_phi],
+            periodic_data=periodic_data, n_chunks=4):
+        # Only the last segment of previous chunk is changed
+        assert i_changed == max(N_segments-1, 0)
+        N_segments = len(trajectory.y_sols)
+
+    assert trajectory.t_sol[-1] == 100.0
+    assert len(trajectory.y_sols) == len(trajectory.t_events) + 1
+    for ys in trajectory.y_sols:
+        assert -np.pi <= np.mean(ys[0]) <= np.pi
+
+
+def test_compact_storage():
+    periodic_data = {0: (-np.pi, 2*np.pi)}
+    trajectories = []
+    for dtype in (np.float64, np.float32):
+        trajectory = Trajectory(_pendulum, np.array([0.0, 0.0]))
+        trajectory.integrate_scipy([1.5, 0.01], 0.0, 50.0, 1000,
+                                   periodic_events=[_periodic_phi])
+        trajectory.process_periodic_variables(periodic_data, dtype)
+        trajectories.append(trajectory)
+    (trajectory, trajectory_32) = trajectories
+
+    # Raw solution is released, segments are views into one buffer
+    assert trajectory._y_sol_raw is None and trajectory._y_events_raw is None
+    for ys in trajectory.y_sols:
+        assert np.shares_memory(ys, trajectory._y_sols_buf)
+    assert trajectory_32.y_sols[0].dtype == np.float32
+    assert trajectory_32.nbytes < trajectory.nbytes
+
+    # Not translated solution is assembled back from segments
+    y_sol = trajectory.y_sol
+    assert np.isclose(y_sol[0, -1], trajectory.last_state[0])
+    assert np.allclose(trajectory_32.y_sol, y_sol, atol=1e-5)
+
+    # Processed again from restored raw solution
+    trajectory.process_periodic_variables()
+    assert np.array_equal(trajectory.y_sol, y_sol)
+    assert len(trajectory.y_sols) == len(trajectory.t_events) + 1
+
+    # Integration continues from the last state not rounded to float32
+    last_states = []
+    for dtype in (np.float64, np.float32):
+        trajectory = Trajectory(_pendulum, np.array([0.0, 0.0]))
+        for _ in trajectory.integrate_scipy_chunks(
+                [1.5, 0.01], 0.0, 50.0, 1000, periodic_events=[_periodic_phi],
+                periodic_data=periodic_data, dtype=dtype):
+            pass
+        trajectory.change_t_end(60.0, periodic_events=[_periodic_phi])
+        last_states.append(trajectory.last_state)
+    assert last_states[1].dtype == np.float64
+    assert np.array_equal(last_states[0], last_states[1])
+
+
+def test_trajectory_store():
+    from copy import copy
+    from os import listdir
+    from tempfile import TemporaryDirectory
+
+    def oscillator(U, p, t):
+        return [U[1], -U[0]]
+
+    periodic_data = {0: (-np.pi, 2*np.pi)}
+    with TemporaryDirectory() as folderpath:
+        # Without periodic variables chunks are appended to the store
+        trajectory = Trajectory(oscillator, np.array([1.0, 0.0]))
+        store = TrajectoryStore(folderpath + "/oscillator")
+        for _ in trajectory.integrate_scipy_chunks(
+                [], 0.0, 50.0, 10_000, store=store, chunk_N=1000,
+                sampling="uniform"):
+            assert isinstance(trajectory.y_sols[0], np.memmap)
+        assert isinstance(trajectory.y_sol, np.memmap)
+        assert trajectory.y_sol.shape == (2, 10_000)
+        assert np.allclose(trajectory.t_sol, np.linspace(0.0, 50.0, 10_000))
+        assert np.allclose(trajectory.y_sol[0], np.cos(trajectory.t_sol), atol=1e-3)
+        assert trajectory.nbytes < store.nbytes / 100
+
+        # Periodic segments are written after each other
+        trajectory = Trajectory(_pendulum, np.array([0.0, 0.0]))
+        store = TrajectoryStore(folderpath + "/pendulum")
+        chunks = trajectory.integrate_scipy_chunks(
+            [1.5, 0.01], 0.0, 100.0, 10_000, periodic_events=[_periodic_phi],
+            periodic_data=periodic_data, store=store, chunk_N=1000)
+        assert len(list(chunks)) == 10
+        assert trajectory.t_sol[-1] == 100.0
+        assert len(trajectory.y_sols) == len(trajectory.t_events) + 1
+        for (ys, ts) in zip(trajectory.y_sols, trajectory.t_sols):
+            assert ys.shape[1] == len(ts)
+            assert -np.pi <= np.mean(ys[0]) <= np.pi
+        assert not trajectory.can_change_t_end(
+            [1.5, 0.01], np.array([0.0, 0.0]), 0.0, 200.0, 10_000)
+
+        # Copy keeps its samples while the store is rewritten
+        shown = copy(trajectory)
+        (ys_shown, ts_shown) = (shown.y_sol.copy(), shown.t_sol.copy())
+        trajectory.change_t_end(50.0)
+        trajectory.change_t_end(100.0, [_periodic_phi])
+        assert np.array_equal(shown.y_sol, ys_shown)
+        assert np.array_equal(shown.t_sol, ts_shown)
+        assert trajectory.t_sol[-1] == 100.0
+
+        # Open segment is continued in place, not written again
+        swinging = Trajectory(_pendulum, np.array([0.5, 0.0]))
+        swinging_store = TrajectoryStore(folderpath + "/swinging")
+        for _ in swinging.integrate_scipy_chunks(
+                [0.0, 0.0], 0.0, 1000.0, 20_000, periodic_events=[_periodic_phi],
+                periodic_data=periodic_data, store=swinging_store, chunk_N=1000):
+            assert swinging_store.length("y") == len(swinging.t_sol)
+        # Chunks are appended to the files they started in
+        assert sorted(listdir(swinging_store.folderpath)) == ["t.0.bin", "y.0.bin"]
+        assert len(swinging.y_sols) == 1
+        assert swinging.t_sol[-1] == 1000.0
+        assert np.allclose(swinging.y_sol[1]**2/2 - np.cos(swinging.y_sol[0]),
+                           -np.cos(0.5), atol=1e-3)
+
+        # Reopened without integrating again
+        store.save(trajectory)
+        loaded = TrajectoryStore(folderpath + "/pendulum").load()
+        assert loaded.ODEs is None
+        assert np.array_equal(loaded.y_sol, trajectory.y_sol)
+        assert np.array_equal(loaded.t_events, trajectory.t_events)
+        assert all(np.array_equal(ys, ys_loaded) for (ys, ys_loaded)
+                   in zip(trajectory.y_sols, loaded.y_sols))
+        assert TrajectoryStore(folderpath + "/missing").load() is None
+
+################################################################################
+if __name__ == "__main__":
+    test_change_t_end()
+    test_uniform_sampling()
+    test_integrate_scipy_chunks()
+    test_compact_storage()
+    test_trajectory_store()
@@ -0,0 +1,185 @@
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from typing import Dict
+
+import numpy as np
+
+from backend.Trajectory import Trajectory
+
+
+class TrajectoryCache():
+    def __init__(self, max_bytes: int = 256*2**20):
+        # Processed trajectories by key, least recently used first
+        self._entries: OrderedDict[str, Trajectory] = OrderedDict()
+        self._max_bytes: int = max_bytes
+        self._n_bytes: int = 0
+
+        self._hits: int = 0
+        self._misses: int = 0
+        self._evictions: int = 0
+
+        # Cache is shared by integration worker threads
+        self._lock = Lock()
+        return
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value: int):
+        with self._lock:
+            self._max_bytes = value
+            self._evict()
+        return
+
+    @property
+    def n_bytes(self) -> int:
+        return self._n_bytes
+
+    @property
+    def stats(self) -> Dict[str, int | float]:
+        n_requests = self._hits + self._misses
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "entries": len(self._entries),
+                "bytes": self._n_bytes,
+                "hit_ratio": self._hits / n_requests
+                if n_requests else 0.0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: str):
+        return key in self._entries
+
+    @staticmethod
+    def make_key(
+            ds_hash: str, pars, initial_state, t_start, t_end, t_N,
+            alg: str = "RK45", rtol: float = 1e-5, atol: float = 1e-5,
+            sampling: str = "solver", dtype: str = "float64",
+            integration: str = "single"
+    ) -> str:
+        """
+        Content address of a trajectory: everything its solution depends on.
+        Direction of integration is given by the order of t_start and t_end,
+        integration is one of INTEGRATION_MODES of Trajectory.
+
+        Returns:
+            Hex digest, also used as name of trajectory's store
+        """
+        h = sha256()
+        h.update(ds_hash.encode())
+        h.update(np.asarray(pars, dtype=float).tobytes())
+        h.update(b"|")
+        h.update(np.asarray(initial_state, dtype=float).tobytes())
+        h.update(repr((float(t_start), float(t_end), int(t_N),
+                       alg, float(rtol), float(atol), sampling, dtype,
+                       integration)).encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def trajectory_key(ds_hash: str, trajectory: Trajectory) -> str:
+        """
+        Key of the settings trajectory was integrated with, see make_key,
+        e.g. of a loaded one. It differs from the key of a row whose
+        settings changed since, or of one still being integrated.
+        """
+        (settings, arrays) = trajectory.save_state()
+        return TrajectoryCache.make_key(
+            ds_hash, arrays.get("pars", []), arrays["initial_state"],
+            settings["t_start"], settings["t_end"], settings["t_N"],
+            alg=settings["alg"], rtol=settings["rtol"], atol=settings["atol"],
+            sampling=settings["sampling"], dtype=settings["dtype"],
+            integration=settings["integration"])
+
+    def get(self, key: str) -> Trajectory | None:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+
+            self._misses += 1
+            return None
+
+    def put(self, key: str, trajectory: Trajectory) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._n_bytes -= self._entries[key].nbytes
+                del self._entries[key]
+            self._insert(key, trajectory)
+        return
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._n_bytes = 0
+        return
+
+    def _insert(self, key: str, trajectory: Trajectory) -> None:
+        self._entries[key] = trajectory
+        self._n_bytes += trajectory.nbytes
+        self._evict()
+        return
+
+    def _evict(self) -> None:
+        # Most recently used entry is kept even if it alone exceeds budget
+        while self._n_bytes > self._max_bytes and len(self._entries) > 1:
+            (_, trajectory) = self._entries.popitem(last=False)
+            self._n_bytes -= trajectory.nbytes
+            self._evictions += 1
+        return
+
+
+################################################################################
+# Tests
+
+def test_trajectory_cache_lru_eviction():
+    def ODEs(U, p, t):
+        return [U[1], -p[0]*U[0]]
+
+    trajectories = []
+    for i in range(3):
+        trajectory = Trajectory(ODEs, np.array([float(i), 0.0]))
+        trajectory.integrate_scipy([1.0], 0.0, 1.0, 10)
+        trajectory.process_periodic_variables()
+        trajectories.append(trajectory)
+
+    cache = TrajectoryCache(max_bytes=2*trajectories[0].nbytes)
+    keys = [TrajectoryCache.make_key("ds", [1.0], t.init_state, 0.0, 1.0, 10)
+            for t in trajectories]
+    assert len(set(keys)) == 3
+
+    cache.put(keys[0], trajectories[0])
+    cache.put(keys[1], trajectories[1])
+    assert cache.get(keys[0]) is trajectories[0]
+    cache.put(keys[2], trajectories[2])
+
+    # keys[1] was the least recently used one
+    assert cache.get(keys[1]) is None
+    assert keys[0] in cache and keys[2] in cache
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 1
+    assert cache.stats["evictions"] == 1
+
+    # Key of trajectory's own settings, only t_end changed since
+    assert TrajectoryCache.trajectory_key("ds", trajectories[0]) == keys[0]
+    trajectories[0].change_t_end(2.0)
+    assert TrajectoryCache.trajectory_key("ds", trajectories[0]) == \
+        TrajectoryCache.make_key("ds", [1.0], [0.0, 0.0], 0.0, 2.0, 10)
+
+    # Chunked solution differs from the one integrated at once
+    chunked = Trajectory(ODEs, np.array([1.0, 0.0]))
+    for _ in chunked.integrate_scipy_chunks([1.0], 0.0, 1.0, 10):
+        pass
+    assert TrajectoryCache.trajectory_key("ds", chunked) == \
+        TrajectoryCache.make_key("ds", [1.0], [1.0, 0.0], 0.0, 1.0, 10,
+                                 integration="chunks")
+    assert TrajectoryCache.trajectory_key("ds", chunked) != keys[1]
+
+################################################################################
+if __name__ == "__main__":
+    test_trajectory_cache_lru_eviction()
@@ -0,0 +1,224 @@
+from typing import Callable, List
+
+import numpy as np
+from scipy.integrate import solve_ivp
+from scipy.sparse import block_diag
+
+from backend.misc import is_vectorizable, stack_rows
+from backend.Trajectory import Trajectory, IMPLICIT_METHODS, sampling_kwargs
+from backend.exceptions.Trajectory_exceptions import IntegrationCancelledException
+
+
+class TrajectoryEnsemble():
+    def __init__(self, ODEs, initial_states):
+        self._ODEs: Callable = ODEs
+
+        # Initial states stacked as columns, shape (n_vars, N)
+        self._initial_states: np.ndarray = np.array(
+            initial_states, dtype=float).T.copy()
+
+        self._vectorized: bool | None = None
+        return
+
+    @property
+    def n_vars(self) -> int:
+        return self._initial_states.shape[0]
+
+    @property
+    def N(self) -> int:
+        return self._initial_states.shape[1]
+
+    @property
+    def vectorized(self) -> bool | None:
+        return self._vectorized
+
+    def is_vectorizable(self, pars) -> bool:
+        return is_vectorizable(self._ODEs, self._initial_states, pars)
+
+    def _rhs(self, pars, should_stop=None) -> Callable:
+        n_vars, N = self.n_vars, self.N
+
+        if self._vectorized:
+            def rhs(t, Y):
+                if (should_stop is not None) and should_stop():
+                    raise IntegrationCancelledException()
+                Us = Y.reshape(n_vars, N)
+                return stack_rows(self._ODEs(Us, pars, t), N).reshape(-1)
+        else:
+            def rhs(t, Y):
+                if (should_stop is not None) and should_stop():
+                    raise IntegrationCancelledException()
+                Us = Y.reshape(n_vars, N)
+                dUs = np.empty_like(Us)
+                for k in range(N):
+                    dUs[:, k] = self._ODEs(Us[:, k], pars, t)
+                return dUs.reshape(-1)
+        return rhs
+
+    def _jac_kwargs(self, pars, alg: str, jacobian: Callable | None) -> dict:
+        # Members do not depend on each other, so Jacobian of the stacked
+        # system is block diagonal, with blocks in order of member states
+        if alg not in IMPLICIT_METHODS:
+            return {}
+
+        n_vars, N = self.n_vars, self.N
+        # Stacked state is (n_vars, N) flattened, reorder it member by member
+        order = np.arange(n_vars*N).reshape(n_vars, N).T.reshape(-1)
+        inverse_order = np.argsort(order)
+
+        if jacobian is None:
+            sparsity = block_diag([np.ones((n_vars, n_vars))]*N, format="csr")
+            return {"jac_sparsity": sparsity[inverse_order][:, inverse_order]}
+
+        def jac(t, Y):
+            Us = Y.reshape(n_vars, N)
+            blocks = [np.asarray(jacobian(Us[:, k], pars, t), dtype=float)
+                      for k in range(N)]
+            J = block_diag(blocks, format="csr")
+            return J[inverse_order][:, inverse_order]
+        return {"jac": jac}
+
+    def _member_events(self, periodic_events: List[Callable]) -> List[Callable]:
+        # Every event of every member is tracked separately,
+        # ordered as [member 0 events..., member 1 events..., ...]
+        n_vars, N = self.n_vars, self.N
+        member_events = []
+        for k in range(N):
+            for event in periodic_events:
+                member_event = lambda t, Y, event=event, k=k: \
+                    event(t, Y.reshape(n_vars, N)[:, k])
+                # solve_ivp reads these from the event function itself
+                member_event.terminal = getattr(event, "terminal", False)
+                member_event.direction = getattr(event, "direction", 0)
+                member_events.append(member_event)
+        return member_events
+
+    def integrate_scipy(
+            self, pars, t_start, t_end, t_N,
+            periodic_events: List[Callable] = [],
+            alg: str = "RK45", rtol: float = 1e-5, atol: float = 1e-5,
+            should_stop: Callable[[], bool] | None = None,
+            jacobian: Callable | None = None, sampling: str = "solver"
+    ) -> List[Trajectory]:
+        pars = np.array(pars)
+        n_vars, N = self.n_vars, self.N
+        N_events = len(periodic_events)
+
+        if self._vectorized is None:
+            self._vectorized = self.is_vectorizable(pars)
+
+        # Same samples as Trajectory.integrate_scipy
+        kwargs = sampling_kwargs(t_start, t_end, t_N, sampling)
+        max_step = kwargs["max_step"]
+
+        # Error of the stacked state is the RMS over all members, so error
+        # of one member could be sqrt(N) times larger than for it alone.
+        # Tighter tolerances keep the error of every member within rtol, atol.
+        scale = 1/np.sqrt(N)
+
+        sol = solve_ivp(
+            self._rhs(pars, should_stop),
+            t_span=(t_start, t_end),
+            y0=self._initial_states.reshape(-1),
+            max_step=max_step,
+            t_eval=kwargs["t_eval"],
+            method=alg, rtol=rtol*scale, atol=atol*scale,
+            events=self._member_events(periodic_events) or None,
+            **self._jac_kwargs(pars, alg, jacobian)
+        )
+
+        ys = sol.y.reshape(n_vars, N, -1)
+        t_events_all = sol.t_events if sol.t_events is not None else []
+        y_events_all = sol.y_events if sol.y_events is not None else []
+
+        # Unstack solution into per-member trajectories
+        trajectories = []
+        for k in range(N):
+            t_events = t_events_all[k*N_events:(k+1)*N_events]
+            y_events = [y_event.reshape(-1, n_vars, N)[:, :, k]
+                        for y_event in y_events_all[k*N_events:(k+1)*N_events]]
+
+            trajectory = Trajectory(self._ODEs, self._initial_states[:, k].copy())
+            trajectory.set_raw_solution(
+                t_start, t_end,
+                np.ascontiguousarray(ys[:, k, :]), sol.t.copy(),
+                y_events, t_events,
+                pars=pars, t_N=t_N, max_step=max_step,
+                alg=alg, rtol=rtol, atol=atol, jacobian=jacobian,
+                sampling=sampling, integration="ensemble")
+            trajectories.append(trajectory)
+        return trajectories
+
+
+################################################################################
+# Tests
+
+def test_ensemble_matches_single_trajectories():
+    def ODEs(U, p, t):
+        x, y = U
+        return [y, -p[0]*x]
+
+    initial_states = [[1.0, 0.0], [0.0, 1.0], [2.0, -1.0]]
+    ensemble = TrajectoryEnsemble(ODEs, initial_states)
+    trajectories = ensemble.integrate_scipy([1.0], 0.0, 5.0, 100)
+    assert ensemble.vectorized
+
+    for (initial_state, trajectory) in zip(initial_states, trajectories):
+        single = Trajectory(ODEs, np.array(initial_state))
+        single.integrate_scipy([1.0], 0.0, 5.0, 100)
+        single.process_periodic_variables()
+        trajectory.process_periodic_variables()
+        assert max(abs(single.last_state - trajectory.last_state)) < 1e-3
+
+
+def test_large_ensemble_error_per_member():
+    def pendulum(U, p, t):
+        phi, y = U
+        return [y, -p[0]*np.sin(phi)]
+
+    # Members are as accurate as single trajectories however many there are
+    initial_states = np.column_stack((np.linspace(-3.0, 3.0, 400), np.zeros(400)))
+    trajectories = TrajectoryEnsemble(pendulum, initial_states).integrate_scipy(
+        [1.0], 0.0, 20.0, 200)
+    for k in (0, 133, 266, 399):
+        single = Trajectory(pendulum, initial_states[k])
+        single.integrate_scipy([1.0], 0.0, 20.0, 200)
+        single.process_periodic_variables()
+        trajectories[k].process_periodic_variables()
+        assert max(abs(single.last_state - trajectories[k].last_state)) < 1e-2
+
+
+def test_member_events_keep_direction():
+    def ODEs(U, p, t):
+        x, y = U
+        return [y, -x]
+
+    def crossing(t, U):
+        return U[0]
+    crossing.direction = 1
+
+    # Only upward crossings of x = 0, as for a single trajectory
+    trajectories = TrajectoryEnsemble(ODEs, [[1.0, 0.0], [-1.0, 0.0]]) \
+        .integrate_scipy([], 0.0, 4*np.pi, 100, periodic_events=[crossing])
+    for trajectory in trajectories:
+        trajectory.process_periodic_variables()
+        assert len(trajectory.t_events) == 2
+        assert (trajectory.y_events[:, 1] > 0).all()
+
+
+def test_ensemble_scalar_ODEs_fallback():
+    def ODEs(U, p, t):
+        x, y = U
+        return [y, -x if x > 0 else -2*x]
+
+    ensemble = TrajectoryEnsemble(ODEs, [[1.0, 0.0], [-1.0, 0.0]])
+    trajectories = ensemble.integrate_scipy([], 0.0, 1.0, 10)
+    assert not ensemble.vectorized
+    assert len(trajectories) == 2
+
+################################################################################
+if __name__ == "__main__":
+    test_ensemble_matches_single_trajectories()
+    test_large_ensemble_error_per_member()
+    test_member_events_keep_direction()
+    test_ensemble_scalar_ODEs_fallback()
@@ -0,0 +1,99 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+from os import cpu_count
+from typing import Dict
+
+import numpy as np
+
+from backend.DSLoaderFromPy import DSLoaderFromPy
+from backend.DynamicalSystem import DynamicalSystem
+from backend.Trajectory import Trajectory
+
+
+# Dynamical systems loaded in the current worker process, by folder path
+_worker_systems: Dict[str, DynamicalSystem] = {}
+
+
+def _load_worker_system(folderpath: str) -> DynamicalSystem:
+    # ODEs are created by `exec` in DSLoaderFromPy and can not be pickled,
+    # so every worker process loads the dynamical system file by itself
+    if folderpath not in _worker_systems:
+        loader = DSLoaderFromPy(folderpath)
+        loader.load_DS()
+        loader.compile_DS()
+        ds = DynamicalSystem()
+        ds.load(loader)
+        _worker_systems[folderpath] = ds
+    return _worker_systems[folderpath]
+
+
+def _integrate_in_worker(
+        folderpath: str, initial_state: np.ndarray, pars: np.ndarray,
+        t_start, t_end, t_N, alg: str, rtol: float, atol: float,
+        sampling: str, dtype: str
+) -> Trajectory:
+    ds = _load_worker_system(folderpath)
+    trajectory = Trajectory(ds.ODEs, initial_state)
+    trajectory.integrate_scipy(pars, t_start, t_end, t_N,
+                               periodic_events=ds.periodic_events,
+                               alg=alg, rtol=rtol, atol=atol,
+                               jacobian=ds.jacobian, sampling=sampling)
+    trajectory.process_periodic_variables(ds.periodic_data, dtype)
+    return trajectory
+
+
+class TrajectoryPool():
+    def __init__(self, ds: DynamicalSystem, max_workers: int | None = None):
+        self._ds: DynamicalSystem = ds
+        self._max_workers: int = max_workers or cpu_count() or 1
+
+        # Created on first submit, spawning workers takes a while
+        self._executor: ProcessPoolExecutor | None = None
+        return
+
+    @property
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # "spawn" as forking a process with running Qt threads is unsafe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._max_workers,
+                mp_context=get_context("spawn"),
+                initializer=_load_worker_system,
+                initargs=(self._ds.folderpath,))
+        return self._executor
+
+    def submit(
+            self, initial_state, pars, t_start, t_end, t_N,
+            alg: str = "RK45", rtol: float = 1e-5, atol: float = 1e-5,
+            sampling: str = "solver", dtype: str = "float64"
+    ) -> Future:
+        """
+        Integrate and process one trajectory in a worker process.
+
+        Returns:
+            Future with integrated Trajectory, its ODEs are set back
+            to the ODEs of this process
+        """
+        future = self._get_executor().submit(
+            _integrate_in_worker,
+            self._ds.folderpath, np.array(initial_state), np.array(pars),
+            t_start, t_end, t_N, alg, rtol, atol, sampling, dtype)
+
+        # Callbacks run in order they were added,
+        # so callers already see trajectory with ODEs set back
+        def reattach_ODEs(future: Future):
+            if not future.cancelled() and future.exception() is None:
+                future.result().ODEs = self._ds.ODEs
+            return
+
+        future.add_done_callback(reattach_ODEs)
+        return future
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        return
@@ -0,0 +1,314 @@
+import json
+from contextlib import suppress
+from os import chmod, environ, makedirs, remove, scandir, utime
+from os.path import abspath, expanduser, getsize, isfile, join
+from shutil import rmtree
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+from backend.misc import atomic_write
+
+
+# Version of the metadata file of a store, see TrajectoryStore.save
+STORE_VERSION = 1
+
+
+def stores_folderpath() -> str:
+    """
+    Per-user folder for stores, e.g. of very long rows, readable and
+    writable by its owner only, so nobody else can plant or read a store.
+    """
+    cache = environ.get("XDG_CACHE_HOME") or join(expanduser("~"), ".cache")
+    folderpath = join(cache, "PhaseSpaceExplorer", "stores")
+    makedirs(folderpath, mode=0o700, exist_ok=True)
+    # Mode of makedirs is masked by umask and kept for an existing folder
+    chmod(folderpath, 0o700)
+    return folderpath
+
+
+def evict_stores(folderpath: str, max_bytes: int, keep: Sequence[str] = ()) -> int:
+    """
+    Remove least recently used stores in folderpath, until the rest take
+    at most max_bytes on disk. Stores are used when written or loaded.
+
+    Args:
+        keep: folders of stores never removed, e.g. ones in use
+
+    Returns:
+        Number of removed stores
+    """
+    keep = {abspath(store_folderpath) for store_folderpath in keep}
+    stores, n_bytes = [], 0
+    for entry in scandir(folderpath):
+        if not entry.is_dir(follow_symlinks=False):
+            continue
+        nbytes = sum(file.stat().st_size for file in scandir(entry.path)
+                     if file.is_file(follow_symlinks=False))
+        n_bytes += nbytes
+        if abspath(entry.path) not in keep:
+            stores.append((entry.stat().st_mtime, nbytes, entry.path))
+
+    n_removed = 0
+    for (_, nbytes, store_folderpath) in sorted(stores):
+        if n_bytes <= max_bytes:
+            break
+        rmtree(store_folderpath, ignore_errors=True)
+        n_bytes -= nbytes
+        n_removed += 1
+    return n_removed
+
+
+class TrajectoryStore():
+    """
+    Buffers of a Trajectory in a folder on disk, memory-mapped, so that
+    trajectories much larger than RAM can be integrated and shown.
+
+    Every buffer is a raw file of samples one after another, i.e. of shape
+    (N, *sample_shape) in C order, so that chunks of solution are appended
+    to the end of it and windows of samples are contiguous on disk.
+    Buffers are exposed with samples along the last axis, as in Trajectory.
+    Samples once written are never changed in place, arrays mapped before,
+    e.g. of copies being drawn, keep their values.
+    """
+    def __init__(self, folderpath: str):
+        self._folderpath: str = folderpath
+        makedirs(self._folderpath, mode=0o700, exist_ok=True)
+
+        # Logical length, sample shape and type, and file of every buffer
+        # by name. Files are never shrunk, arrays mapped before stay readable.
+        self._lengths: Dict[str, int] = {}
+        self._layouts: Dict[str, Tuple[Tuple[int, ...], np.dtype]] = {}
+        self._filenames: Dict[str, str] = {}
+        return
+
+    @property
+    def folderpath(self) -> str:
+        return self._folderpath
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return tuple(self._lengths)
+
+    @property
+    def nbytes(self) -> int:
+        # Bytes of samples on disk, not in RAM
+        return sum(self._lengths[name] * self._sample_nbytes(name)
+                   for name in self._lengths)
+
+    def _filepath(self, name: str) -> str:
+        return join(self._folderpath,
+                    self._filenames.setdefault(name, f"{name}.0.bin"))
+
+    def _sample_nbytes(self, name: str) -> int:
+        (sample_shape, dtype) = self._layouts[name]
+        return int(np.prod(sample_shape, dtype=int)) * dtype.itemsize
+
+    def length(self, name: str) -> int:
+        return self._lengths.get(name, 0)
+
+    def write(self, name: str, i_from: int, samples: np.ndarray) -> np.ndarray:
+        """
+        Write samples to buffer from i_from on, samples after them
+        are dropped. i_from equal to length appends to buffer.
+        Samples before the end of file are written to a copy of it.
+
+        Args:
+            samples: array with samples along the last axis
+
+        Returns:
+            The whole buffer, memory-mapped, see array
+        """
+        samples = np.asarray(samples)
+        if name not in self._layouts:
+            self._layouts[name] = (samples.shape[:-1], samples.dtype)
+        (sample_shape, dtype) = self._layouts[name]
+        if i_from > self.length(name):
+            raise IndexError(f"Buffer {name} has only {self.length(name)} samples")
+
+        n_bytes_kept = i_from * self._sample_nbytes(name)
+        if isfile(self._filepath(name)) and \
+                n_bytes_kept < getsize(self._filepath(name)):
+            self._copy_file(name, n_bytes_kept)
+
+        mode = "r+b" if isfile(self._filepath(name)) else "wb"
+        with open(self._filepath(name), mode) as f:
+            f.seek(n_bytes_kept)
+            # Samples one after another
+            np.ascontiguousarray(np.moveaxis(samples, -1, 0), dtype=dtype).tofile(f)
+        self._lengths[name] = int(i_from) + samples.shape[-1]
+        return self.array(name)
+
+    def _copy_file(self, name: str, n_bytes: int) -> None:
+        # Buffer continues in a new file with the first n_bytes of the old
+        # one. Old file is removed, mapped arrays keep it until they are
+        # released, where it can not be removed it is left to evict_stores.
+        filepath = self._filepath(name)
+        i_file = int(self._filenames[name].split(".")[1]) + 1
+        self._filenames[name] = f"{name}.{i_file}.bin"
+        with open(filepath, "rb") as f_old, open(self._filepath(name), "wb") as f:
+            remaining = n_bytes
+            while remaining > 0:
+                block = f_old.read(min(remaining, 2**24))
+                if not block:
+                    break
+                f.write(block)
+                remaining -= len(block)
+        with suppress(OSError):
+            remove(filepath)
+        return
+
+    def array(self, name: str) -> np.ndarray:
+        """
+        Buffer with samples along the last axis, read lazily from disk.
+
+        Returns:
+            Read-only memory-mapped array, empty array for empty buffer
+        """
+        (sample_shape, dtype) = self._layouts[name]
+        N = self._lengths[name]
+        if N == 0:
+            return np.empty((*sample_shape, 0), dtype=dtype)
+        array = np.memmap(self._filepath(name), dtype=dtype, mode="r",
+                          shape=(N, *sample_shape))
+        return np.moveaxis(array, 0, -1)
+
+    def is_complete(self) -> bool:
+        # Files hold every sample of every buffer
+        for name in self.names:
+            filepath = self._filepath(name)
+            if not isfile(filepath) or \
+                    getsize(filepath) < self.length(name) * self._sample_nbytes(name):
+                return False
+        return True
+
+    def _metadata_filepath(self, extension: str) -> str:
+        return join(self._folderpath, f"trajectory.{extension}")
+
+    def has_trajectory(self) -> bool:
+        return isfile(self._metadata_filepath("json"))
+
+    def save(self, trajectory) -> None:
+        """
+        Save everything but buffers of stored trajectory, they are on disk
+        already, so that it can be loaded without integrating it again.
+        Settings and buffer layouts go to a JSON file, the other arrays
+        to a npz file next to it, see Trajectory.save_state.
+        """
+        (settings, arrays) = trajectory.save_state()
+        del arrays["t_sol"], arrays["y_sols_buf"]
+        metadata = {
+            "version": STORE_VERSION,
+            "settings": settings,
+            "buffers": {name: {"filename": self._filenames[name],
+                               "length": self._lengths[name],
+                               "sample_shape": list(self._layouts[name][0]),
+                               "dtype": self._layouts[name][1].str}
+                        for name in self.names}}
+        # Metadata file is written last, it marks the store as saved
+        with atomic_write(self._metadata_filepath("npz")) as f:
+            np.savez(f, **arrays)
+        with atomic_write(self._metadata_filepath("json"), "w") as f:
+            json.dump(metadata, f)
+        return
+
+    def load(self):
+        """
+        Load trajectory saved in this folder, its buffers are mapped
+        from files of this store, see Trajectory.map_store. Trajectory
+        comes without ODEs, caller is responsible to set them.
+
+        Returns:
+            Trajectory or None if there is none or its files are incomplete
+        """
+        # Trajectory imports this module
+        from backend.Trajectory import Trajectory
+
+        if not self.has_trajectory():
+            return None
+        with open(self._metadata_filepath("json")) as f:
+            metadata = json.load(f)
+        if metadata.get("version") != STORE_VERSION:
+            return None
+        for (name, buffer) in metadata["buffers"].items():
+            self._filenames[name] = buffer["filename"]
+            self._lengths[name] = buffer["length"]
+            self._layouts[name] = (tuple(buffer["sample_shape"]),
+                                   np.dtype(buffer["dtype"]))
+        if not self.is_complete():
+            return None
+
+        # Arrays are plain numbers, nothing is unpickled
+        with np.load(self._metadata_filepath("npz"), allow_pickle=False) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+        arrays["t_sol"], arrays["y_sols_buf"] = self.array("t"), self.array("y")
+        trajectory = Trajectory(None, arrays["initial_state"])
+        trajectory.load_state(metadata["settings"], arrays)
+        trajectory.map_store(self)
+
+        # Loading counts as use, see evict_stores
+        utime(self._folderpath)
+        return trajectory
+
+
+################################################################################
+# Tests
+
+def test_trajectory_store():
+    from tempfile import TemporaryDirectory
+
+    with TemporaryDirectory() as folderpath:
+        store = TrajectoryStore(folderpath)
+        ys = np.arange(12.0).reshape(3, 4)
+        assert np.array_equal(store.write("y", 0, ys), ys)
+
+        # Append, then overwrite the tail
+        store.write("y", 4, ys[:, :2])
+        mapped = store.write("y", 5, ys)
+        assert isinstance(mapped, np.memmap)
+        assert mapped.shape == (3, 9)
+        assert np.array_equal(mapped[:, :5], np.hstack((ys, ys[:, :1])))
+        assert np.array_equal(mapped[:, 5:], ys)
+
+        # Dropping samples does not shrink the file, nor change
+        # samples mapped before
+        mapped_samples = np.array(mapped)
+        store.write("y", 1, -ys[:, :1])
+        assert mapped.shape == (3, 9) and store.array("y").shape == (3, 2)
+        assert np.array_equal(mapped, mapped_samples)
+        assert np.array_equal(store.array("y")[:, 1], -ys[:, 0])
+        assert store.nbytes == 2*3*8
+
+
+def test_stores_folder():
+    from os import listdir, stat
+    from os.path import isdir
+    from tempfile import TemporaryDirectory
+
+    with TemporaryDirectory() as cache:
+        xdg_cache_home = environ.get("XDG_CACHE_HOME")
+        environ["XDG_CACHE_HOME"] = cache
+        try:
+            folderpath = stores_folderpath()
+        finally:
+            if xdg_cache_home is None:
+                del environ["XDG_CACHE_HOME"]
+            else:
+                environ["XDG_CACHE_HOME"] = xdg_cache_home
+        assert folderpath.startswith(cache)
+        assert stat(folderpath).st_mode & 0o777 == 0o700
+
+        # Least recently used stores are evicted first, kept ones never
+        for (i, name) in enumerate(["old", "kept", "new"]):
+            store = TrajectoryStore(join(folderpath, name))
+            store.write("y", 0, np.zeros((1, 100)))
+            utime(store.folderpath, (i, i))
+        assert evict_stores(folderpath, 2*800, keep=[join(folderpath, "kept")]) == 1
+        assert sorted(listdir(folderpath)) == ["kept", "new"]
+        assert evict_stores(folderpath, 0, keep=[join(folderpath, "kept")]) == 1
+        assert listdir(folderpath) == ["kept"] and isdir(join(folderpath, "kept"))
+
+################################################################################
+if __name__ == "__main__":
+    test_trajectory_store()
+    test_stores_folder()
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+from backend.misc import batch_evaluator
+
+
+class VectorField():
+    """
+    ODEs evaluated on a grid over a view of 2D slice of phase space,
+    for vector field and nullclines.
+
+    Grid nodes are multiples of a power of 2 in every axis, so that the
+    grid depends only on the scale of the view, not on its position.
+    Grid is cut into square tiles of nodes, tiles are cached, so that
+    after pan only the newly exposed tiles are evaluated. Least recently
+    used tiles are evicted first.
+    """
+    def __init__(self, ODEs: Callable, n_vars: int, tile_size: int = 16,
+                 max_tiles: int = 512):
+        self._ODEs: Callable = ODEs
+        self._n_vars: int = n_vars
+        self._tile_size: int = tile_size
+        # Function evaluating (n_vars, N) states at once,
+        # None until the first evaluation
+        self._evaluate: Callable | None = None
+
+        # Derivatives at nodes of every tile, shape (n_vars, T, T), by key
+        self._tiles: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self._max_tiles: int = max_tiles
+
+        self._hits: int = 0
+        self._misses: int = 0
+        self._evictions: int = 0
+        return
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "tiles": len(self._tiles)}
+
+    def clear(self) -> None:
+        self._tiles.clear()
+        return
+
+    @staticmethod
+    def level(lim: Tuple[float, float], resolution: int) -> int:
+        # Node spacing is 2**level, at most resolution intervals in view
+        span = max(abs(lim[1] - lim[0]), np.finfo(float).tiny)
+        return int(np.ceil(np.log2(span / resolution)))
+
+    def field(
+        self,
+        pars,
+        x_lim: Tuple[float, float],
+        y_lim: Tuple[float, float],
+        i_x: int,
+        i_y: int,
+        base_state: np.ndarray | None = None,
+        resolution: int = 32
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Derivatives of all variables at grid nodes in the view.
+        Cost is bounded by resolution, at most (resolution+1)**2 nodes
+        are returned and at most the tiles covering them are evaluated.
+
+        Args:
+            i_x, i_y: variables along x and y axes
+            base_state: values of the other variables, zeros by default
+            resolution: number of grid intervals along each axis, at least
+
+        Returns:
+            xs and ys of nodes and derivatives, shape (n_vars, len(ys), len(xs))
+        """
+        base_state = np.zeros(self._n_vars) if base_state is None \
+            else np.array(base_state, dtype=float)
+        base_state[[i_x, i_y]] = 0.0
+        (level_x, level_y) = (self.level(x_lim, resolution),
+                              self.level(y_lim, resolution))
+        (hx, hy) = (2.0**level_x, 2.0**level_y)
+
+        # Nodes in view by integer index, i*h
+        i_xs = np.arange(np.ceil(min(x_lim)/hx), np.floor(max(x_lim)/hx) + 1)
+        i_ys = np.arange(np.ceil(min(y_lim)/hy), np.floor(max(y_lim)/hy) + 1)
+        T = self._tile_size
+        t_xs = np.arange(np.floor(i_xs[0]/T), np.floor(i_xs[-1]/T) + 1).astype(int) \
+            if len(i_xs) else np.empty(0, dtype=int)
+        t_ys = np.arange(np.floor(i_ys[0]/T), np.floor(i_ys[-1]/T) + 1).astype(int) \
+            if len(i_ys) else np.empty(0, dtype=int)
+
+        prefix = (np.asarray(pars, dtype=float).tobytes(), base_state.tobytes(),
+                  i_x, i_y, level_x, level_y)
+        missed = [(t_x, t_y) for t_y in t_ys for t_x in t_xs
+                  if prefix + (t_x, t_y) not in self._tiles]
+        self._hits += len(t_xs)*len(t_ys) - len(missed)
+        self._misses += len(missed)
+
+        # Nodes of all missing tiles are evaluated in one batch
+        if missed:
+            offsets = np.arange(T)
+            nodes_x = np.concatenate([np.tile((t_x*T + offsets)*hx, T)
+                                      for (t_x, _) in missed])
+            nodes_y = np.concatenate([np.repeat((t_y*T + offsets)*hy, T)
+                                      for (_, t_y) in missed])
+            Xs = np.repeat(base_state[:, None], len(nodes_x), axis=1)
+            Xs[i_x], Xs[i_y] = nodes_x, nodes_y
+            with np.errstate(all="ignore"):
+                if self._evaluate is None:
+                    self._evaluate = batch_evaluator(self._ODEs, Xs[:, :2], pars)
+                dXs = self._evaluate(Xs, pars)
+            dXs = dXs.reshape(self._n_vars, len(missed), T, T)
+            for (k, tile) in enumerate(missed):
+                self._tiles[prefix + tile] = dXs[:, k]
+            self._evict(keep=len(t_xs)*len(t_ys))
+
+        # Tiles are glued together and cut to the view
+        dX = np.empty((self._n_vars, len(t_ys)*T, len(t_xs)*T))
+        for (j, t_y) in enumerate(t_ys):
+            for (i, t_x) in enumerate(t_xs):
+                key = prefix + (t_x, t_y)
+                self._tiles.move_to_end(key)
+                dX[:, j*T:(j+1)*T, i*T:(i+1)*T] = self._tiles[key]
+        i_x_from = int(i_xs[0] - t_xs[0]*T) if len(i_xs) else 0
+        i_y_from = int(i_ys[0] - t_ys[0]*T) if len(i_ys) else 0
+        dX = dX[:, i_y_from:i_y_from+len(i_ys), i_x_from:i_x_from+len(i_xs)]
+        return (i_xs*hx, i_ys*hy, dX)
+
+    def _evict(self, keep: int) -> None:
+        # Tiles of the current view are kept even if they exceed the budget
+        while len(self._tiles) > max(self._max_tiles, keep):
+            self._tiles.popitem(last=False)
+            self._evictions += 1
+        return
+
+
+################################################################################
+# Tests
+
+def test_vector_field():
+    n_calls = [0]
+
+    def ODEs(U, p, t):
+        n_calls[0] += 1
+        x, y, z = U
+        return [y - p[0]*x, -x, z + 0*x]
+
+    field = VectorField(ODEs, 3, tile_size=4)
+    (xs, ys, dX) = field.field([2.0], (-1.0, 1.0), (0.0, 3.0), 0, 1,
+                               base_state=[0.0, 0.0, 5.0], resolution=8)
+    assert np.allclose(np.diff(xs), 0.25) and np.allclose(np.diff(ys), 0.5)
+    assert xs[0] == -1.0 and xs[-1] == 1.0 and ys[0] == 0.0 and ys[-1] == 3.0
+    (X, Y) = np.meshgrid(xs, ys)
+    assert np.allclose(dX[0], Y - 2.0*X) and np.allclose(dX[1], -X)
+    assert np.allclose(dX[2], 5.0)
+
+    # Pan by a few nodes evaluates only the newly exposed column of tiles
+    (n_tiles, n_misses) = (field.stats["tiles"], field.stats["misses"])
+    (xs2, _, dX2) = field.field([2.0], (0.5, 2.5), (0.0, 3.0), 0, 1,
+                                base_state=[0.0, 0.0, 5.0], resolution=8)
+    assert field.stats["misses"] - n_misses == 2
+    assert field.stats["tiles"] - n_tiles == 2
+    assert np.allclose(dX2[:, :, :3], dX[:, :, 6:])
+
+    # Other parameters are another grid, evaluated in a single call,
+    # as broadcasting of ODEs was checked by the first one
+    n_calls[0] = 0
+    field.field([1.0], (-1.0, 1.0), (0.0, 3.0), 0, 1, resolution=8)
+    assert n_calls[0] == 1
+    assert field.stats["tiles"] > n_tiles
+
+    # Scalar ODEs fall back to evaluation node by node
+    def scalar_ODEs(U, p, t):
+        return [float(U[1]), -float(np.sin(U[0]))]
+
+    (xs, ys, dX) = VectorField(scalar_ODEs, 2).field([], (0, 1), (0, 1), 0, 1,
+                                                     resolution=4)
+    assert np.allclose(dX[1], -np.sin(np.meshgrid(xs, ys)[0]))
+
+################################################################################
+if __name__ == "__main__":
+    test_vector_field()
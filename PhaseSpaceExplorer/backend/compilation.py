@@ -0,0 +1,147 @@
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _sample_arguments(N_variables: int, N_parameters: int):
+    # Arbitrary but non-trivial point to check compiled functions at
+    U = np.linspace(0.1, 0.9, N_variables)
+    p = np.linspace(0.2, 0.8, N_parameters)
+    return U, p, 0.5
+
+
+def compile_ODEs(
+    ODEs: Callable,
+    N_variables: int,
+    N_parameters: int
+) -> Tuple[Callable, str]:
+    """
+    Compile ODEs(U, p, t) with Numba if it is installed and can compile them,
+    otherwise wrap them to return numpy array instead of a list.
+
+    Args:
+        ODEs: python function from dynamical system file
+        N_variables: number of variables, length of U
+        N_parameters: number of parameters, length of p
+
+    Returns:
+        Compiled ODEs and the name of the path used: "numba", "numpy"
+        or "python" if ODEs could not be evaluated at all
+    """
+    U, p, t = _sample_arguments(N_variables, N_parameters)
+    try:
+        dU = np.asarray(ODEs(U, p, t), dtype=float)
+    except Exception:
+        return ODEs, "python"
+
+    if numba is not None:
+        try:
+            ODEs_jit = numba.njit(ODEs)
+
+            def ODEs_numba(U, p, t):
+                return np.asarray(ODEs_jit(U, p, t), dtype=float)
+
+            # Compilation happens on the first call
+            if np.allclose(ODEs_numba(U, p, t), dU, equal_nan=True):
+                ODEs_numba.__wrapped__ = ODEs
+                return ODEs_numba, "numba"
+        except Exception:
+            pass
+
+    def ODEs_numpy(U, p, t):
+        return np.asarray(ODEs(U, p, t), dtype=float)
+
+    ODEs_numpy.__wrapped__ = ODEs
+    return ODEs_numpy, "numpy"
+
+
+def compile_events(
+    events: List[Callable],
+    N_variables: int
+) -> Tuple[List[Callable], str]:
+    """
+    Compile event functions event(t, y) the same way as ODEs.
+    Attributes `terminal` and `direction` used by solve_ivp are kept.
+
+    Returns:
+        Compiled events and the name of the path used for all of them,
+        "numba" only if every event was compiled with Numba
+    """
+    U, _, t = _sample_arguments(N_variables, 0)
+
+    compiled_events, modes = [], []
+    for event in events:
+        try:
+            value = float(event(t, U))
+        except Exception:
+            compiled_events.append(event)
+            modes.append("python")
+            continue
+
+        compiled_event, mode = None, "numpy"
+        if numba is not None:
+            try:
+                event_jit = numba.njit(event)
+                if np.isclose(float(event_jit(t, U)), value, equal_nan=True):
+                    compiled_event = lambda t, y, event_jit=event_jit: \
+                        float(event_jit(t, y))
+                    mode = "numba"
+            except Exception:
+                pass
+        if compiled_event is None:
+            compiled_event = lambda t, y, event=event: float(event(t, y))
+
+        for attribute in ("terminal", "direction"):
+            if hasattr(event, attribute):
+                setattr(compiled_event, attribute, getattr(event, attribute))
+        compiled_event.__wrapped__ = event
+        compiled_events.append(compiled_event)
+        modes.append(mode)
+
+    if not modes:
+        return compiled_events, "none"
+    # Report the slowest path used
+    return compiled_events, min(modes, key=["python", "numpy", "numba"].index)
+
+
+################################################################################
+# Tests
+
+def test_compile_ODEs():
+    def ODEs(U, p, t):
+        x, y = U
+        return [p[0]*y, -x]
+
+    compiled, mode = compile_ODEs(ODEs, 2, 1)
+    assert mode in ("numba", "numpy")
+    dU = compiled(np.array([1.0, 2.0]), np.array([3.0]), 0.0)
+    assert isinstance(dU, np.ndarray)
+    assert (dU == np.array([6.0, -1.0])).all()
+
+    def broken_ODEs(U, p, t):
+        raise ValueError()
+
+    compiled, mode = compile_ODEs(broken_ODEs, 2, 1)
+    assert mode == "python"
+    assert compiled is broken_ODEs
+
+
+def test_compile_events():
+    def event(t, y):
+        return y[0] - 0.5
+    event.direction = 1
+
+    compiled, mode = compile_events([event,], 2)
+    assert mode in ("numba", "numpy")
+    assert compiled[0].direction == 1
+    assert compiled[0](0.0, np.array([1.0, 0.0])) == 0.5
+
+################################################################################
+if __name__ == "__main__":
+    test_compile_ODEs()
+    test_compile_events()
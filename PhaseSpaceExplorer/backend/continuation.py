@@ -0,0 +1,207 @@
+from typing import Callable
+
+import numpy as np
+
+from backend.Linearization import Linearization
+from backend.misc import jacobian_fd, solve
+
+
+# Kinds of points of a branch, see Branch.kinds
+REGULAR, FOLD, HOPF = 0, 1, 2
+
+
+class Branch():
+    def __init__(self, i_parameter: int, parameters: np.ndarray,
+                 states: np.ndarray, eigenvalues: np.ndarray, n_solves: int):
+        # Equilibria along the branch, in order of continuation
+        self._i_parameter: int = i_parameter
+        self._parameters: np.ndarray = parameters  # (N,)
+        self._states: np.ndarray = states  # (n_vars, N)
+        self._eigenvalues: np.ndarray = eigenvalues  # (N, n_vars)
+        self._n_solves: int = n_solves
+
+        # Bifurcations between neighbouring points are marked at the later
+        # one. A real eigenvalue crossing zero flips the sign of determinant
+        # (fold), a complex pair crossing the imaginary axis does not (Hopf).
+        n_unstable = (self._eigenvalues.real > 0).sum(axis=1)
+        det_sign = np.sign(np.prod(self._eigenvalues, axis=1).real)
+        self._kinds: np.ndarray = np.full(len(parameters), REGULAR)
+        changed = np.flatnonzero(np.diff(n_unstable) != 0) + 1
+        folds = np.diff(det_sign)[changed-1] != 0
+        self._kinds[changed[folds]] = FOLD
+        self._kinds[changed[~folds]] = HOPF
+        return
+
+    @property
+    def i_parameter(self) -> int:
+        return self._i_parameter
+
+    @property
+    def N(self) -> int:
+        return len(self._parameters)
+
+    @property
+    def parameters(self) -> np.ndarray:
+        return self._parameters
+
+    @property
+    def states(self) -> np.ndarray:
+        return self._states
+
+    @property
+    def eigenvalues(self) -> np.ndarray:
+        return self._eigenvalues
+
+    @property
+    def stable(self) -> np.ndarray:
+        return (self._eigenvalues.real < 0).all(axis=1)
+
+    @property
+    def kinds(self) -> np.ndarray:
+        # REGULAR, FOLD or HOPF for every point
+        return self._kinds
+
+    @property
+    def n_solves(self) -> int:
+        # Calls of misc.solve spent on the branch
+        return self._n_solves
+
+    @property
+    def table(self) -> np.ndarray:
+        """
+        Branch as a structured array, one record per point, e.g. to plot
+        table["x"][:, i] against table["p"] split by table["stable"].
+        """
+        n_vars = self._states.shape[0]
+        table = np.empty(self.N, dtype=[("p", float), ("x", float, (n_vars,)),
+                                        ("stable", bool), ("kind", int)])
+        table["p"] = self._parameters
+        table["x"] = self._states.T
+        table["stable"] = self.stable
+        table["kind"] = self._kinds
+        return table
+
+
+def continue_equilibrium(
+    ODEs: Callable,
+    x0: np.ndarray,
+    pars,
+    i_parameter: int,
+    p_end: float,
+    ds: float = 0.05,
+    ds_min: float = 1e-4,
+    ds_max: float = 0.5,
+    max_points: int = 500
+) -> Branch:
+    """
+    Trace equilibrium through x0 while parameter pars[i_parameter] goes
+    towards p_end, by pseudo-arclength continuation: the branch is followed
+    by its length in (x, p) space, so it is followed through folds, where
+    p turns back.
+
+    Every step predicts the next point along the secant of the last two
+    and corrects it with misc.solve started there, on the plane normal to
+    the secant. Step grows while corrections are small and is halved if
+    the corrector fails or moves the point by more than half a step.
+
+    Args:
+        x0: equilibrium or a guess close to it at pars
+        ds: initial step along the branch, ds_min and ds_max bound it
+
+    Returns:
+        Branch of points from pars[i_parameter] until p leaves the range
+        between it and p_end, or until max_points or ds_min is reached
+    """
+    pars = np.array(pars, dtype=float)
+    p_start = pars[i_parameter]
+    (p_low, p_high) = sorted((p_start, p_end))
+    direction = 1.0 if p_end >= p_start else -1.0
+
+    def F(z, _, t=0.0):
+        # ODEs of state z[:-1] with parameter set to z[-1]
+        pars_z = pars.copy()
+        pars_z[i_parameter] = z[-1]
+        return np.asarray(ODEs(z[:-1], pars_z, t), dtype=float)
+
+    (x, success) = solve(ODEs, np.asarray(x0, dtype=float), pars)
+    n_solves = 1
+    if not success:
+        raise ValueError("Could not find equilibrium to continue from")
+    zs = [np.append(x, p_start)]
+
+    # The first tangent spans the null space of [dF/dx dF/dp]
+    J = jacobian_fd(F, zs[0], None, vectorized=False)
+    tangent = np.linalg.svd(J)[2][-1]
+    tangent *= direction * np.sign(tangent[-1]) if tangent[-1] != 0 else 1.0
+
+    while len(zs) < max_points:
+        z_predicted = zs[-1] + ds*tangent
+
+        # Corrector stays on the plane through the prediction normal to tangent
+        def F_corrector(z, _, t=0.0, z_predicted=z_predicted, tangent=tangent):
+            return np.append(F(z, None), np.dot(z - z_predicted, tangent))
+
+        (z, success) = solve(F_corrector, z_predicted, None)
+        n_solves += 1
+        correction = np.linalg.norm(z - z_predicted)
+        if not success or correction > 0.5*ds:
+            if ds/2 < ds_min:
+                break
+            ds /= 2
+            continue
+
+        zs.append(z)
+        if not (p_low <= z[-1] <= p_high):
+            break
+        tangent = (zs[-1] - zs[-2]) / np.linalg.norm(zs[-1] - zs[-2])
+        if correction < 0.1*ds:
+            ds = min(1.5*ds, ds_max)
+
+    zs = np.array(zs).T
+    # Eigenvalues of all points, each with its own parameters, at once
+    pars_zs = np.repeat(pars[:, None], zs.shape[1], axis=1)
+    pars_zs[i_parameter] = zs[-1]
+    eigenvalues = Linearization(ODEs).eigen_batch(zs[:-1], pars_zs)[0]
+    return Branch(i_parameter, zs[-1], zs[:-1], eigenvalues, n_solves)
+
+
+################################################################################
+# Tests
+
+def test_continue_equilibrium_fold():
+    # Saddle-node normal form, equilibria x = ±sqrt(p) meet at p = 0
+    def ODEs(U, p, t):
+        x, y = U
+        return [p[0] - x**2, -y]
+
+    branch = continue_equilibrium(ODEs, [1.0, 0.0], [1.0], 0, -1.0)
+    # Branch turns at the fold and goes back along the other half
+    assert branch.parameters.min() < 0.01
+    assert branch.states[0, 0] > 0 and branch.states[0, -1] < 0
+    assert np.allclose(branch.states[0]**2, branch.parameters, atol=1e-6)
+    i_folds = np.flatnonzero(branch.kinds == FOLD)
+    assert len(i_folds) == 1
+    assert branch.stable[i_folds[0]-1] and not branch.stable[i_folds[0]]
+    assert branch.n_solves < 100
+
+
+def test_continue_equilibrium_hopf():
+    # Hopf normal form, focus at origin loses stability at p = 0
+    def ODEs(U, p, t):
+        x, y = U
+        r2 = x**2 + y**2
+        return [p[0]*x - y - x*r2, x + p[0]*y - y*r2]
+
+    branch = continue_equilibrium(ODEs, [0.0, 0.0], [-1.0], 0, 1.0)
+    assert branch.parameters[-1] >= 1.0
+    i_hopfs = np.flatnonzero(branch.kinds == HOPF)
+    assert len(i_hopfs) == 1
+    assert abs(branch.parameters[i_hopfs[0]]) < 0.5
+    table = branch.table
+    assert table["stable"][0] and not table["stable"][-1]
+    assert table["x"].shape == (branch.N, 2)
+
+################################################################################
+if __name__ == "__main__":
+    test_continue_equilibrium_fold()
+    test_continue_equilibrium_hopf()
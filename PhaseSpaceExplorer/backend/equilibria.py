@@ -0,0 +1,215 @@
+from typing import Callable, Dict, Sequence, Tuple
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+from scipy.stats.qmc import LatinHypercube
+
+from backend.misc import batch_evaluator, jacobians_fd
+
+
+# How starting points fill the search box, see seed_points
+SEED_METHODS = ("grid", "lhs")
+
+
+def seed_points(
+    lower: Sequence[float],
+    upper: Sequence[float],
+    N: int,
+    method: str = "grid",
+    seed: int | None = 0
+) -> np.ndarray:
+    """
+    Starting points for equilibrium search, spread over the box.
+
+    Args:
+        lower, upper: corners of the box, one value per variable
+        N: number of points, grid takes the largest full grid not above it
+        method: "grid" for a regular grid with cells centered in the box,
+            "lhs" for a Latin hypercube sample
+        seed: seed of the Latin hypercube sample
+
+    Returns:
+        Points stacked as columns, shape (n_vars, N)
+    """
+    lower, upper = np.asarray(lower, dtype=float), np.asarray(upper, dtype=float)
+    n_vars = len(lower)
+    if method == "grid":
+        n_side = max(int(np.floor(N ** (1/n_vars) + 1e-9)), 1)
+        unit = (np.arange(n_side) + 0.5) / n_side
+        unit_points = np.stack(np.meshgrid(*[unit]*n_vars, indexing="ij"))
+        unit_points = unit_points.reshape(n_vars, -1)
+    elif method == "lhs":
+        unit_points = LatinHypercube(d=n_vars, seed=seed).random(N).T
+    else:
+        raise ValueError(f"Unknown seed method: {method}")
+    return lower[:, None] + unit_points * (upper - lower)[:, None]
+
+
+def newton_batch(
+    F: Callable,
+    Xs: np.ndarray,
+    max_iter: int = 50,
+    tol: float = 1e-10
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Newton iterations from every column of Xs at once. Values and Jacobians
+    of all points are found in a single call of F, see misc.jacobians_fd.
+
+    Args:
+        F: function of (n_vars, N) array of states, see misc.batch_evaluator
+        Xs: starting points stacked as columns
+        tol: tolerance of max|F| for converged points
+
+    Returns:
+        Final points and mask of converged ones
+    """
+    Xs = np.array(Xs, dtype=float)
+    (n_vars, N) = Xs.shape
+    active = np.ones(N, dtype=bool)
+    converged = np.zeros(N, dtype=bool)
+
+    for _ in range(max_iter):
+        X = Xs[:, active]
+        if X.shape[1] == 0:
+            break
+
+        (J, Fx) = jacobians_fd(F, X, with_values=True)
+
+        # Done points leave the batch, so do ones that blew up
+        done = np.max(np.abs(Fx), axis=0) < tol
+        with np.errstate(invalid="ignore"):
+            failed = ~np.isfinite(Fx).all(axis=0) | ~np.isfinite(J).all(axis=(1, 2))
+        i_active = np.flatnonzero(active)
+        converged[i_active[done]] = True
+        active[i_active[done | failed]] = False
+
+        keep = ~(done | failed)
+        try:
+            dX = np.linalg.solve(J[keep], -Fx[:, keep].T[:, :, None])[:, :, 0].T
+        except np.linalg.LinAlgError:
+            # Some Jacobian is singular, solve point by point
+            dX = np.zeros((n_vars, keep.sum()))
+            for (k, i) in enumerate(np.flatnonzero(keep)):
+                dX[:, k] = np.linalg.lstsq(J[i], -Fx[:, i], rcond=None)[0]
+        Xs[:, i_active[keep]] += dX
+    return Xs, converged
+
+
+def unique_points(
+    Xs: np.ndarray,
+    tol: float,
+    periodic_data: Dict[int, Tuple[float, float]] = {}
+) -> np.ndarray:
+    """
+    Indexes of the first point of every cluster of points closer than tol,
+    periodic variables are compared on their period.
+
+    Args:
+        Xs: points stacked as columns, periodic variables within period
+    """
+    if Xs.shape[1] == 0:
+        return np.empty(0, dtype=int)
+
+    # KD-tree wraps periodic dims given in [0, period)
+    points = Xs.T.copy()
+    boxsize = np.zeros(Xs.shape[0])
+    for (dim, (offset, period)) in periodic_data.items():
+        points[:, dim] = (points[:, dim] - offset) % period
+        boxsize[dim] = period
+    tree = cKDTree(points, boxsize=boxsize if periodic_data else None)
+
+    # Points linked by chains of close pairs form one cluster
+    pairs = tree.query_pairs(tol, output_type="ndarray")
+    N = len(points)
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+                       shape=(N, N))
+    (_, labels) = connected_components(graph, directed=False)
+    (_, i_first) = np.unique(labels, return_index=True)
+    return np.sort(i_first)
+
+
+def find_equilibria(
+    ODEs: Callable,
+    pars,
+    lower: Sequence[float],
+    upper: Sequence[float],
+    N: int = 1000,
+    method: str = "grid",
+    periodic_data: Dict[int, Tuple[float, float]] = {},
+    tol: float = 1e-10,
+    dedup_tol: float = 1e-6
+) -> np.ndarray:
+    """
+    All equilibria found by Newton iterations from N points seeded
+    over the box, see seed_points. Unlike misc.solve, all starting
+    points are solved together in one batch.
+
+    Args:
+        tol: tolerance of max|ODEs| at equilibrium
+        dedup_tol: equilibria closer than it are the same one
+
+    Returns:
+        Distinct equilibria inside the box stacked as columns,
+        periodic variables translated to their period
+    """
+    pars = np.asarray(pars, dtype=float)
+    lower, upper = np.asarray(lower, dtype=float), np.asarray(upper, dtype=float)
+
+    Xs = seed_points(lower, upper, N, method)
+    evaluate = batch_evaluator(ODEs, Xs[:, :2], pars)
+    (Xs, converged) = newton_batch(lambda Xs: evaluate(Xs, pars), Xs, tol=tol)
+    Xs = Xs[:, converged]
+
+    for (dim, (offset, period)) in periodic_data.items():
+        Xs[dim] = (Xs[dim] - offset) % period + offset
+    # Newton may converge to points far outside of the box
+    margin = dedup_tol + 1e-9 * np.maximum(np.abs(lower), np.abs(upper))
+    inside = ((Xs >= (lower - margin)[:, None])
+              & (Xs <= (upper + margin)[:, None])).all(axis=0)
+    Xs = Xs[:, inside]
+    return Xs[:, unique_points(Xs, dedup_tol, periodic_data)]
+
+
+################################################################################
+# Tests
+
+def test_seed_points():
+    grid = seed_points([0.0, -1.0], [1.0, 1.0], 10)
+    assert grid.shape == (2, 9)
+    assert np.allclose(sorted(set(grid[0])), [1/6, 1/2, 5/6])
+    lhs = seed_points([0.0, -1.0], [1.0, 1.0], 10, method="lhs")
+    assert lhs.shape == (2, 10)
+    # Every one of N strata of every variable holds one point
+    assert (np.sort(np.floor(lhs[0]*10)) == np.arange(10)).all()
+
+
+def test_find_equilibria():
+    def lorenz(U, p, t):
+        x, y, z = U
+        sigma, r, b = p
+        return [sigma*(y-x), x*(r-z) - y, x*y - b*z]
+
+    pars = [10.0, 28.0, 8/3]
+    equilibria = find_equilibria(lorenz, pars, [-20, -20, 0], [20, 20, 40], N=512)
+    c = np.sqrt(pars[2]*(pars[1]-1))
+    expected = np.array([[0, 0, 0], [c, c, 27], [-c, -c, 27]]).T
+    assert equilibria.shape == (3, 3)
+    for x in expected.T:
+        assert np.min(np.abs(equilibria - x[:, None]).max(axis=0)) < 1e-8
+
+    # Equilibria at -pi and pi are the same one
+    def pendulum(U, p, t):
+        return [U[1], p[0] - np.sin(U[0])]
+
+    periodic_data = {0: (-np.pi, 2*np.pi)}
+    equilibria = find_equilibria(pendulum, [0.5], [-np.pi, -1], [np.pi, 1],
+                                 N=100, periodic_data=periodic_data)
+    assert equilibria.shape == (2, 2)
+    assert np.allclose(sorted(np.sin(equilibria[0])), [0.5, 0.5])
+
+################################################################################
+if __name__ == "__main__":
+    test_seed_points()
+    test_find_equilibria()
@@ -1,5 +1,19 @@
 class NotIntegratedYetException(Exception):
     """Exception raised when Trajectory is not integrated yet"""
 
-    def __init__(self, path):
+    def __init__(self):
         super().__init__("Trajectory not integrated yet")
+
+
+class IntegrationCancelledException(Exception):
+    """Exception raised when integration was stopped before it finished"""
+
+    def __init__(self):
+        super().__init__("Integration cancelled")
+
+
+class UnknownSamplingModeException(Exception):
+    """Exception raised when sampling mode is not one of SAMPLING_MODES"""
+
+    def __init__(self, sampling):
+        super().__init__(f"Unknown sampling mode: {sampling}")
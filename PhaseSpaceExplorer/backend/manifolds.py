@@ -0,0 +1,254 @@
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from backend.Linearization import Linearization
+from backend.Trajectory import Trajectory
+from backend.TrajectoryEnsemble import TrajectoryEnsemble
+from backend.misc import stack_rows
+
+
+# Stable manifolds are integrated backward in time, unstable ones forward
+MANIFOLD_KINDS = ("stable", "unstable")
+
+
+class ManifoldBranch():
+    def __init__(self, i_equilibrium: int, kind: str, i_eigenvalue: int,
+                 trajectory: Trajectory):
+        # One curve of invariant manifold of i_equilibrium-th equilibrium,
+        # starting eps away from it along i_eigenvalue-th eigenvector
+        self._i_equilibrium: int = i_equilibrium
+        self._kind: str = kind
+        self._i_eigenvalue: int = i_eigenvalue
+        self._trajectory: Trajectory = trajectory
+        return
+
+    @property
+    def i_equilibrium(self) -> int:
+        return self._i_equilibrium
+
+    @property
+    def kind(self) -> str:
+        return self._kind
+
+    @property
+    def i_eigenvalue(self) -> int:
+        return self._i_eigenvalue
+
+    @property
+    def trajectory(self) -> Trajectory:
+        return self._trajectory
+
+
+def manifold_seeds(
+    x: np.ndarray,
+    eigenvalues: np.ndarray,
+    eigenvectors: np.ndarray,
+    eps: float,
+    N_circle: int = 16,
+    tol: float = 1e-9
+) -> List[Tuple[str, int, np.ndarray]]:
+    """
+    Initial states of manifold branches of equilibrium x, eps away from it
+    along eigenvectors. Real eigenvector gives two branches, one on each
+    side. Complex pair spans a plane, its branches start on a circle in it.
+    Eigenvalues with |Re| up to tol give no branches.
+
+    Returns:
+        Kind, index of eigenvalue and initial state of every branch
+    """
+    x = np.asarray(x, dtype=float)
+    seeds = []
+    for (i, eigenvalue) in enumerate(eigenvalues):
+        if abs(eigenvalue.real) <= tol:
+            continue
+        kind = "stable" if eigenvalue.real < 0 else "unstable"
+        vector = eigenvectors[:, i]
+
+        if abs(eigenvalue.imag) <= tol:
+            direction = vector.real / np.linalg.norm(vector.real)
+            seeds.append((kind, i, x + eps*direction))
+            seeds.append((kind, i, x - eps*direction))
+        elif eigenvalue.imag > 0:
+            # Conjugate eigenvalue spans the same plane
+            (u, _) = np.linalg.qr(np.column_stack((vector.real, vector.imag)))
+            for angle in np.linspace(0, 2*np.pi, N_circle, endpoint=False):
+                direction = np.cos(angle)*u[:, 0] + np.sin(angle)*u[:, 1]
+                seeds.append((kind, i, x + eps*direction))
+    return seeds
+
+
+def bounded(ODEs: Callable, bound: float, periodic_data: Dict = {}) -> Callable:
+    """
+    ODEs that stop states leaving the box |U| <= bound, in non periodic
+    variables, so that a branch escaping to infinity does not slow down
+    integration of the whole ensemble. States are evaluated one by one
+    by ODEs, arrays of them by python ODEs wrapped by compiled ones.
+    """
+    ODEs_broadcasting = getattr(ODEs, "__wrapped__", ODEs)
+
+    def bounded_ODEs(U, p, t):
+        if np.ndim(U) == 1:
+            dU = np.asarray(ODEs(U, p, t), dtype=float)
+            return dU*0.0 if is_outside(U, bound, periodic_data) else dU
+        dU = stack_rows(ODEs_broadcasting(U, p, t), U.shape[1])
+        outside = np.abs(np.delete(U, list(periodic_data), axis=0)).max(
+            axis=0, initial=0.0) > bound
+        dU[:, outside] = 0.0
+        return dU
+    return bounded_ODEs
+
+
+def bounded_jacobian(jacobian: Callable | None, bound: float,
+                     periodic_data: Dict = {}) -> Callable | None:
+    """
+    Jacobian of bounded ODEs, zero where they stop states, see bounded.
+    States are evaluated one by one.
+    """
+    if jacobian is None:
+        return None
+
+    def bounded_jac(U, p, t):
+        J = np.asarray(jacobian(U, p, t), dtype=float)
+        return J*0.0 if is_outside(U, bound, periodic_data) else J
+    return bounded_jac
+
+
+def is_outside(U: np.ndarray, bound: float, periodic_data: Dict = {}) -> bool:
+    # Whether single state U left the box of bounded
+    return np.abs(np.delete(U, list(periodic_data))).max(initial=0.0) > bound
+
+
+def compute_manifolds(
+    ODEs: Callable,
+    equilibria: np.ndarray,
+    pars,
+    t_end: float,
+    t_N: int,
+    eps: float | Sequence[float] = 1e-5,
+    linearization: Linearization | None = None,
+    periodic_events: List[Callable] = [],
+    periodic_data: Dict[int, Tuple[float, float]] = {},
+    jacobian: Callable | None = None,
+    sampling: str = "solver",
+    dtype: str = "float64",
+    N_circle: int = 16,
+    bound: float = 1e4,
+    should_stop: Callable[[], bool] | None = None
+) -> List[ManifoldBranch]:
+    """
+    Stable and unstable manifolds of all saddles among equilibria.
+    Branches of all saddles are integrated together, unstable ones
+    in one ensemble forward to t_end, stable ones in another backward
+    to -t_end, see TrajectoryEnsemble.
+
+    Args:
+        equilibria: equilibria stacked as columns, shape (n_vars, K)
+        eps: distance of initial states from equilibrium, one for all
+            or one per equilibrium
+        linearization: eigenpairs are looked up there, if given
+        bound: branches stop once they get this far in any non periodic
+            variable, see bounded and bounded_jacobian
+
+    Returns:
+        Branches with processed trajectories, stable ones run backward in time
+    """
+    equilibria = np.asarray(equilibria, dtype=float)
+    if equilibria.ndim == 1:
+        equilibria = equilibria[:, None]
+    K = equilibria.shape[1]
+    eps = np.broadcast_to(np.asarray(eps, dtype=float), (K,))
+    if linearization is None:
+        linearization = Linearization(ODEs)
+    (eigenvalues, eigenvectors) = linearization.eigen_batch(equilibria, pars)
+
+    # Branches of saddles only, other equilibria have no separatrices
+    seeds = {kind: [] for kind in MANIFOLD_KINDS}
+    for k in range(K):
+        re = eigenvalues[k].real
+        if not ((re < 0).any() and (re > 0).any()):
+            continue
+        for (kind, i, seed) in manifold_seeds(equilibria[:, k], eigenvalues[k],
+                                              eigenvectors[k], eps[k], N_circle):
+            seeds[kind].append((k, i, seed))
+
+    ODEs_bounded = bounded(ODEs, bound, periodic_data)
+    jacobian_bounded = bounded_jacobian(jacobian, bound, periodic_data)
+    branches = []
+    for (kind, t_sign) in (("unstable", 1.0), ("stable", -1.0)):
+        if not seeds[kind]:
+            continue
+        ensemble = TrajectoryEnsemble(ODEs_bounded,
+                                      [seed for (_, _, seed) in seeds[kind]])
+        trajectories = ensemble.integrate_scipy(
+            pars, 0.0, t_sign*t_end, t_N, periodic_events=periodic_events,
+            should_stop=should_stop, jacobian=jacobian_bounded,
+            sampling=sampling)
+        for ((k, i, _), trajectory) in zip(seeds[kind], trajectories):
+            trajectory.ODEs, trajectory.jacobian = ODEs, jacobian
+            trajectory.process_periodic_variables(periodic_data, dtype)
+            branches.append(ManifoldBranch(k, kind, i, trajectory))
+    return branches
+
+
+################################################################################
+# Tests
+
+def test_manifold_seeds():
+    eigenvalues = np.array([-1.0, 2.0, 0.5+1.0j, 0.5-1.0j])
+    eigenvectors = np.eye(4, dtype=complex)
+    eigenvectors[:, 2] = [0, 0, 1, 1j]
+    eigenvectors[:, 3] = [0, 0, 1, -1j]
+    seeds = manifold_seeds(np.zeros(4), eigenvalues, eigenvectors, 0.1, N_circle=8)
+    kinds = [kind for (kind, _, _) in seeds]
+    assert kinds.count("stable") == 2 and kinds.count("unstable") == 2 + 8
+    for (_, _, seed) in seeds:
+        assert np.isclose(np.linalg.norm(seed), 0.1)
+    assert np.allclose(seeds[0][2], [0.1, 0, 0, 0])
+
+
+def test_compute_manifolds():
+    # Pendulum saddles at phi = ±pi, their separatrices connect them
+    def pendulum(U, p, t):
+        return [U[1], -np.sin(U[0])]
+
+    def energy(U):
+        return U[1]**2/2 - np.cos(U[0])
+
+    equilibria = np.array([[np.pi, 0.0], [0.0, 0.0]]).T
+    branches = compute_manifolds(pendulum, equilibria, [], 5.0, 200, eps=1e-6)
+    # Center has no separatrices, saddle has 2 stable and 2 unstable branches
+    assert [branch.i_equilibrium for branch in branches] == [0]*4
+    assert sorted(branch.kind for branch in branches) == \
+        ["stable", "stable", "unstable", "unstable"]
+    for branch in branches:
+        trajectory = branch.trajectory
+        t_end = trajectory.t_sol[-1]
+        assert t_end == (5.0 if branch.kind == "unstable" else -5.0)
+        # Separatrix lies on the energy level of the saddle
+        assert np.allclose(energy(trajectory.y_sol), 1.0, atol=1e-3)
+
+    # Escaping branches stop at bound
+    def saddle(U, p, t):
+        return [U[0], -U[1]]
+
+    branches = compute_manifolds(saddle, [[0.0], [0.0]], [], 50.0, 100,
+                                 eps=1e-3, bound=10.0)
+    assert len(branches) == 4
+    for branch in branches:
+        assert np.abs(branch.trajectory.y_sol).max() < 11.0
+
+    # Implicit solver gets Jacobian of the bounded ODEs
+    def saddle_jacobian(U, p, t):
+        return [[1.0, 0.0], [0.0, -1.0]]
+
+    jac = bounded_jacobian(saddle_jacobian, 10.0)
+    assert np.array_equal(jac(np.array([1.0, 1.0]), [], 0.0),
+                          saddle_jacobian(None, [], 0.0))
+    assert not jac(np.array([11.0, 1.0]), [], 0.0).any()
+    assert bounded_jacobian(None, 10.0) is None
+
+################################################################################
+if __name__ == "__main__":
+    test_manifold_seeds()
+    test_compute_manifolds()
@@ -1,8 +1,34 @@
+from contextlib import contextmanager, suppress
+from os import remove, replace
+
 from scipy.optimize import fsolve
 from scipy.differentiate import jacobian
 from scipy.linalg import eig
 
-from numpy import mean, array, ndarray
+from numpy import (
+    mean, array, ndarray, asarray, empty, absolute, maximum, concatenate, zeros,
+    column_stack, allclose, finfo, eye, ndim, repeat, moveaxis,
+    ascontiguousarray)
+
+
+@contextmanager
+def atomic_write(filepath: str, mode: str = "wb"):
+    """
+    File to write in place of filepath. It is written to a temporary file
+    first, which replaces filepath once it is closed, so that
+    a half-written file is never read back.
+    """
+    tmp_filepath = filepath + ".tmp"
+    try:
+        with open(tmp_filepath, mode) as f:
+            yield f
+    except BaseException:
+        # open itself may have failed before creating the file
+        with suppress(FileNotFoundError):
+            remove(tmp_filepath)
+        raise
+    replace(tmp_filepath, filepath)
+    return
 
 
 def solve(ODEs, x0, pars):
@@ -16,6 +42,152 @@ def eigenvalues_and_eigenvectors(ODEs, x0, pars):
     return (res[0], res[1])
 
 
+def stack_rows(dU, N_columns: int) -> ndarray:
+    """
+    Stack ODEs output row by row into (len(dU), N_columns) array.
+    Rows may be arrays of N_columns values or scalars (e.g. constant
+    derivative), scalars are broadcast along the row.
+    """
+    stacked = empty((len(dU), N_columns))
+    for (i, dU_i) in enumerate(dU):
+        stacked[i] = dU_i
+    return stacked
+
+
+def evaluate_columns(ODEs, Us: ndarray, pars, t: float = 0.0) -> ndarray:
+    """
+    Evaluate ODEs at every column of (n_vars, N) array of states
+    one by one, see batch_evaluator for pars.
+
+    Returns:
+        Derivatives stacked as columns
+    """
+    # Contiguous columns, as compiled ODEs are compiled for them
+    Us_T = ascontiguousarray(Us.T)
+    Ps_T = ascontiguousarray(asarray(pars, dtype=float).T) \
+        if ndim(pars) == 2 else None
+    return column_stack(
+        [asarray(ODEs(Us_T[k], pars if Ps_T is None else Ps_T[k], t),
+                 dtype=float)
+         for k in range(Us.shape[1])]).reshape(-1, Us.shape[1])
+
+
+def is_vectorizable(ODEs, Us: ndarray, pars, t: float = 0.0) -> bool:
+    """
+    Check whether ODEs can be evaluated on a (n_vars, N) array of states
+    at once, giving the same result as N separate evaluations.
+
+    Args:
+        ODEs: function ODEs(U, p, t)
+        Us: states to check ODEs at, stacked as columns
+        pars: parameter values to evaluate ODEs with, shared by all states
+            or stacked as columns, one per state
+        t: time to evaluate ODEs at
+
+    Returns:
+        True if ODEs broadcast over columns of the state array
+    """
+    try:
+        dU_vec = stack_rows(ODEs(Us, pars, t), Us.shape[1])
+    except Exception:
+        return False
+    return allclose(dU_vec, evaluate_columns(ODEs, Us, pars, t), equal_nan=True)
+
+
+def batch_evaluator(ODEs, Us: ndarray, pars, t: float = 0.0):
+    """
+    Function evaluate(Xs, pars) of ODEs at (n_vars, N) array of states
+    at once, with parameters shared by all states or stacked as columns,
+    one per state. Python ODEs wrapped by compiled ones are tried first,
+    compiled ODEs take single states and compiling them for arrays takes
+    long. If neither broadcast, states are evaluated one by one.
+
+    Args:
+        Us, pars: states and parameters to check broadcasting at,
+            see is_vectorizable, at least two states
+    """
+    # A single state might pass for an array of them
+    if Us.shape[1] < 2:
+        Us = column_stack((Us[:, 0], Us[:, 0] + 0.5))
+        if ndim(pars) == 2:
+            pars = repeat(asarray(pars)[:, :1], 2, axis=1)
+    for candidate in (getattr(ODEs, "__wrapped__", None), ODEs):
+        if candidate is not None and is_vectorizable(candidate, Us, pars, t):
+            return lambda Xs, pars, candidate=candidate: \
+                stack_rows(candidate(Xs, pars, t), Xs.shape[1])
+    return lambda Xs, pars: evaluate_columns(ODEs, Xs, pars, t)
+
+
+def jacobians_fd(F, Xs: ndarray, Ps: ndarray | None = None,
+                 with_values: bool = False):
+    """
+    Jacobians of F at every column of Xs by central finite differences.
+    Like scipy.differentiate.jacobian, all perturbed states of all columns
+    are stacked as columns and evaluated at once, here in a single call of F.
+
+    Args:
+        F: function F(Xs) of states stacked as columns, or F(Xs, Ps)
+            if Ps are given, returning values stacked as columns
+        Xs: states to calculate Jacobians at, shape (n_vars, N)
+        Ps: columns passed to F along with every perturbed state
+            of the same column of Xs, e.g. its parameters, shape (n_pars, N)
+        with_values: also evaluate F at Xs, in the same call
+
+    Returns:
+        Jacobians J[k, i, j] = dF_i / dU_j at k-th column, shape
+        (N, n_out, n_vars), and values F(Xs), shape (n_out, N), if with_values
+    """
+    (n_vars, N) = Xs.shape
+    h = finfo(float).eps**(1/3) * maximum(1.0, absolute(Xs))
+
+    # Columns with perturbations stacked as (n_vars, n_steps, N)
+    steps = [eye(n_vars)[:, :, None] * h[None, :, :],
+             -eye(n_vars)[:, :, None] * h[None, :, :]]
+    if with_values:
+        steps.insert(0, zeros((n_vars, 1, N)))
+    steps = concatenate(steps, axis=1)
+    n_steps = steps.shape[1]
+    X_steps = (Xs[:, None, :] + steps).reshape(n_vars, n_steps*N)
+    if Ps is None:
+        values = F(X_steps)
+    else:
+        P_steps = repeat(Ps[:, None, :], n_steps, axis=1).reshape(
+            Ps.shape[0], n_steps*N)
+        values = F(X_steps, P_steps)
+    values = asarray(values).reshape(-1, n_steps, N)
+
+    i_plus = 1 if with_values else 0
+    J = (values[:, i_plus:i_plus+n_vars, :]
+         - values[:, i_plus+n_vars:, :]) / (2*h[None, :, :])
+    J = moveaxis(J, -1, 0)
+    if with_values:
+        return (J, values[:, 0, :])
+    return J
+
+
+def jacobian_fd(ODEs, x0, pars, t: float = 0.0, vectorized: bool = True) -> ndarray:
+    """
+    Jacobian of ODEs by central finite differences, see jacobians_fd.
+
+    Args:
+        ODEs: function ODEs(U, p, t)
+        x0: state to calculate Jacobian at
+        pars: parameter values
+        t: time
+        vectorized: whether ODEs broadcast over columns of the state array,
+            if not, perturbed states are evaluated one by one
+
+    Returns:
+        Jacobian matrix J[i, j] = dODEs_i / dU_j
+    """
+    x0 = asarray(x0, dtype=float)
+    if vectorized:
+        F = lambda Xs: stack_rows(ODEs(Xs, pars, t), Xs.shape[1])
+    else:
+        F = lambda Xs: evaluate_columns(ODEs, Xs, pars, t)
+    return jacobians_fd(F, x0[:, None])[0]
+
+
 def translate_value_to_periodic_segment(
     value: int | float,
     offset: int | float,
@@ -37,6 +209,26 @@ def translate_value_to_periodic_segment(
     return translated_value
 
 
+def n_periods_to_periodic_segment(
+    value: int | float | ndarray,
+    offset: int | float | ndarray,
+    period: int | float | ndarray
+) -> int | float | ndarray:
+    """
+    Number of periods to subtract from value to get it into
+    periodic segment [offset, offset+period]. Works elementwise on arrays.
+
+    Args:
+        value: any real number or numpy array
+        offset: left (minimum) value of the segment, can be any real number
+        period: length of the periodic segment, must be positive
+
+    Returns:
+        Number of periods n, so that value - n*period ∈ [offset, offset+period]
+    """
+    return (value-offset) // period
+
+
 def translate_array_to_periodic_segment(
     vec: ndarray,
     offset: int | float,
@@ -54,7 +246,7 @@ def translate_array_to_periodic_segment(
         Translated vector
     """
     avg = mean(vec)
-    n_periods = (avg-offset) // period
+    n_periods = n_periods_to_periodic_segment(avg, offset, period)
     translated_vector = vec.copy() - n_periods*period
     return translated_vector
 
@@ -84,6 +276,57 @@ def test_translate_vector_to_periodic_segment():
     assert max(abs(translate_array_to_periodic_segment(
         array([8.5, 9.5, 11.5]), -5, 2) - array([-5.5, -4.5, -2.5]))) < 1e-3
 
+def test_n_periods_to_periodic_segment():
+    assert n_periods_to_periodic_segment(10, 5, 2) == 2
+    assert n_periods_to_periodic_segment(-10, 5, 2) == -8
+    n_periods = n_periods_to_periodic_segment(
+        array([[7.5, -7.5], [8.5, 0.5]]), array([[5], [-5]]), array([[2], [2]]))
+    assert (n_periods == array([[1, -7], [6, 2]])).all()
+
+def test_jacobian_fd():
+    ODEs = lambda U, p, t: [p[0]*U[0]*U[1], U[0]**2 + 1.0]
+    x0 = array([1.0, 2.0])
+    J_expected = array([[6.0, 3.0], [2.0, 0.0]])
+    for vectorized in (True, False):
+        J = jacobian_fd(ODEs, x0, array([3.0]), vectorized=vectorized)
+        assert abs(J - J_expected).max() < 1e-6
+    assert is_vectorizable(ODEs, array([[1.0, 2.0], [3.0, 4.0]]), array([3.0]))
+
+    # Columns of states with their own parameters, with values
+    Xs = array([[1.0, 2.0], [2.0, 1.0]])
+    Ps = array([[3.0, 1.0]])
+    evaluate = batch_evaluator(ODEs, Xs, Ps)
+    (J, values) = jacobians_fd(evaluate, Xs, Ps, with_values=True)
+    assert abs(J[0] - J_expected).max() < 1e-6
+    assert abs(J[1] - array([[1.0, 2.0], [4.0, 0.0]])).max() < 1e-6
+    assert abs(values - array([[6.0, 2.0], [2.0, 5.0]])).max() < 1e-9
+
+def test_atomic_write():
+    from os import listdir
+    from os.path import join
+    from tempfile import TemporaryDirectory
+
+    with TemporaryDirectory() as folderpath:
+        filepath = join(folderpath, "file.txt")
+        with atomic_write(filepath, "w") as f:
+            f.write("old")
+        # Failed write leaves the previous file as it was
+        try:
+            with atomic_write(filepath, "w") as f:
+                f.write("half")
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        with open(filepath) as f:
+            assert f.read() == "old"
+        assert listdir(folderpath) == ["file.txt"]
+        # Failing open raises its own error
+        try:
+            with atomic_write(join(folderpath, "missing", "file.txt")):
+                pass
+        except FileNotFoundError as e:
+            assert e.__context__ is None
+
 def test_flatten():
     to_flatten = [[1,2,3], [4,5]]
     flattened = flatten(to_flatten)
@@ -105,4 +348,7 @@ def test_flatten():
 if __name__ == "__main__":
     test_translate_value_to_periodic_segment()
     test_translate_vector_to_periodic_segment()
+    test_n_periods_to_periodic_segment()
+    test_jacobian_fd()
+    test_atomic_write()
     test_flatten()
\ No newline at end of file
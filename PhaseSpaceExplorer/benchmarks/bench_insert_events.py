@@ -0,0 +1,88 @@
+"""
+Benchmark of Trajectory._insert_events against the previous implementation,
+which scanned `ts` for every event and called np.insert once per event.
+
+Run from PhaseSpaceExplorer folder:
+    python -m benchmarks.bench_insert_events
+"""
+from os.path import dirname, join
+from timeit import timeit
+
+import numpy as np
+
+from backend.DSLoaderFromPy import DSLoaderFromPy
+from backend.DynamicalSystem import DynamicalSystem
+from backend.Trajectory import Trajectory
+
+
+def insert_events_reference(trajectory: Trajectory):
+    ys = trajectory._y_sol_raw.copy()
+    ts = trajectory._t_sol_raw.copy()
+    dt = trajectory._dt
+
+    # Previous implementation expects events sorted by time
+    order = np.argsort(trajectory._t_events_sorted, kind="stable")
+    for i in order:
+        state_to_insert = trajectory._y_events_sorted[i]
+        t_event = trajectory._t_events_sorted[i]
+        for (j, t) in enumerate(ts):
+            if (dt == "+") and (t >= t_event):
+                ys = np.insert(ys, j, state_to_insert, axis=1)
+                ts = np.insert(ts, j, t_event)
+                break
+            if (dt == "-") and (t <= t_event):
+                ys = np.insert(ys, j, state_to_insert, axis=1)
+                ts = np.insert(ts, j, t_event)
+                break
+    return ys, ts
+
+
+def load_pendulum() -> DynamicalSystem:
+    folderpath = join(dirname(__file__), "..", "..",
+                      "examples_DS_python", "DS_pengilum")
+    loader = DSLoaderFromPy(folderpath)
+    loader.load_DS()
+    ds = DynamicalSystem()
+    ds.load(loader)
+    return ds
+
+
+def main():
+    ds = load_pendulum()
+    pars = [1.5, 0.01]  # g > 1: pendulum keeps rotating
+
+    print(f"{'t_end':>8} {'samples':>8} {'events':>7} "
+          f"{'reference, s':>13} {'merge, s':>10} {'speedup':>8}")
+    for t_end in (100.0, 300.0, 1000.0):
+        trajectory = Trajectory(ds.ODEs, np.array([0.0, 0.0]))
+        trajectory.integrate_scipy(pars, 0.0, t_end, int(t_end*10),
+                                   periodic_events=ds.periodic_events)
+        trajectory._flatten_and_sort_events()
+        # _insert_events releases the raw solution, it is put back
+        # before every call
+        ys_raw, ts_raw = trajectory._y_sol_raw, trajectory._t_sol_raw
+
+        def insert_events():
+            trajectory._y_sol_raw, trajectory._t_sol_raw = ys_raw, ts_raw
+            trajectory._insert_events()
+            return
+
+        ys_ref, ts_ref = insert_events_reference(trajectory)
+        insert_events()
+        assert np.array_equal(ts_ref, trajectory.t_sol)
+        assert np.array_equal(ys_ref, trajectory.y_sol)
+
+        N_repeat = 3
+        trajectory._y_sol_raw, trajectory._t_sol_raw = ys_raw, ts_raw
+        time_ref = timeit(lambda: insert_events_reference(trajectory),
+                          number=N_repeat) / N_repeat
+        time_new = timeit(insert_events, number=N_repeat) / N_repeat
+
+        print(f"{t_end:>8.0f} {len(ts_raw):>8} "
+              f"{len(trajectory._t_events_sorted):>7} "
+              f"{time_ref:>13.4f} {time_new:>10.6f} {time_ref/time_new:>8.0f}")
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from numpy import sin, pi
+from numpy import sin, cos, pi
 
 variable_names = ["p1", "p2"]
 parameter_names = ["g1", "g2", "k", "d"]
@@ -28,4 +28,10 @@ def ODEs(U, p, t):
     p1, p2 = U
     g1, g2, k, d = p
     return [g1 - sin(p1) - k * sin(p2), 
-            g2 - sin(p2) - d * sin(p1)]
\ No newline at end of file
+            g2 - sin(p2) - d * sin(p1)]
+
+def jacobian(U, p, t):
+    p1, p2 = U
+    g1, g2, k, d = p
+    return [[-cos(p1), -k * cos(p2)],
+            [-d * cos(p1), -cos(p2)]]
\ No newline at end of file